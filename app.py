@@ -5,6 +5,7 @@ import tempfile
 import re
 import json
 import time
+import hashlib
 import uuid
 import psutil
 import asyncio
@@ -18,8 +19,8 @@ import subprocess
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List, Tuple
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Depends
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from tasks import repeat_every
@@ -29,6 +30,7 @@ from logger import init_logging, LOG_FILE, check_directory_permissions_async
 
 from utils import  (
     get_yt_dlp_opts,
+    get_safe_ydl_opts,
     download_m3u8,
     get_disk_space,
     clean_old_logs,
@@ -39,13 +41,28 @@ from utils import  (
     clear_logs_task,
     sanitize_filename,
     is_loom_url,
-    download_loom_video
+    download_loom_video,
+    status_reporter
 )
 import glob
 from models import DownloadStatus
 from state_storage import StateStorage, state_storage
+from sqlite_storage import SQLiteStateStorage
+from redis_storage import RedisStateStorage
 from cleanup_manager import CleanupManager
-from services.cancellation_service import CancellationService
+from job_queue import DownloadJobQueue, QueueFullError, STAGE_CPU, STAGE_NETWORK
+from ydl_worker import YdlProcessPool
+from process_runner import run_process
+from progress_bus import progress_bus, ProgressPersister, ProgressRelay, TERMINAL_STATUSES
+from progress_reporter import ProgressReporter
+from single_flight import SingleFlight, make_flight_key
+from result_cache import ResultCache
+from metadata_cache import MetadataCache, is_single_video, summarize_info
+from range_response import RangeFileResponse
+from file_index import FileIndex
+from log_cursor import LogCursors
+from quota_manager import QuotaManager, estimate_download_size
+from sse_starlette.sse import EventSourceResponse
 
 import functools
 import time
@@ -91,6 +108,40 @@ LOG_DIR = os.path.join(DOWNLOADS_DIR, 'logs')
 CLEANUP_INTERVAL_SECONDS = int(os.getenv('CLEANUP_INTERVAL_SECONDS', str(60 * 60)))  # 1 час по умолчанию
 DOWNLOAD_EXPIRY_SECONDS = int(os.getenv('DOWNLOAD_EXPIRY_SECONDS', str(24 * 60 * 60)))  # 24 часа по умолчанию
 PING_INTERVAL = 15  # 15 секунд
+DOWNLOAD_RECORD_TTL_SECONDS = int(os.getenv('DOWNLOAD_RECORD_TTL_SECONDS', str(30 * 60)))  # 30 минут без изменений
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', '60'))  # Проверка просроченных загрузок
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '3'))  # Количество одновременно выполняемых загрузок
+DOWNLOAD_QUEUE_SIZE = int(os.getenv('DOWNLOAD_QUEUE_SIZE', '100'))  # Максимум загрузок в очереди
+NETWORK_STAGE_LIMIT = int(os.getenv('NETWORK_STAGE_LIMIT', '2'))  # Одновременные скачивания
+CPU_STAGE_LIMIT = int(os.getenv('CPU_STAGE_LIMIT', '1'))  # Одновременные объединения и конвертации ffmpeg
+CANCEL_TIMEOUT = float(os.getenv('CANCEL_TIMEOUT', '10'))  # Ожидание остановки выполняющейся загрузки при отмене
+YDL_PROCESS_WORKERS = int(os.getenv('YDL_PROCESS_WORKERS', str(DOWNLOAD_WORKERS)))  # Процессы для yt-dlp
+PROGRESS_PERSIST_INTERVAL = float(os.getenv('PROGRESS_PERSIST_INTERVAL', '0.5'))  # Запись прогресса в хранилище не чаще
+PROGRESS_MIN_DELTA = float(os.getenv('PROGRESS_MIN_DELTA', '1.0'))  # Изменение прогресса (%), публикуемое сразу
+PROGRESS_MIN_INTERVAL = float(os.getenv('PROGRESS_MIN_INTERVAL', '1.0'))  # Публикация прогресса не реже, чем раз в N секунд
+SSE_MAX_RATE = float(os.getenv('SSE_MAX_RATE', '4'))  # Максимум событий SSE в секунду на клиента
+WS_TICK_INTERVAL = float(os.getenv('WS_TICK_INTERVAL', '0.5'))  # Интервал кадров WebSocket в секундах
+WS_MAX_SUBSCRIPTIONS = int(os.getenv('WS_MAX_SUBSCRIPTIONS', '500'))  # Максимум загрузок на одно соединение
+BATCH_STATUS_MAX_IDS = int(os.getenv('BATCH_STATUS_MAX_IDS', '200'))  # Максимум ID в одном запросе /api/status/batch
+LONG_POLL_MAX_WAIT = float(os.getenv('LONG_POLL_MAX_WAIT', '30'))  # Максимальное ожидание изменений по параметру wait=
+LONG_POLL_RECHECK_INTERVAL = float(os.getenv('LONG_POLL_RECHECK_INTERVAL', '1'))  # Пересчет ответа при ожидании без событий шины
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(1024 ** 3)))  # Бюджет кеша готовых файлов, 0 - отключен
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', '600'))  # Время жизни информации о видео, 0 - кеш отключен
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '256'))  # Максимум URL в кеше информации о видео
+DISK_MIN_FREE_BYTES = int(os.getenv('DISK_MIN_FREE_BYTES', str(400 * 1024 * 1024)))  # Место, которое не занимают загрузки
+DISK_RESERVE_FACTOR = float(os.getenv('DISK_RESERVE_FACTOR', '2.0'))  # Запас к ожидаемому размеру на объединение ffmpeg
+DISK_DEFAULT_ESTIMATE = int(os.getenv('DISK_DEFAULT_ESTIMATE', str(200 * 1024 * 1024)))  # Размер, если он неизвестен
+DISK_WAIT_TIMEOUT = float(os.getenv('DISK_WAIT_TIMEOUT', '600'))  # Максимальное ожидание свободного места
+
+# Хранилище состояний
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'json').lower()  # json, sqlite или redis
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')  # Адрес Redis для STATE_BACKEND=redis
+# Журнал изменений вместо полной перезаписи; при нескольких воркерах его ведет только один (см. StateStorage)
+STATE_WAL_ENABLED = os.getenv('STATE_WAL_ENABLED', 'true').lower() == 'true'
+STATE_COMPACT_INTERVAL = float(os.getenv('STATE_COMPACT_INTERVAL', '60'))  # Интервал сжатия журнала в секундах
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', '1.0'))  # Отложенная запись на диск, 0 - синхронно
+STATE_FLUSH_BATCH_SIZE = int(os.getenv('STATE_FLUSH_BATCH_SIZE', '100'))  # Досрочная запись после N изменений
+STATE_SNAPSHOT_FORMAT = os.getenv('STATE_SNAPSHOT_FORMAT', 'binary').lower()  # binary или json
 
 async def check_ffmpeg():
     """Проверка наличия FFmpeg в системе"""
@@ -153,55 +204,100 @@ class LogErrorRequest(BaseModel):
 class M3U8ValidationRequest(BaseModel):
     url: str = Field(..., description="URL для валидации")
 
+class BatchStatusRequest(BaseModel):
+    ids: List[str] = Field(..., description="ID загрузок")
+    since: Optional[float] = Field(None, description="server_time предыдущего ответа: вернуть только изменившиеся записи")
+
+    @validator("ids")
+    def validate_ids(cls, ids: List[str]) -> List[str]:
+        if len(ids) > BATCH_STATUS_MAX_IDS:
+            raise ValueError(f"Не более {BATCH_STATUS_MAX_IDS} ID в одном запросе")
+        return list(dict.fromkeys(ids))
+
 # ==================== Lifespan приложения ====================
 
+def create_storage():
+    """Создает хранилище состояний согласно STATE_BACKEND"""
+    if STATE_BACKEND == 'sqlite':
+        return SQLiteStateStorage(os.path.join(DOWNLOADS_DIR, "state.db"))
+    if STATE_BACKEND == 'redis':
+        return RedisStateStorage(REDIS_URL)
+    return StateStorage(
+        os.path.join(DOWNLOADS_DIR, "state.json"),
+        wal_enabled=STATE_WAL_ENABLED,
+        compact_interval=STATE_COMPACT_INTERVAL,
+        flush_interval=STATE_FLUSH_INTERVAL or None,
+        flush_batch_size=STATE_FLUSH_BATCH_SIZE,
+        snapshot_format=STATE_SNAPSHOT_FORMAT
+    )
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     try:
         # Инициализация хранилища
-        if not hasattr(app.state, 'storage'):
-            app.state.storage = StateStorage(os.path.join(DOWNLOADS_DIR, "state.json"))
+        # DummyStorage подставляется при импорте модуля, заменяем его настоящим хранилищем
+        if not hasattr(app.state, 'storage') or isinstance(app.state.storage, DummyStorage):
+            app.state.storage = create_storage()
         await app.state.storage.initialize()
 
+        # Прогресс загрузок из других процессов сервиса (STATE_BACKEND=redis) передается в шину
+        if hasattr(app.state.storage, 'subscribe'):
+            app.state.progress_relay = ProgressRelay(progress_bus, app.state.storage)
+            await app.state.progress_relay.start()
+
         # Инициализация utils
         await utils.init_app(app)
 
         # Создаем директорию для загрузок
         os.makedirs(DOWNLOADS_DIR, exist_ok=True)
 
-        # Проверяем наличие ffmpeg
-        await check_ffmpeg()
+        # Восстанавливаем индекс готовых файлов одним обходом директории загрузок
+        await asyncio.to_thread(file_index.rebuild)
 
-        # Запускаем очистку логов
-        cleanup_task = asyncio.create_task(periodic_log_cleanup())
+        # Загружаем индекс кеша готовых файлов
+        await result_cache.load()
 
-        # Запускаем очистку загрузок
-        downloads_cleanup_task = asyncio.create_task(periodic_downloads_cleanup_task())
+        # Проверяем наличие ffmpeg
+        await check_ffmpeg()
 
-        # Инициализируем менеджер очистки
-        app.state.cleanup_manager = CleanupManager(DOWNLOADS_DIR, LOG_DIR)
-        await app.state.cleanup_manager.start(cleanup_interval=600)  # Каждые 10 минут
+        # Запускаем воркеры очереди загрузок
+        await get_download_queue()
+
+        # Очистка файлов загрузок, записей хранилища и логов одним прогоном
+        app.state.cleanup_manager = CleanupManager(
+            DOWNLOADS_DIR,
+            LOG_DIR,
+            keep_file=result_cache.is_cached,
+            on_remove=file_index.discard_path,
+            # Последние события удаленных и просроченных записей не остаются в шине прогресса
+            on_record_remove=progress_bus.discard,
+            storage=app.state.storage,
+            record_ttl=DOWNLOAD_RECORD_TTL_SECONDS,
+            max_age=DOWNLOAD_RECORD_TTL_SECONDS,
+            before_run=trim_app_log
+        )
+        await app.state.cleanup_manager.start(cleanup_interval=EXPIRY_SWEEP_INTERVAL)
 
         yield
 
-        # Останавливаем задачи очистки
-        cleanup_task.cancel()
-        downloads_cleanup_task.cancel()
-
         # Останавливаем менеджер очистки
         if hasattr(app.state, 'cleanup_manager'):
             await app.state.cleanup_manager.stop()
 
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
+        # Останавливаем воркеры очереди загрузок и пул процессов yt-dlp
+        if getattr(app.state, 'download_queue', None) is not None:
+            await app.state.download_queue.stop()
+        if getattr(app.state, 'ydl_pool', None) is not None:
+            await app.state.ydl_pool.stop()
+        if getattr(app.state, 'progress_persister', None) is not None:
+            await app.state.progress_persister.stop()
+        if getattr(app.state, 'progress_relay', None) is not None:
+            await app.state.progress_relay.stop()
 
-        try:
-            await downloads_cleanup_task
-        except asyncio.CancelledError:
-            pass
+        # Сохраняем отложенные изменения состояния
+        if hasattr(app.state.storage, 'stop'):
+            await app.state.storage.stop()
 
     except Exception as e:
         logging.error(f"[LIFESPAN] Error in lifespan: {str(e)}", exc_info=True)
@@ -209,8 +305,6 @@ async def lifespan(app: FastAPI):
 
 # ==================== FastAPI приложение ====================
 
-from api.cancel import router as cancel_router
-
 app = FastAPI(
     title="Video Downloader",
     description="API для загрузки видео",
@@ -240,11 +334,21 @@ class DummyStorage:
         """Получает все состояния загрузок"""
         return self.data.copy()
 
+    async def get_items(self, keys: List[str]) -> Dict[str, Any]:
+        """Получает состояния загрузок по списку ключей"""
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    async def count_by_status(self) -> Dict[Optional[str], int]:
+        """Возвращает количество загрузок по статусам"""
+        counts: Dict[Optional[str], int] = {}
+        for state in self.data.values():
+            status = state.get("status") if isinstance(state, dict) else None
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
 if not hasattr(app, 'state') or not hasattr(app.state, 'storage'):
     app.state.storage = DummyStorage()
 
-app.include_router(cancel_router)
-
 # Настройка CORS
 app.add_middleware(
     CORSMiddleware,
@@ -275,65 +379,39 @@ import yt_dlp
 from yt_dlp import YoutubeDL
 from utils import *
 
-# Функция для чтения файла прогресса и обновления статуса загрузки
-async def update_progress_from_file(download_id: str, progress_file: str):
-    """Читает файл прогресса и обновляет статус загрузки"""
-    try:
-        last_progress = 0
-        last_update_time = time.time()
-        no_progress_counter = 0
-
-        # Сразу устанавливаем начальный прогресс
-        await update_download_status(download_id, "downloading", progress=1)
-        logging.info(f"[ПРОГРЕСС] Установлен начальный прогресс 1% для {download_id}")
-
-        while True:
-            try:
-                # Проверяем, существует ли файл прогресса
-                if not os.path.exists(progress_file):
-                    logging.info(f"[ПРОГРЕСС] Файл прогресса не найден, завершаем задачу")
-                    break
-
-                # Читаем текущий прогресс из файла
-                with open(progress_file, 'r') as f:
-                    progress_str = f.read().strip()
-
-                if progress_str and progress_str.isdigit():
-                    current_progress = int(progress_str)
-
-                    # Если прогресс изменился или прошло больше 1 секунды с момента последнего обновления
-                    current_time = time.time()
-                    if current_progress != last_progress or (current_time - last_update_time) > 1:
-                        logging.info(f"[ПРОГРЕСС] Обновляем прогресс: {current_progress}% для {download_id}")
-                        await update_download_status(download_id, "downloading", progress=current_progress)
-                        last_progress = current_progress
-                        last_update_time = current_time
-                        no_progress_counter = 0
-                    else:
-                        no_progress_counter += 1
-                else:
-                    logging.warning(f"[ПРОГРЕСС] Некорректный формат прогресса в файле: '{progress_str}'")
-                    no_progress_counter += 1
+# Прореживает прогресс yt-dlp перед публикацией в шину
+progress_reporter = ProgressReporter(
+    progress_bus.publish,
+    min_delta=PROGRESS_MIN_DELTA,
+    min_interval=PROGRESS_MIN_INTERVAL
+)
+status_reporter.min_delta = PROGRESS_MIN_DELTA
+status_reporter.min_interval = PROGRESS_MIN_INTERVAL
 
-                # Если прогресс достиг 100%, завершаем задачу
-                if last_progress >= 100:
-                    logging.info(f"[ПРОГРЕСС] Прогресс достиг 100%, завершаем задачу")
-                    break
+async def save_final_state(download_id: str, state: Dict[str, Any]):
+    """
+    Записывает итоговое состояние загрузки
 
-                # Ждем небольшую паузу перед следующей проверкой
-                await asyncio.sleep(0.3)  # Уменьшаем интервал проверки до 0.3 секунд
-            except Exception as e:
-                logging.error(f"[ПРОГРЕСС] Ошибка при обновлении прогресса: {str(e)}")
-                await asyncio.sleep(1)
-    except Exception as e:
-        logging.error(f"[ПРОГРЕСС] Ошибка в задаче обновления прогресса: {str(e)}")
-    finally:
-        # Удаляем файл прогресса при завершении
-        if os.path.exists(progress_file):
-            try:
-                os.remove(progress_file)
-            except:
-                pass
+    Необработанные события прогресса загрузки отбрасываются, чтобы они не
+    перезаписали итоговое состояние, а подписчики шины получают его сразу.
+    Отмененная загрузка (например, отмена пришла в другой процесс сервиса)
+    не перезаписывается результатом.
+    """
+    progress_reporter.finish(download_id)
+    persister = getattr(app.state, 'progress_persister', None)
+    if persister is not None:
+        await persister.finish(download_id)
+    if state.get("status") != DownloadStatus.CANCELLED.value:
+        current = await app.state.storage.get_item(download_id)
+        if isinstance(current, dict) and current.get("status") == DownloadStatus.CANCELLED.value:
+            logging.info(f"[DOWNLOAD] Загрузка {download_id} отменена, итоговое состояние не сохраняется")
+            return
+    if state.get("status") == "completed" and state.get("file_path"):
+        await asyncio.to_thread(file_index.add, download_id, state["file_path"])
+    await app.state.storage.update_item(download_id, state)
+    progress_bus.publish(download_id, {
+        key: value for key, value in state.items() if key in ("status", "progress", "error")
+    }, persist=False)
 
 async def process_download(download_id: str, url: str):
     """
@@ -345,6 +423,7 @@ async def process_download(download_id: str, url: str):
     """
     try:
         logging.info(f"[DOWNLOAD] Начало загрузки {url} с ID: {download_id}")
+        progress_reporter.forget(download_id)
 
         # Инициализация состояния
         await app.state.storage.update_item(download_id, {
@@ -353,6 +432,7 @@ async def process_download(download_id: str, url: str):
             "url": url,
             "updated_at": time.time()
         })
+        progress_bus.publish(download_id, {"status": "starting", "progress": 0}, persist=False)
 
         # Создаем директорию для загрузок
         os.makedirs(DOWNLOADS_DIR, exist_ok=True)
@@ -362,12 +442,38 @@ async def process_download(download_id: str, url: str):
         if is_loom:
             logging.info(f"[DOWNLOAD] Обнаружен URL Loom: {url}")
 
+        # Резервируем место на диске под ожидаемый размер файла; информация
+        # о видео затем используется загрузкой без повторного извлечения
+        info = None if is_loom else await load_video_info(url)
+
+        download_queue = getattr(app.state, 'download_queue', None)
+        waited_for_space = False
+
+        async def on_wait_for_space(required: int, available: int):
+            nonlocal waited_for_space
+            # Ожидающая места загрузка не занимает слот сетевой стадии
+            waited_for_space = True
+            if download_queue is not None:
+                download_queue.leave_stage(download_id)
+            await app.state.storage.update_item(download_id, {
+                "status": DownloadStatus.WAITING_FOR_SPACE.value,
+                "required_bytes": required,
+                "available_bytes": available,
+                "updated_at": time.time()
+            })
+            progress_bus.publish(download_id, {"status": DownloadStatus.WAITING_FOR_SPACE.value, "progress": 0}, persist=False)
+
+        await disk_quota.reserve(download_id, estimate_download_size(info), on_wait=on_wait_for_space)
+        if waited_for_space and download_queue is not None:
+            await download_queue.enter_stage(download_id, STAGE_NETWORK)
+
         # Обновляем статус на downloading перед началом загрузки
         await app.state.storage.update_item(download_id, {
             "status": "downloading",
             "progress": 0,
             "updated_at": time.time()
         })
+        progress_bus.publish(download_id, {"status": "downloading", "progress": 0}, persist=False)
 
         # Запускаем загрузку в зависимости от типа URL
         try:
@@ -376,14 +482,6 @@ async def process_download(download_id: str, url: str):
                 # Для Loom используем специальный метод загрузки
                 output_path = os.path.join(DOWNLOADS_DIR, f'sc-Replit-C1-L0-master-{download_id}.mp4')
 
-                # Создаем файл прогресса для отслеживания загрузки
-                progress_file = os.path.join(DOWNLOADS_DIR, f"{download_id}_progress.txt")
-                with open(progress_file, 'w') as f:
-                    f.write('0')
-
-                # Запускаем задачу обновления прогресса
-                asyncio.create_task(update_progress_from_file(download_id, progress_file))
-
                 # Запускаем загрузку в отдельном процессе
                 cmd = [
                     "yt-dlp",
@@ -395,6 +493,7 @@ async def process_download(download_id: str, url: str):
                     "--merge-output-format", "mp4",
                     "--retries", "10",
                     "--fragment-retries", "10",
+                    "--no-mtime",
                     "-o", output_path,
                     url
                 ]
@@ -407,61 +506,24 @@ async def process_download(download_id: str, url: str):
                 os.makedirs(log_dir, exist_ok=True)
                 log_file = os.path.join(log_dir, f"{download_id}.log")
 
-                # Запускаем процесс загрузки
-                with open(log_file, "w") as f:
-                    # Увеличиваем лимит чтения для потока stdout
-                    # Используем обычный subprocess вместо asyncio.create_subprocess_exec
-                    import subprocess
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        bufsize=1,
-                        universal_newlines=True
-                    )
+                async def handle_output_line(line: str):
+                    # Публикуем прогресс в шину, в хранилище его запишет ProgressPersister
+                    update = parse_download_line(line)
+                    if update:
+                        progress_reporter.report(download_id, "downloading", **update)
+
+                    # Проверяем завершение загрузки
+                    if "Merging formats" in line or "Writing video" in line:
+                        # Объединение выполняет ffmpeg: переходим в процессорную стадию
+                        await app.state.download_queue.enter_stage(download_id, STAGE_CPU)
+                        progress_reporter.report(download_id, "downloading", 99)
 
-                    # Читаем вывод процесса и обновляем прогресс
-                    for line in process.stdout:
-                        if not line:
-                            break
-
-                        # Теперь line уже в текстовом формате благодаря text=True
-                        f.write(line)
-                        f.flush()
-
-                        # Обновляем прогресс
-                        progress_match = re.search(r"\[download\]\s+(\d+\.\d+)%", line)
-                        if progress_match:
-                            progress = float(progress_match.group(1))
-                            # Обновляем прогресс в хранилище (асинхронно)
-                            asyncio.create_task(app.state.storage.update_item(download_id, {
-                                "status": "downloading",
-                                "progress": progress,
-                                "updated_at": time.time()
-                            }))
-                            # Также обновляем прогресс в файле
-                            with open(progress_file, 'w') as pf:
-                                pf.write(str(int(progress)))
-
-                        # Проверяем завершение загрузки
-                        if "Merging formats" in line or "Writing video" in line:
-                            # Записываем 99% прогресса
-                            with open(progress_file, 'w') as pf:
-                                pf.write("99")
-                            # Обновляем прогресс в хранилище
-                            asyncio.create_task(app.state.storage.update_item(download_id, {
-                                "status": "downloading",
-                                "progress": 99,
-                                "updated_at": time.time()
-                            }))
-
-                    # Ждем завершения процесса
-                    process.wait()
+                # Запускаем процесс загрузки: вывод читается асинхронно и пишется в лог пакетами
+                returncode = await run_process(cmd, log_file=log_file, on_line=handle_output_line)
 
                 # Проверяем результат
-                if process.returncode != 0:
-                    raise Exception(f"Ошибка при загрузке видео: код возврата {process.returncode}")
+                if returncode != 0:
+                    raise Exception(f"Ошибка при загрузке видео: код возврата {returncode}")
 
                 if not os.path.exists(output_path):
                     raise Exception("Файл не был создан после загрузки")
@@ -477,19 +539,42 @@ async def process_download(download_id: str, url: str):
                 ydl_opts = await get_yt_dlp_opts(download_id, DOWNLOADS_DIR)
                 logging.info(f"[DOWNLOAD] Опции yt-dlp: {ydl_opts}")
 
-                with YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
+                download_queue = app.state.download_queue
+
+                async def on_ydl_message(kind: str, payload: Dict[str, Any]):
+                    if kind == "progress" and payload.get("status") == "downloading":
+                        total = payload.get("total_bytes") or payload.get("total_bytes_estimate") or 0
+                        downloaded = payload.get("downloaded_bytes") or 0
+                        # Записанные байты уже заняли место на диске и не учитываются в резерве повторно
+                        disk_quota.record_written(download_id, payload.get("filename") or "", downloaded)
+                        progress = (downloaded / total * 100) if total else 0
+                        progress_reporter.report(
+                            download_id, "downloading", progress,
+                            speed=payload.get("speed"), eta=payload.get("eta")
+                        )
+                    elif kind == "postprocess":
+                        # Постобработка (объединение, конвертация) ждет слот процессорной стадии
+                        await download_queue.enter_stage(download_id, STAGE_CPU)
+
+                # yt-dlp выполняется в отдельном процессе и не блокирует цикл событий;
+                # информация, полученная при резервировании места, избавляет от повторного извлечения
+                ydl_pool = await get_ydl_pool()
+                try:
+                    video_path = await ydl_pool.download(download_id, url, ydl_opts, on_message=on_ydl_message, info=info)
+                except Exception as e:
                     if info is None:
-                        raise Exception("Не удалось получить информацию о видео")
+                        raise
+                    # Ссылки форматов могли устареть раньше срока: повторяем с полным извлечением
+                    logging.warning(f"[DOWNLOAD] Ошибка загрузки по сохраненной информации, повторное извлечение: {str(e)}")
+                    metadata_cache.discard(url)
+                    video_path = await ydl_pool.download(download_id, url, ydl_opts, on_message=on_ydl_message)
 
-                    logging.info("[DOWNLOAD] Загрузка завершена, получаем путь к файлу")
-                    # Получаем путь к файлу
-                    video_path = ydl.prepare_filename(info)
-                    if not os.path.exists(video_path):
-                        raise Exception("Файл не найден после загрузки")
+                logging.info("[DOWNLOAD] Загрузка завершена, получаем путь к файлу")
+                if not os.path.exists(video_path):
+                    raise Exception("Файл не найден после загрузки")
 
             # Обновляем состояние с путем к файлу и оригинальным именем
-            await app.state.storage.update_item(download_id, {
+            await save_final_state(download_id, {
                 "status": "completed",
                 "progress": 100,
                 "file_path": video_path,
@@ -502,7 +587,7 @@ async def process_download(download_id: str, url: str):
 
         except Exception as e:
             logging.error(f"[YDL] Error downloading video: {str(e)}")
-            await app.state.storage.update_item(download_id, {
+            await save_final_state(download_id, {
                 "status": "error",
                 "error": str(e),
                 "updated_at": time.time()
@@ -511,13 +596,230 @@ async def process_download(download_id: str, url: str):
 
     except Exception as e:
         logging.error(f"[DOWNLOAD] Error processing download: {str(e)}")
-        await app.state.storage.update_item(download_id, {
+        await save_final_state(download_id, {
             "status": "error",
             "error": str(e),
             "updated_at": time.time()
         })
         raise
 
+# Выполняющиеся загрузки по ключу запроса (URL, формат, качество)
+download_flights = SingleFlight()
+
+# Поля итогового состояния, которые получают присоединенные запросы
+FLIGHT_RESULT_FIELDS = ("status", "progress", "error", "file_path", "original_filename", "service_type")
+
+# Готовые файлы по ID загрузки вместо перебора директории загрузок
+file_index = FileIndex(DOWNLOADS_DIR)
+
+# Позиции чтения логов загрузок для определения зависших загрузок
+log_cursors = LogCursors()
+
+# Готовые файлы по ключу запроса; файлы кеша не удаляются очисткой по возрасту
+result_cache = ResultCache(
+    RESULT_CACHE_MAX_BYTES, os.path.join(DOWNLOADS_DIR, "result_cache.json"), on_remove=file_index.discard_path
+)
+
+async def run_download(download_id: str, url: str):
+    """Выполняет загрузку из очереди и передает ее результат присоединенным запросам"""
+    try:
+        await process_download(download_id, url)
+    except asyncio.CancelledError:
+        # Загрузка прервана отменой (DownloadJobQueue.abort); ошибка записи статуса не заменяет отмену
+        try:
+            await asyncio.shield(save_final_state(download_id, {
+                "status": DownloadStatus.CANCELLED.value,
+                "progress": 0,
+                "error": "Загрузка отменена пользователем",
+                "updated_at": time.time()
+            }))
+        except Exception as e:
+            logging.error(f"[DOWNLOAD] Не удалось сохранить отмену загрузки {download_id}: {str(e)}")
+        raise
+    finally:
+        disk_quota.release(download_id)
+        await finish_flight(download_id)
+
+async def finish_flight(download_id: str):
+    """
+    Снимает загрузку с регистрации, добавляет готовый файл в кеш результатов
+    и копирует итоговое состояние в псевдонимы загрузки
+    """
+    flight_key = download_flights.get_key(download_id)
+    abandoned = download_flights.is_abandoned(download_id)
+    aliases = download_flights.complete(download_id)
+    state = await app.state.storage.get_item(download_id) or {}
+    completed = state.get("status") == "completed" and state.get("file_path")
+
+    # Загрузка, отмененная ее запросом, передает результат первому присоединенному запросу
+    owner_id = download_id
+    if abandoned:
+        await app.state.storage.update_item(download_id, {
+            "status": DownloadStatus.CANCELLED.value,
+            "progress": 0,
+            "error": "Загрузка отменена пользователем",
+            "file_path": None,
+            "updated_at": time.time()
+        })
+        file_index.discard(download_id)
+        if aliases:
+            owner_id = aliases.pop(0)
+            if completed:
+                await asyncio.to_thread(file_index.add, owner_id, state["file_path"])
+
+    # Файл загрузки, которую никто не ждет, не попадает в кеш: его запись отменена
+    if flight_key and completed and not (abandoned and owner_id == download_id):
+        await result_cache.put(flight_key, state["file_path"], {
+            "download_id": owner_id,
+            "original_filename": state.get("original_filename"),
+            "service_type": state.get("service_type")
+        })
+
+    result = {field: state[field] for field in FLIGHT_RESULT_FIELDS if field in state}
+    if owner_id != download_id:
+        await app.state.storage.update_item(owner_id, {**result, "alias_of": None, "updated_at": time.time()})
+        logging.info(f"[DOWNLOAD] Результат отмененной загрузки {download_id} передан запросу {owner_id}")
+    if not aliases:
+        return
+    for alias_id in aliases:
+        await app.state.storage.update_item(alias_id, {**result, "alias_of": owner_id, "updated_at": time.time()})
+    logging.info(f"[DOWNLOAD] Результат {download_id} передан присоединенным запросам: {len(aliases)}")
+
+async def resolve_download(download_id: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Находит загрузку, к которой присоединен запрос
+
+    Returns:
+        Tuple[str, Optional[Dict[str, Any]]]: ID и состояние основной загрузки;
+            для обычной загрузки или псевдонима без основной записи - собственные
+    """
+    state = await app.state.storage.get_item(download_id)
+    primary_id = state.get("alias_of") if isinstance(state, dict) else None
+    if primary_id:
+        primary = await app.state.storage.get_item(primary_id)
+        if primary:
+            return primary_id, primary
+    return download_id, state
+
+# Информация о видео по URL для /api/info и загрузок без повторного извлечения
+metadata_cache = MetadataCache(ttl=METADATA_CACHE_TTL, max_entries=METADATA_CACHE_SIZE)
+
+async def extract_video_info(url: str) -> Dict[str, Any]:
+    """Извлекает информацию о видео через пул процессов yt-dlp"""
+    ydl_opts = await get_safe_ydl_opts(os.path.join(DOWNLOADS_DIR, '%(title)s.%(ext)s'), None)
+    ydl_pool = await get_ydl_pool()
+    return await ydl_pool.extract_info(f"info-{uuid.uuid4()}", url, ydl_opts)
+
+async def load_video_info(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Информация о видео из кеша или извлеченная заново; None, если ее получить
+    не удалось или URL ведет не на отдельное видео (плейлист и ссылки
+    загружаются с полным извлечением)
+    """
+    try:
+        info, _ = await metadata_cache.get_or_load(url, lambda: extract_video_info(url))
+    except Exception as e:
+        logging.warning(f"[DOWNLOAD] Не удалось заранее получить информацию о {url}: {str(e)}")
+        return None
+    if not is_single_video(info):
+        logging.info(f"[DOWNLOAD] {url} ведет не на отдельное видео ({info.get('_type')}), загрузка с полным извлечением")
+        return None
+    return info
+
+async def on_quota_evict(download_id: str, file_path: str):
+    """Отмечает загрузку и присоединенные к ней запросы, файл которых удален ради места на диске"""
+    await result_cache.discard_file(file_path)
+    storage = app.state.storage
+    expired_ids = [download_id] if await storage.get_item(download_id) else []
+    # Запросы, получившие файл из кеша или от общей загрузки, ссылаются на тот же файл
+    if hasattr(storage, "get_items_by_status"):
+        completed = await storage.get_items_by_status(DownloadStatus.COMPLETED.value)
+        expired_ids.extend(
+            key for key, state in completed.items()
+            if key != download_id and (state.get("alias_of") == download_id or state.get("file_path") == file_path)
+        )
+    for key in expired_ids:
+        await storage.update_item(key, {
+            "status": DownloadStatus.EXPIRED.value,
+            "updated_at": time.time()
+        })
+        # Последнее событие шины иначе продолжало бы отдавать статус completed
+        progress_bus.publish(key, {"status": DownloadStatus.EXPIRED.value}, persist=False)
+
+# Файлы, которые сейчас отдаются клиентам, и число их одновременных отдач
+serving_files: Dict[str, int] = {}
+
+def is_file_serving(file_path: str) -> bool:
+    """Отдается ли файл клиенту (такой файл не удаляется ради места)"""
+    return os.path.abspath(file_path) in serving_files
+
+class ServedFileResponse(RangeFileResponse):
+    """Ответ с файлом загрузки, который на время отдачи защищен от вытеснения квотой"""
+
+    async def __call__(self, scope, receive, send):
+        path = os.path.abspath(self.path)
+        serving_files[path] = serving_files.get(path, 0) + 1
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            serving_files[path] -= 1
+            if not serving_files[path]:
+                del serving_files[path]
+
+# Место на диске под выполняющиеся загрузки; не хватает места - удаляются давно использованные файлы
+disk_quota = QuotaManager(
+    DOWNLOADS_DIR,
+    get_disk_space,
+    file_index,
+    min_free_bytes=DISK_MIN_FREE_BYTES,
+    reserve_factor=DISK_RESERVE_FACTOR,
+    default_estimate=DISK_DEFAULT_ESTIMATE,
+    wait_timeout=DISK_WAIT_TIMEOUT,
+    protect=is_file_serving,
+    on_evict=on_quota_evict
+)
+
+async def get_ydl_pool() -> YdlProcessPool:
+    """Возвращает пул процессов yt-dlp, запуская его при первом обращении"""
+    ydl_pool = getattr(app.state, 'ydl_pool', None)
+    if ydl_pool is None:
+        ydl_pool = YdlProcessPool(max_workers=YDL_PROCESS_WORKERS)
+        app.state.ydl_pool = ydl_pool
+    if not ydl_pool.running:
+        await ydl_pool.start()
+    return ydl_pool
+
+async def start_progress_persister() -> ProgressPersister:
+    """Запускает запись событий шины прогресса в хранилище"""
+    persister = getattr(app.state, 'progress_persister', None)
+    if persister is None or persister.storage is not app.state.storage:
+        if persister is not None:
+            await persister.stop()
+        persister = ProgressPersister(progress_bus, app.state.storage, interval=PROGRESS_PERSIST_INTERVAL)
+        app.state.progress_persister = persister
+    if not persister.running:
+        await persister.start()
+    return persister
+
+async def get_download_queue() -> DownloadJobQueue:
+    """Возвращает очередь загрузок приложения, запуская ее при первом обращении"""
+    # Прогресс загрузок пишется в хранилище через шину
+    await start_progress_persister()
+
+    download_queue = getattr(app.state, 'download_queue', None)
+    if download_queue is None:
+        download_queue = DownloadJobQueue(
+            run_download,
+            workers=DOWNLOAD_WORKERS,
+            max_pending=DOWNLOAD_QUEUE_SIZE,
+            network_limit=NETWORK_STAGE_LIMIT,
+            cpu_limit=CPU_STAGE_LIMIT
+        )
+        app.state.download_queue = download_queue
+    if not download_queue.running:
+        await download_queue.start()
+    return download_queue
+
 # ==================== Эндпоинт для скачивания файла ====================
 
 @app.get("/api/download/{download_id}")
@@ -525,8 +827,8 @@ async def process_download(download_id: str, url: str):
 async def download_file(download_id: str, request: Request):
     """Скачивание готового файла"""
     try:
-        # Получаем информацию о загрузке
-        download_info = await app.state.storage.get_item(download_id)
+        # Получаем информацию о загрузке (для присоединенного запроса - об общей загрузке)
+        source_id, download_info = await resolve_download(download_id)
         if not download_info:
             raise HTTPException(status_code=404, detail="Download not found")
 
@@ -539,6 +841,9 @@ async def download_file(download_id: str, request: Request):
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
 
+        # Давно не скачиваемые файлы удаляются первыми при нехватке места
+        file_index.touch(source_id)
+
         # Получаем имя файла из пути
         filename = os.path.basename(file_path)
 
@@ -549,20 +854,11 @@ async def download_file(download_id: str, request: Request):
         # Устанавливаем заголовки для скачивания
         headers = {
             "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}",
-            "Access-Control-Expose-Headers": "Content-Disposition"
+            "Access-Control-Expose-Headers": "Content-Disposition, Content-Range, Accept-Ranges"
         }
 
-        # Возвращаем файл через StreamingResponse
-        async def file_iterator():
-            async with aiofiles.open(file_path, mode="rb") as file:
-                while chunk := await file.read(8192):
-                    yield chunk
-
-        return StreamingResponse(
-            file_iterator(),
-            media_type="application/octet-stream",
-            headers=headers
-        )
+        # Файл отдается с поддержкой Range: докачка и перемотка не начинают передачу заново
+        return RangeFileResponse(file_path, media_type="application/octet-stream", headers=headers)
 
     except HTTPException:
         raise
@@ -572,9 +868,6 @@ async def download_file(download_id: str, request: Request):
 
 # ==================== Эндпоинт для отмены загрузки ====================
 
-# Глобальный словарь для хранения активных загрузок
-active_downloads = {}
-
 @app.post('/api/cancel/{download_id}')
 async def cancel_download(download_id: str):
     """
@@ -586,17 +879,55 @@ async def cancel_download(download_id: str):
     Returns:
         dict: Результат отмены
     """
-    # Проверяем существование загрузки
-    state = await app.state.storage.get_item(f"download_{download_id}")
+    # Проверяем существование загрузки (записи старого формата хранятся с префиксом download_)
+    state = await app.state.storage.get_item(download_id) or await app.state.storage.get_item(f"download_{download_id}")
     if not state:
         raise HTTPException(status_code=404, detail="Загрузка не найдена")
 
-    # Отменяем загрузку
-    if download_id in active_downloads:
-        active_downloads[download_id].cancel()
-        del active_downloads[download_id]
+    # Присоединенный запрос отсоединяется, общая загрузка продолжается для остальных
+    primary_id = download_flights.get_primary(download_id)
+    if primary_id is not None:
+        download_flights.detach(download_id)
+        await app.state.storage.update_item(download_id, {"alias_of": None})
+        await update_download_status(
+            download_id=download_id,
+            status=DownloadStatus.CANCELLED,
+            progress=0,
+            error="Загрузка отменена пользователем"
+        )
+        # Загрузку, отмененную ее запросом, больше никто не ждет
+        if download_flights.is_abandoned(primary_id) and not download_flights.has_aliases(primary_id):
+            await stop_download(primary_id)
+        return {"status": "success", "message": "Загрузка отменена"}
 
-    # Обновляем статус
+    # Основная загрузка с присоединенными запросами продолжается для них, ее запись отменяется при завершении
+    if download_flights.abandon(download_id):
+        logging.info(f"[DOWNLOAD] Загрузка {download_id} отменена, продолжается для присоединенных запросов")
+        return {"status": "success", "message": "Загрузка отменена"}
+
+    await stop_download(download_id)
+    return {"status": "success", "message": "Загрузка отменена"}
+
+async def stop_download(download_id: str):
+    """Останавливает загрузку и отмечает ее отмененной"""
+    download_queue = getattr(app.state, 'download_queue', None)
+    # Загрузка, отмененная до начала выполнения, не передаст результат сама
+    if download_queue is not None and download_queue.cancel(download_id):
+        await update_download_status(
+            download_id=download_id,
+            status=DownloadStatus.CANCELLED,
+            progress=0,
+            error="Загрузка отменена пользователем"
+        )
+        await finish_flight(download_id)
+        return
+    # Выполняющаяся загрузка прерывается, статус cancelled записывает run_download
+    if download_queue is not None and download_queue.is_running(download_id):
+        if not await download_queue.abort(download_id, timeout=CANCEL_TIMEOUT):
+            raise HTTPException(status_code=409, detail="Загрузка не остановилась, повторите отмену позже")
+        return
+
+    # Загрузка не выполняется в этом процессе: отметка cancelled не перезаписывается ее результатом
     await update_download_status(
         download_id=download_id,
         status=DownloadStatus.CANCELLED,
@@ -604,13 +935,6 @@ async def cancel_download(download_id: str):
         error="Загрузка отменена пользователем"
     )
 
-    return {"status": "success", "message": "Загрузка отменена"}
-
-@app.post('/api/cancel/<operation_id>')
-async def cancel_operation(operation_id: str):
-    cancellation_service = CancellationService(app.state.storage)
-    return await cancellation_service.cancel_operation(operation_id)
-
 # ==================== Эндпоинт для health check ====================
 
 @app.get("/health")
@@ -665,7 +989,7 @@ async def health():
 
         # Проверяем свободное место на диске
         total_space, free_space = await get_disk_space(DOWNLOADS_DIR)
-        min_required_space = 400 * 1024 * 1024  # 400 MB
+        min_required_space = DISK_MIN_FREE_BYTES
 
         if free_space < min_required_space:
             return JSONResponse(
@@ -682,7 +1006,8 @@ async def health():
             "disk_space": {
                 "total": total_space,
                 "free": free_space,
-                "free_mb": free_space / 1024 / 1024
+                "free_mb": free_space / 1024 / 1024,
+                "reserved": disk_quota.reserved_bytes
             }
         }
 
@@ -698,88 +1023,9 @@ async def health():
 
 # ==================== Очистка логов ====================
 
-async def periodic_log_cleanup():
-    """Периодическая очистка логов"""
-    while True:
-        try:
-            log_path = os.path.join(LOG_DIR, LOG_FILE)
-            await utils.clean_old_logs(log_path)
-            await asyncio.sleep(600)  # Очистка каждые 10 минут
-        except Exception as e:
-            logging.error(f"[CLEANUP] Ошибка при очистке логов: {str(e)}", exc_info=True)
-            await asyncio.sleep(60)  # При ошибке ждем 1 минуту
-
-# ==================== Очистка загрузок ====================
-
-async def cleanup_downloads(downloads_dir: str, max_age_hours: float = 0.5):  # 30 минут по умолчанию
-    """Асинхронная очистка старых загрузок"""
-    try:
-        # Очищаем старые загрузки через StateStorage
-        await app.state.storage.cleanup_old_downloads()
-
-        # Очищаем файлы на диске через CleanupManager
-        await app.state.cleanup_manager.cleanup_downloads(max_age_hours)
-        logging.info(f"[CLEANUP] Запущена очистка файлов старше {max_age_hours * 60:.0f} минут")
-
-    except Exception as e:
-        logging.error(f"[CLEANUP] Ошибка при очистке: {str(e)}")
-
-# Запуск периодической очистки загрузок происходит в lifespan
-
-async def periodic_downloads_cleanup_task():
-    """Задача периодической очистки загрузок"""
-    while True:
-        try:
-            await periodic_downloads_cleanup()
-            await asyncio.sleep(600)  # Каждые 10 минут
-        except Exception as e:
-            logging.error(f"[CLEANUP] Ошибка в задаче периодической очистки: {str(e)}")
-            await asyncio.sleep(60)  # При ошибке ждем 1 минуту
-
-async def periodic_downloads_cleanup():
-    """Периодическая очистка загрузок"""
-    try:
-        # Получаем все загрузки
-        downloads = await app.state.storage.get_all_items()
-
-        # Проверяем каждую загрузку
-        for download_id, state in downloads.items():
-            if not download_id.startswith("download_"):
-                continue
-
-            try:
-                # Проверяем время создания
-                created_at = state.get("created_at", "")
-                if isinstance(created_at, str) and created_at:
-                    try:
-                        created_at = datetime.fromisoformat(created_at)
-                    except ValueError:
-                        # Если формат даты неверный, используем timestamp
-                        created_at = datetime.fromtimestamp(float(state.get("updated_at", time.time())))
-                else:
-                    # Если created_at не строка или пустая строка, используем timestamp
-                    created_at = datetime.fromtimestamp(float(state.get("updated_at", time.time())))
-
-                age_minutes = (datetime.now() - created_at).total_seconds() / 60
-
-                # Если загрузка старше 30 минут
-                if age_minutes > 30:
-                    # Удаляем файл если он существует
-                    file_path = state.get("file_path")
-                    if file_path and os.path.exists(file_path):
-                        os.remove(file_path)
-                        logging.info(f"[CLEANUP] Удален файл {file_path} (возраст: {age_minutes:.1f} минут)")
-
-                    # Удаляем состояние
-                    await app.state.storage.delete_item(download_id)
-                    logging.info(f"[CLEANUP] Удалена запись о загрузке {download_id} (возраст: {age_minutes:.1f} минут)")
-
-            except Exception as e:
-                logging.error(f"[CLEANUP] Error processing download {download_id}: {str(e)}")
-                continue
-
-    except Exception as e:
-        logging.error(f"[CLEANUP] Error: {str(e)}")
+async def trim_app_log():
+    """Обрезает лог приложения (вызывается перед каждым прогоном очистки)"""
+    await utils.clean_old_logs(os.path.join(LOG_DIR, LOG_FILE))
 
 # ==================== Удаление файла по расписанию ====================
 
@@ -799,14 +1045,12 @@ async def delete_file_after_delay(file_path: str, delay: int):
 async def metrics():
     """Метрики для мониторинга"""
     try:
-        # Получаем все загрузки
-        downloads = await app.state.storage.get_all_items()
-
-        # Считаем метрики
-        total_downloads = len(downloads)
-        active_downloads = sum(1 for d in downloads.values() if d.get("status") == DownloadStatus.DOWNLOADING)
-        completed_downloads = sum(1 for d in downloads.values() if d.get("status") == DownloadStatus.COMPLETED)
-        failed_downloads = sum(1 for d in downloads.values() if d.get("status") == DownloadStatus.ERROR)
+        # Считаем метрики по счетчикам хранилища, без обхода всех записей
+        counts = await app.state.storage.count_by_status()
+        total_downloads = sum(counts.values())
+        active_downloads = counts.get(DownloadStatus.DOWNLOADING.value, 0)
+        completed_downloads = counts.get(DownloadStatus.COMPLETED.value, 0)
+        failed_downloads = counts.get(DownloadStatus.ERROR.value, 0)
 
         # Получаем информацию о диске
         total_space, free_space = await get_disk_space(DOWNLOADS_DIR)
@@ -819,7 +1063,21 @@ async def metrics():
                 "total": total_downloads,
                 "active": active_downloads,
                 "completed": completed_downloads,
-                "failed": failed_downloads
+                "failed": failed_downloads,
+                "by_status": {status: count for status, count in counts.items() if status is not None}
+            },
+            "queue": app.state.download_queue.stats() if getattr(app.state, 'download_queue', None) else None,
+            "progress_bus": progress_bus.stats(),
+            "single_flight": download_flights.stats(),
+            "result_cache": result_cache.stats(),
+            "metadata_cache": metadata_cache.stats(),
+            "file_index": file_index.stats(),
+            "log_cursors": log_cursors.stats(),
+            "disk_quota": disk_quota.stats(),
+            "cleanup": app.state.cleanup_manager.stats() if getattr(app.state, 'cleanup_manager', None) else None,
+            "progress_reporter": {
+                "bus": progress_reporter.stats(),
+                "status": status_reporter.stats()
             },
             "disk": {
                 "total_mb": total_space / (1024 * 1024),
@@ -868,12 +1126,104 @@ async def log_error(request: LogErrorRequest):
         logging.error(f"[ERROR] Failed to log error: {str(e)}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+def make_etag(version: int, body: Dict[str, Any]) -> str:
+    """
+    ETag ответа о состоянии загрузки: версия загрузки в шине и хеш содержимого
+
+    Версия меняется с каждым событием прогресса, хеш - при изменениях без
+    событий шины (позиция в очереди, индекс готовых файлов, запись в хранилище).
+    """
+    digest = hashlib.blake2b(json.dumps(body, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+    return f'"{version}-{digest}"'
+
+async def conditional_state_response(
+    download_id: str,
+    build: Callable[[], Awaitable[Dict[str, Any]]],
+    response: Response,
+    if_none_match: Optional[str],
+    wait: float
+):
+    """
+    Отвечает на условный запрос состояния загрузки
+
+    ETag состоит из версии загрузки в шине прогресса и хеша содержимого
+    ответа (см. make_etag). Если ETag клиента совпадает и задан wait, запрос
+    ждет следующего события загрузки в шине (wait_for_version) и отвечает
+    сразу после него. Позиция в очереди и индекс файлов меняются без событий
+    шины, поэтому ответ также пересчитывается не реже раза в
+    LONG_POLL_RECHECK_INTERVAL секунд, но ожидание не длится дольше
+    LONG_POLL_MAX_WAIT секунд.
+
+    Args:
+        download_id: ID загрузки
+        build: Корутина, формирующая тело ответа
+        response: Ответ, в который добавляются заголовки
+        if_none_match: Заголовок If-None-Match
+        wait: Время ожидания изменений в секундах
+
+    Returns:
+        Тело ответа или ответ 304, если состояние не изменилось
+    """
+    client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")} if if_none_match else set()
+    deadline = time.monotonic() + min(max(wait, 0), LONG_POLL_MAX_WAIT)
+    while True:
+        # Версия читается до формирования ответа, чтобы не пропустить событие между ними
+        version = progress_bus.get_version(download_id)
+        body = await build()
+        etag = make_etag(version, body)
+        if etag not in client_etags:
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            return body
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        await progress_bus.wait_for_version(download_id, version, min(remaining, LONG_POLL_RECHECK_INTERVAL))
+
+async def progress_body(source_id: str, download_id: str) -> Dict[str, Any]:
+    """Тело ответа /api/progress"""
+    logging.debug(f"[PROGRESS] Поиск состояния для ID: {source_id}")
+
+    state = await app.state.storage.get_item(source_id)
+
+    if not state:
+        logging.warning(f"[PROGRESS] Состояние не найдено для ID: {download_id}")
+        raise HTTPException(status_code=404, detail="Download not found")
+
+    # Прогресс из шины свежее записанного в хранилище
+    last_event = progress_bus.get_last(source_id)
+    if last_event and last_event["updated_at"] >= (state.get("updated_at") or 0):
+        state = {**state, **last_event}
+
+    logging.debug(f"[PROGRESS] Найдено состояние: {state}")
+
+    # Формируем ответ
+    return {
+        "status": state.get("status", "unknown"),
+        "progress": state.get("progress", 0),
+        "error": state.get("error"),
+        "log": state.get("log"),
+        "queue_position": get_queue_position(source_id)
+    }
+
 @app.get("/api/progress/{download_id}")
 @measure_time()
-async def get_progress(download_id: str):
-    """Получение прогресса загрузки"""
+async def get_progress(
+    download_id: str,
+    response: Response,
+    wait: float = 0,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Получение прогресса загрузки
+
+    Ответ содержит ETag по содержимому. С заголовком If-None-Match и
+    параметром wait запрос ждет изменения состояния и возвращает 304, если
+    оно не изменилось за время ожидания.
+    """
     try:
-        logging.info(f"[PROGRESS] Получение прогресса для ID: {download_id}")
+        logging.debug(f"[PROGRESS] Получение прогресса для ID: {download_id}")
 
         # Проверяем инициализацию хранилища
         if not hasattr(app.state, 'storage'):
@@ -888,23 +1238,12 @@ async def get_progress(download_id: str):
                 logging.error(f"[PROGRESS] Ошибка инициализации storage: {str(e)}")
                 raise HTTPException(status_code=500, detail="Failed to initialize storage")
 
-        logging.info(f"[PROGRESS] Поиск состояния для ID: {download_id}")
-
-        state = await app.state.storage.get_item(download_id)
-
-        if not state:
-            logging.warning(f"[PROGRESS] Состояние не найдено для ID: {download_id}")
-            raise HTTPException(status_code=404, detail="Download not found")
+        # Присоединенный запрос показывает прогресс общей загрузки
+        source_id, _ = await resolve_download(download_id)
 
-        logging.info(f"[PROGRESS] Найдено состояние: {state}")
-
-        # Формируем ответ
-        return {
-            "status": state.get("status", "unknown"),
-            "progress": state.get("progress", 0),
-            "error": state.get("error"),
-            "log": state.get("log")
-        }
+        return await conditional_state_response(
+            source_id, lambda: progress_body(source_id, download_id), response, if_none_match, wait
+        )
 
     except HTTPException:
         raise
@@ -912,8 +1251,162 @@ async def get_progress(download_id: str):
         logging.error(f"[PROGRESS] Error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Поля состояния, которые передаются клиенту в событиях прогресса
+PROGRESS_EVENT_FIELDS = ("status", "progress", "speed", "eta", "error")
+
+async def progress_event_stream(download_id: str, subscription, state: Dict[str, Any]):
+    """
+    Генератор событий SSE для одной загрузки
+
+    События шины объединяются: клиенту уходит не больше SSE_MAX_RATE событий
+    в секунду, каждое с последним известным состоянием.
+    """
+    min_interval = 1.0 / SSE_MAX_RATE if SSE_MAX_RATE > 0 else 0
+    sent = None
+    try:
+        while True:
+            payload = progress_payload(download_id, state)
+            queue_position = payload.get("queue_position")
+            if payload != sent:
+                yield {"data": json.dumps(payload)}
+                sent = payload
+
+            if state.get("status") in TERMINAL_STATUSES:
+                break
+
+            await asyncio.sleep(min_interval)
+            # Пока загрузка ждет в очереди, периодически обновляем позицию
+            event = await subscription.get(timeout=1.0 if queue_position is not None else None)
+            while event is not None:
+                state = {**state, **event.data}
+                event = subscription.get_nowait()
+    finally:
+        subscription.close()
+
+@app.get("/api/events/{download_id}")
+async def download_events(download_id: str):
+    """Поток событий прогресса загрузки (Server-Sent Events)"""
+    # Присоединенный запрос получает события общей загрузки
+    download_id, _ = await resolve_download(download_id)
+
+    # Подписываемся до чтения состояния, чтобы не пропустить события
+    subscription = progress_bus.subscribe(download_id)
+    try:
+        stored = await app.state.storage.get_item(download_id)
+    except Exception:
+        subscription.close()
+        raise
+    last_event = progress_bus.get_last(download_id)
+    if not stored and last_event is None:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="Download not found")
+
+    state = dict(stored or {})
+    if last_event and last_event["updated_at"] >= (state.get("updated_at") or 0):
+        state.update(last_event)
+
+    return EventSourceResponse(
+        progress_event_stream(download_id, subscription, state),
+        ping=PING_INTERVAL
+    )
+
+def progress_payload(download_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """Поля состояния загрузки, которые передаются клиентам в событиях прогресса"""
+    payload = {field: state[field] for field in PROGRESS_EVENT_FIELDS if state.get(field) is not None}
+    queue_position = get_queue_position(download_id)
+    if queue_position is not None:
+        payload["queue_position"] = queue_position
+    return payload
+
+@app.websocket("/ws/progress")
+async def progress_websocket(websocket: WebSocket):
+    """
+    Прогресс нескольких загрузок через одно соединение
+
+    Клиент отправляет {"action": "subscribe" | "unsubscribe", "ids": [...]}.
+    Сервер каждые WS_TICK_INTERVAL секунд отправляет кадр
+    {"type": "delta", "server_time": ..., "downloads": {id: состояние}}
+    только с загрузками, состояние которых изменилось с прошлого кадра.
+    """
+    await websocket.accept()
+    snapshots: Dict[str, Dict[str, Any]] = {}  # Состояние из хранилища на момент подписки
+    sources: Dict[str, str] = {}  # ID загрузки, прогресс которой показывается (для псевдонимов - основная)
+    sent: Dict[str, Dict[str, Any]] = {}
+    replies: List[Dict[str, Any]] = []
+
+    async def read_commands():
+        while True:
+            try:
+                message = await websocket.receive_json()
+                action = message.get("action")
+                ids = message.get("ids") or []
+                if action not in ("subscribe", "unsubscribe") or not isinstance(ids, list):
+                    raise ValueError("ожидается {\"action\": \"subscribe\" | \"unsubscribe\", \"ids\": [...]}")
+            except (ValueError, AttributeError) as e:
+                replies.append({"type": "error", "detail": f"Некорректная команда: {str(e)}"})
+                continue
+
+            if action == "unsubscribe":
+                for download_id in map(str, ids):
+                    snapshots.pop(download_id, None)
+                    sources.pop(download_id, None)
+                    sent.pop(download_id, None)
+                continue
+
+            missing = []
+            for download_id in map(str, ids):
+                if download_id in snapshots:
+                    continue
+                if len(snapshots) >= WS_MAX_SUBSCRIPTIONS:
+                    replies.append({"type": "error", "detail": f"Не более {WS_MAX_SUBSCRIPTIONS} загрузок на соединение"})
+                    break
+                source_id, stored = await resolve_download(download_id)
+                if not stored and progress_bus.get_last(source_id) is None:
+                    missing.append(download_id)
+                    continue
+                sources[download_id] = source_id
+                snapshots[download_id] = dict(stored or {})
+            if missing:
+                replies.append({"type": "missing", "ids": missing})
+
+    reader = asyncio.create_task(read_commands())
+    try:
+        while not reader.done():
+            downloads = {}
+            for download_id, snapshot in list(snapshots.items()):
+                source_id = sources.get(download_id, download_id)
+                state = snapshot
+                last_event = progress_bus.get_last(source_id)
+                if last_event and last_event["updated_at"] >= (snapshot.get("updated_at") or 0):
+                    state = {**snapshot, **last_event}
+                payload = progress_payload(source_id, state)
+                if sent.get(download_id) != payload:
+                    downloads[download_id] = sent[download_id] = payload
+
+            while replies:
+                await websocket.send_json(replies.pop(0))
+            if downloads:
+                await websocket.send_json({"type": "delta", "server_time": time.time(), "downloads": downloads})
+
+            await asyncio.wait([reader], timeout=WS_TICK_INTERVAL)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+        try:
+            await reader
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            pass
+        except Exception as e:
+            logging.error(f"[WS] Ошибка в соединении прогресса: {str(e)}")
+
+def get_queue_position(download_id: str) -> Optional[int]:
+    """Позиция загрузки в очереди или None, если загрузка не ожидает"""
+    download_queue = getattr(app.state, 'download_queue', None)
+    return download_queue.get_position(download_id) if download_queue else None
+
 @app.post("/api/download")
-async def start_download(request: Request, background_tasks: BackgroundTasks):
+async def start_download(request: Request):
     """Начать загрузку видео"""
     try:
         data = await request.json()
@@ -926,8 +1419,60 @@ async def start_download(request: Request, background_tasks: BackgroundTasks):
         if not is_valid:
             raise HTTPException(status_code=400, detail=message)
 
-        # Генерируем уникальный ID для загрузки
+        download_queue = await get_download_queue()
+
+        flight_key = make_flight_key(url, data.get('format'), data.get('quality'))
+
+        # Такое же видео уже загружено: сразу возвращаем завершенную загрузку
+        cached = await result_cache.get(flight_key)
+        if cached is not None:
+            download_id = str(uuid.uuid4())
+            await app.state.storage.update_item(download_id, {
+                "status": "completed",
+                "progress": 100,
+                "url": url,
+                "file_path": cached["file_path"],
+                "original_filename": cached.get("original_filename"),
+                "service_type": cached.get("service_type"),
+                "alias_of": cached.get("download_id"),
+                "cached": True,
+                "created_at": time.time(),
+                "updated_at": time.time()
+            })
+            file_index.touch(cached.get("download_id"))
+            logging.info(f"[DOWNLOAD] Запрос {download_id} получил готовый файл из кеша: {cached['file_path']}")
+            return {"download_id": download_id, "status": "completed", "progress": 100, "cached": True}
+
+        # Такое же видео уже загружается: присоединяемся к загрузке вместо запуска новой
+        primary_id = download_flights.get(flight_key)
+        if primary_id is not None:
+            download_id = str(uuid.uuid4())
+            download_flights.attach(primary_id, download_id)
+            await app.state.storage.update_item(download_id, {
+                "status": "pending",
+                "progress": 0,
+                "url": url,
+                "alias_of": primary_id,
+                "created_at": time.time(),
+                "updated_at": time.time()
+            })
+            logging.info(f"[DOWNLOAD] Запрос {download_id} присоединен к загрузке {primary_id}")
+            primary = progress_bus.get_last(primary_id) or await app.state.storage.get_item(primary_id) or {}
+            return {
+                "download_id": download_id,
+                "status": primary.get("status", "pending"),
+                "queue_position": get_queue_position(primary_id),
+                "alias_of": primary_id
+            }
+
+        # Проверяем место в очереди до создания записи
+        if download_queue.is_full:
+            raise HTTPException(status_code=503, detail="Очередь загрузок заполнена, повторите позже")
+
+        # Генерируем уникальный ID для загрузки и регистрируем ее до первого await,
+        # чтобы одновременные запросы того же видео присоединились к ней
         download_id = str(uuid.uuid4())
+        download_flights.start(flight_key, download_id)
 
         # Создаем начальное состояние
         await app.state.storage.update_item(download_id, {
@@ -938,110 +1483,142 @@ async def start_download(request: Request, background_tasks: BackgroundTasks):
             "updated_at": time.time()
         })
 
-        # Запускаем загрузку в фоновом режиме
-        background_tasks.add_task(process_download, download_id, url)
+        # Ставим загрузку в очередь
+        try:
+            queue_position = download_queue.submit(download_id, url)
+        except QueueFullError as e:
+            await app.state.storage.update_item(download_id, {
+                "status": "error",
+                "error": str(e),
+                "updated_at": time.time()
+            })
+            await finish_flight(download_id)
+            raise HTTPException(status_code=503, detail="Очередь загрузок заполнена, повторите позже")
 
         return {
             "download_id": download_id,
-            "status": "pending"
+            "status": "pending",
+            "queue_position": queue_position
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"[DOWNLOAD] Error starting download: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/info")
+async def get_video_info(url: str):
+    """
+    Информация о видео и доступных форматах
+
+    Результат сохраняется в кеше: повторные запросы и последующая загрузка
+    того же URL не извлекают информацию заново.
+    """
+    is_valid, message = is_valid_video_url(url)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=message)
+
+    try:
+        info, cached = await metadata_cache.get_or_load(url, lambda: extract_video_info(url))
+    except Exception as e:
+        logging.error(f"[INFO] Ошибка при получении информации о {url}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Не удалось получить информацию о видео: {str(e)}")
+
+    return {**summarize_info(info), "cached": cached}
+
 from fastapi.responses import FileResponse, Response
 import os
 
 @app.get("/api/status/{video_id}")
-async def get_video_status(video_id: str):
-    """Возвращает статус загрузки видео"""
-    logging.info(f"[STATUS] Получение статуса для ID: {video_id}")
-
-    # Проверяем, есть ли файл на диске
-    downloads_dir = DOWNLOADS_DIR  # Используем глобальную константу вместо os.path.join(os.getcwd(), "downloads")
-    mp4_files = glob.glob(os.path.join(downloads_dir, f"*{video_id}*.mp4"))
-    webm_files = glob.glob(os.path.join(downloads_dir, f"*{video_id}*.webm"))
-
-    # Если файл существует, возвращаем статус "completed"
-    if mp4_files or webm_files:
-        logging.info(f"[STATUS] Файл для {video_id} найден: {mp4_files or webm_files}")
+async def get_video_status(
+    video_id: str,
+    response: Response,
+    wait: float = 0,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Возвращает статус загрузки видео
+
+    Поддерживает условные запросы и ожидание изменений так же, как /api/progress.
+    """
+    logging.debug(f"[STATUS] Получение статуса для ID: {video_id}")
+
+    # Присоединенный запрос показывает статус и файл общей загрузки
+    video_id, _ = await resolve_download(video_id)
+
+    return await conditional_state_response(video_id, lambda: video_status_body(video_id), response, if_none_match, wait)
+
+async def video_status_body(video_id: str) -> Dict[str, Any]:
+    """Тело ответа /api/status"""
+    # Проверяем, есть ли готовый файл в индексе
+    downloads_dir = DOWNLOADS_DIR
+    entry = file_index.get(video_id)
+    if entry:
+        logging.debug(f"[STATUS] Файл для {video_id} найден: {entry['path']}")
         return {"status": "completed", "progress": 100}
 
-    # Проверяем файл прогресса
-    progress_file = os.path.join(downloads_dir, f"{video_id}_progress.txt")
-    if os.path.exists(progress_file):
-        try:
-            with open(progress_file, 'r') as f:
-                progress_str = f.read().strip()
-                if progress_str and progress_str.isdigit():
-                    progress = int(progress_str)
-                    logging.info(f"[STATUS] Прогресс из файла для {video_id}: {progress}%")
-                    return {"status": "downloading", "progress": progress}
-        except Exception as e:
-            logging.error(f"[STATUS] Ошибка при чтении файла прогресса: {str(e)}")
+    # Проверяем последнее событие прогресса в шине
+    last_event = progress_bus.get_last(video_id)
+    if last_event and last_event.get("status") == "downloading":
+        return {"status": "downloading", "progress": last_event.get("progress", 0)}
 
     # Проверяем статус загрузки в логах
     try:
         log_file = os.path.join(downloads_dir, "logs", f"{video_id}.log")
-        if os.path.exists(log_file):
-            with open(log_file, "r") as f:
-                log_content = f.read()
-                if "download] 100%" in log_content or "[FixupM3u8] Fixing MPEG-TS in MP4 container" in log_content:
-                    logging.info(f"[STATUS] Файл для {video_id} загружен по логам")
-                    return {"status": "completed", "progress": 100}
-
-                # Проверяем, не остановилась ли загрузка
-                last_modified_time = os.path.getmtime(log_file)
-                current_time = time.time()
-                # Если лог не обновлялся более 2 минут, считаем загрузку остановленной
-                if current_time - last_modified_time > 120:  # 2 минуты в секундах
-                    # Проверяем, есть ли прогресс в логе
-                    progress_matches = re.findall(r"\[download\]\s+(\d+\.\d+)%", log_content)
-                    if progress_matches:
-                        last_progress = float(progress_matches[-1])
-                        if last_progress > 0 and last_progress < 100:
-                            # Если прогресс завис на 65-90%, пробуем перезапустить процесс объединения
-                            if 65 <= last_progress <= 90:
-                                logging.warning(f"[STATUS] Загрузка {video_id} зависла на {last_progress}%, пробуем перезапустить процесс объединения")
-
-                                # Пробуем объединить видео и аудио с помощью ffmpeg
-                                try:
-                                    # Ищем файлы видео и аудио
-                                    video_files = glob.glob(os.path.join(downloads_dir, f"*{video_id}*.mp4.part"))
-                                    if video_files:
-                                        video_file = video_files[0]
-                                        output_file = os.path.join(downloads_dir, f"sc-Replit-C1-L0-master-{video_id}.mp4")
-
-                                        # Копируем файл как есть (хотя бы видео будет)
-                                        import shutil
-                                        shutil.copy(video_file, output_file)
-                                        logging.info(f"[STATUS] Скопирован файл {video_file} в {output_file}")
-
-                                        # Записываем 100% прогресса в файл прогресса
-                                        progress_file = os.path.join(downloads_dir, f"{video_id}_progress.txt")
-                                        with open(progress_file, 'w') as f:
-                                            f.write('100')
-                                        logging.info(f"[STATUS] Установлен прогресс 100% для {video_id}")
-                                        return {"status": "completed", "progress": 100}
-                                except Exception as e:
-                                    logging.error(f"[STATUS] Ошибка при обработке зависшей загрузки: {str(e)}")
-
-                                    # В случае ошибки просто устанавливаем прогресс 100%
-                                    progress_file = os.path.join(downloads_dir, f"{video_id}_progress.txt")
-                                    try:
-                                        with open(progress_file, 'w') as f:
-                                            f.write('100')
-                                        logging.info(f"[STATUS] Установлен прогресс 100% для {video_id}")
-                                        return {"status": "completed", "progress": 100}
-                                    except Exception as e:
-                                        logging.error(f"[STATUS] Ошибка при записи в файл прогресса: {str(e)}")
-
-                            # Возвращаем статус зависания
-                            return {"status": "stalled", "progress": last_progress}
-                        elif last_progress >= 100:
-                            logging.info(f"[STATUS] Загрузка для {video_id} остановилась на {last_progress}%")
-                            return {"status": "stalled", "progress": last_progress, "retry_url": f"/download?url=https://www.loom.com/share/{video_id}"}
+        # Читаются только байты, дописанные в лог после предыдущего опроса
+        log_state = await asyncio.to_thread(log_cursors.read, log_file)
+        if log_state is not None:
+            if log_state.completed:
+                logging.info(f"[STATUS] Файл для {video_id} загружен по логам")
+                return {"status": "completed", "progress": 100}
+
+            # Проверяем, не остановилась ли загрузка
+            last_modified_time = log_state.mtime
+            current_time = time.time()
+            # Если лог не обновлялся более 2 минут, считаем загрузку остановленной
+            if current_time - last_modified_time > 120:  # 2 минуты в секундах
+                # Проверяем, есть ли прогресс в логе
+                if log_state.progress is not None:
+                    last_progress = log_state.progress
+                    if last_progress > 0 and last_progress < 100:
+                        # Если прогресс завис на 65-90%, пробуем перезапустить процесс объединения
+                        if 65 <= last_progress <= 90:
+                            logging.warning(f"[STATUS] Загрузка {video_id} зависла на {last_progress}%, пробуем перезапустить процесс объединения")
+
+                            # Пробуем объединить видео и аудио с помощью ffmpeg
+                            try:
+                                # Ищем файлы видео и аудио
+                                video_files = await asyncio.to_thread(
+                                    glob.glob, os.path.join(downloads_dir, f"*{video_id}*.mp4.part")
+                                )
+                                if video_files:
+                                    video_file = video_files[0]
+                                    output_file = os.path.join(downloads_dir, f"sc-Replit-C1-L0-master-{video_id}.mp4")
+
+                                    # Копируем файл как есть (хотя бы видео будет); копирование
+                                    # больших файлов выполняется вне цикла событий
+                                    await asyncio.to_thread(shutil.copy, video_file, output_file)
+                                    await asyncio.to_thread(file_index.add, video_id, output_file)
+                                    logging.info(f"[STATUS] Скопирован файл {video_file} в {output_file}")
+
+                                    # Публикуем 100% прогресса
+                                    progress_bus.publish(video_id, {"status": "completed", "progress": 100})
+                                    logging.info(f"[STATUS] Установлен прогресс 100% для {video_id}")
+                                    return {"status": "completed", "progress": 100}
+                            except Exception as e:
+                                logging.error(f"[STATUS] Ошибка при обработке зависшей загрузки: {str(e)}")
+
+                                # В случае ошибки просто устанавливаем прогресс 100%
+                                progress_bus.publish(video_id, {"status": "completed", "progress": 100})
+                                logging.info(f"[STATUS] Установлен прогресс 100% для {video_id}")
+                                return {"status": "completed", "progress": 100}
+
+                        # Возвращаем статус зависания
+                        return {"status": "stalled", "progress": last_progress}
+                    elif last_progress >= 100:
+                        logging.info(f"[STATUS] Загрузка для {video_id} остановилась на {last_progress}%")
+                        return {"status": "stalled", "progress": last_progress, "retry_url": f"/download?url=https://www.loom.com/share/{video_id}"}
     except Exception as e:
         logging.error(f"[STATUS] Ошибка при чтении лога: {str(e)}")
 
@@ -1066,7 +1643,7 @@ async def get_video_status(video_id: str):
             # Иначе возвращаем текущий статус и прогресс
             status = status_data.get("status", "downloading")
             progress = status_data.get("progress", 0)
-            return {"status": status, "progress": progress}
+            return {"status": status, "progress": progress, "queue_position": get_queue_position(video_id)}
     except Exception as e:
         logging.error(f"[STATUS] Ошибка при получении статуса из хранилища: {str(e)}")
 
@@ -1074,53 +1651,98 @@ async def get_video_status(video_id: str):
     logging.info(f"[STATUS] Статус для {video_id} не найден, возвращаем pending")
     return {"status": "pending", "progress": 0}
 
-@app.get("/api/video/{video_id}")
-@app.head("/api/video/{video_id}")
-async def get_video(video_id: str, request: Request):
-    """Возвращает видеофайл по его идентификатору"""
-    logging.info(f"[VIDEO] Запрос на получение видео {video_id}, метод: {request.method}")
-    downloads_dir = os.path.join(os.getcwd(), "downloads")
-
-    # Получаем все файлы в директории downloads
-    all_files = os.listdir(downloads_dir)
-
-    # Фильтруем файлы по части ID и расширению .mp4
-    # Исключаем файлы с суффиксами .fhls-raw-audio-audio.mp4, .temp.mp4 и т.д.
-    mp4_files = [os.path.join(downloads_dir, f) for f in all_files if video_id in f and f.endswith('.mp4')
-                and not '.fhls-raw-' in f and not '.temp.' in f]
-
-    # Исключаем конвертированные файлы из списка
-    original_mp4_files = [f for f in mp4_files if not os.path.basename(f).startswith("converted-")]
-
-    if original_mp4_files:
-        # Если это HEAD запрос, просто возвращаем 200 OK
-        if request.method == "HEAD":
-            return Response(status_code=200)
+@app.post("/api/status/batch")
+async def get_batch_status(request: BatchStatusRequest):
+    """
+    Возвращает статусы нескольких загрузок
 
-        # Получаем имя файла из пути
-        filename = f"video-{video_id}.mp4"  # Используем более дружелюбное имя
+    Все статусы берутся из одного снимка хранилища и индекса готовых файлов. С параметром since возвращаются только записи, изменившиеся
+    после server_time предыдущего ответа.
+    """
+    server_time = time.time()
+    ids = request.ids
+    records = await app.state.storage.get_items(ids)
+
+    # Присоединенные запросы показывают состояние общей загрузки
+    sources = {
+        video_id: record["alias_of"] for video_id, record in records.items()
+        if isinstance(record, dict) and record.get("alias_of")
+    }
+    primary_ids = [primary_id for primary_id in sources.values() if primary_id not in records]
+    if primary_ids:
+        records.update(await app.state.storage.get_items(primary_ids))
+    sources = {video_id: primary_id for video_id, primary_id in sources.items() if primary_id in records}
+    source_ids = [sources.get(video_id, video_id) for video_id in ids]
+    files = {source_id: entry["indexed_at"] for source_id in source_ids if (entry := file_index.get(source_id))}
+
+    downloads: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for video_id, source_id in zip(ids, source_ids):
+        if source_id in files:
+            # Время завершения - по записи, событию шины или добавлению файла в индекс, но не по mtime файла:
+            # yt-dlp выставляет ему Last-Modified источника, и завершение оказалось бы раньше since
+            state = records.get(source_id)
+            last_event = progress_bus.get_last(source_id)
+            updated_at = max(
+                files[source_id],
+                state.get("updated_at", 0) if isinstance(state, dict) else 0,
+                last_event["updated_at"] if last_event else 0
+            )
+            status = {"status": "completed", "progress": 100}
+        else:
+            state = records.get(source_id)
+            last_event = progress_bus.get_last(source_id)
+            if last_event and (state is None or last_event["updated_at"] >= state.get("updated_at", 0)):
+                state = {**(state or {}), **last_event}
+            if state is None:
+                missing.append(video_id)
+                continue
 
-        # Добавляем заголовок Content-Disposition, чтобы браузер скачивал файл
-        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+            updated_at = state.get("updated_at", 0)
+            if state.get("error"):
+                status = {"status": "error", "error": state["error"]}
+            else:
+                status = {"status": state.get("status", "downloading"), "progress": state.get("progress", 0)}
+                queue_position = get_queue_position(source_id)
+                if queue_position is not None:
+                    status["queue_position"] = queue_position
 
-        logging.info(f"[VIDEO] Возвращаем оригинальный mp4 файл: {original_mp4_files[0]}")
-        return FileResponse(original_mp4_files[0], media_type="video/mp4", headers=headers)
+        if request.since is not None and updated_at <= request.since:
+            continue
+        status["updated_at"] = updated_at
+        downloads[video_id] = status
 
-    # Если не нашли оригинальные mp4 файлы, ищем .webm
-    webm_files = [os.path.join(downloads_dir, f) for f in all_files if video_id in f and f.endswith('.webm')]
-    if webm_files:
-        # Если это HEAD запрос, просто возвращаем 200 OK
-        if request.method == "HEAD":
-            return Response(status_code=200)
+    return {"server_time": server_time, "downloads": downloads, "missing": missing}
 
-        # Получаем имя файла из пути
-        filename = f"video-{video_id}.webm"  # Используем более дружелюбное имя
+@app.get("/api/video/{video_id}")
+@app.head("/api/video/{video_id}")
+async def get_video(video_id: str, request: Request):
+    """Возвращает видеофайл по его идентификатору"""
+    logging.info(f"[VIDEO] Запрос на получение видео {video_id}, метод: {request.method}")
+    video_id, record = await resolve_download(video_id)
 
-        # Добавляем заголовок Content-Disposition, чтобы браузер скачивал файл
-        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    # Файл загрузки берется из индекса; файл из кеша результатов назван
+    # по ID загрузки, которая его создала, и берется из записи загрузки
+    entry = file_index.get(video_id)
+    candidates = [entry["path"]] if entry else []
+    file_path = record.get("file_path") if isinstance(record, dict) else None
+    if file_path:
+        candidates.append(file_path)
 
-        logging.info(f"[VIDEO] Возвращаем webm файл: {webm_files[0]}")
-        return FileResponse(webm_files[0], media_type="video/webm", headers=headers)
+    for file_path in candidates:
+        try:
+            stat_result = await asyncio.to_thread(os.stat, file_path)
+        except OSError:
+            # Файл удален в обход очистки
+            file_index.discard_path(file_path)
+            continue
+
+        extension = os.path.splitext(file_path)[1].lstrip(".") or "mp4"
+        # Добавляем заголовок Content-Disposition с более дружелюбным именем, чтобы браузер скачивал файл
+        headers = {"Content-Disposition": f"attachment; filename=video-{video_id}.{extension}"}
+        logging.info(f"[VIDEO] Возвращаем файл: {file_path}")
+        file_index.touch(video_id)
+        return ServedFileResponse(file_path, media_type=f"video/{extension}", headers=headers, stat_result=stat_result)
 
     # Если это HEAD запрос, возвращаем 404
     if request.method == "HEAD":
@@ -0,0 +1,325 @@
+"""
+Очистка директории загрузок и логов за один проход.
+
+Прогон очистки читает каждую директорию одним os.scandir и использует
+stat из DirEntry, не запрашивая его повторно. По результатам обхода
+и записям хранилища состояний в том же прогоне находятся:
+
+- устаревшие готовые файлы и файлы загрузок, записей которых нет (сироты);
+- остатки незавершенных загрузок (.part, .ytdl, фрагменты, временные файлы),
+  если их загрузка уже не выполняется;
+- записи завершенных загрузок, файлов которых нет на диске;
+- файлы просроченных записей (по куче устаревания хранилища);
+- старые логи загрузок.
+
+Рассматриваются только файлы загрузок: с ID загрузки в имени, медиафайлы
+и промежуточные файлы. Хранилище состояний (state.json, state.db и их
+журналы и резервные копии) и индексы кешей лежат в той же директории
+и не удаляются. Возраст файла, у которого есть запись, отсчитывается от
+последнего изменения записи: yt-dlp выставляет готовому файлу время
+Last-Modified источника, и по нему только что завершенный файл выглядит старым.
+
+Файлы удаляются пакетами в пуле потоков. Каждый прогон возвращает
+метрики: сколько файлов просмотрено, удалено и сколько байт освобождено.
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from state_storage import get_record_timestamp
+
+# Признаки промежуточных файлов yt-dlp и ffmpeg (.ytdl - состояние загрузки фрагментов)
+LEFTOVER_SUFFIXES = (".part", ".ytdl", ".tmp", ".temp")
+# Медиафайлы, которые удаляются по возрасту и без ID загрузки в имени
+MEDIA_EXTENSIONS = (".mp4", ".webm", ".mkv", ".m4a", ".mp3", ".opus", ".ogg", ".wav", ".flv", ".ts")
+# Служебные файлы директории загрузок: хранилище состояний, его журналы и резервные копии, индекс кеша
+SERVICE_FILE_PREFIXES = ("state.", "result_cache.", "download_states.")
+# Статусы загрузок, промежуточные файлы которых еще нужны
+ACTIVE_STATUSES = ("pending", "starting", "downloading", "processing", "converting", "retrying", "waiting_for_space")
+
+_UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+_FORMAT_STREAM_PATTERN = re.compile(r"\.f\d+\.\w+$")  # Отдельный поток перед объединением: title-{id}.f137.mp4
+
+def find_download_id(filename: str) -> Optional[str]:
+    """ID загрузки в имени готового или промежуточного файла"""
+    ids = _UUID_PATTERN.findall(filename)
+    return ids[-1] if ids else None
+
+def is_leftover_file(filename: str) -> bool:
+    """Является ли файл остатком незавершенной загрузки или постобработки"""
+    if filename.endswith(LEFTOVER_SUFFIXES) or ".part-Frag" in filename:
+        return True
+    if ".temp." in filename or ".fhls-raw-" in filename or filename.startswith("converted-"):
+        return True
+    return bool(_FORMAT_STREAM_PATTERN.search(filename))
+
+def is_download_file(filename: str) -> bool:
+    """Создан ли файл загрузкой (готовый, промежуточный или медиафайл), а не хранилищем или кешем"""
+    if find_download_id(filename) is not None:
+        return True
+    if filename.endswith(".json") or filename.startswith(SERVICE_FILE_PREFIXES):
+        return False
+    return filename.endswith(MEDIA_EXTENSIONS) or is_leftover_file(filename)
+
+def _remove_batch(paths: List[Tuple[str, int]]) -> Tuple[List[Tuple[str, int]], int]:
+    """Удаляет пакет файлов; возвращает удаленные файлы и число ошибок"""
+    removed, errors = [], 0
+    for path, size in paths:
+        try:
+            os.remove(path)
+            removed.append((path, size))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            errors += 1
+            logging.error(f"[CLEANUP] Ошибка при удалении файла {path}: {str(e)}")
+    return removed, errors
+
+class CleanupEngine:
+    """Прогон очистки файлов загрузок, логов и записей хранилища"""
+
+    def __init__(
+        self,
+        downloads_dir: str,
+        logs_dir: Optional[str] = None,
+        max_age: float = 30 * 60,
+        log_max_age: float = 24 * 60 * 60,
+        leftover_max_age: float = 60 * 60,
+        orphan_grace: float = 10 * 60,
+        keep_file: Optional[Callable[[str], bool]] = None,
+        on_remove: Optional[Callable[[str], None]] = None,
+        on_record_remove: Optional[Callable[[str], None]] = None,
+        workers: int = 4,
+        batch_size: int = 64
+    ):
+        """
+        Args:
+            downloads_dir: Директория загрузок
+            logs_dir: Директория логов загрузок (None - логи не очищаются)
+            max_age: Возраст готового файла в секундах, после которого он удаляется
+            log_max_age: Возраст лога в секундах, после которого он удаляется
+            leftover_max_age: Возраст промежуточного файла, после которого он удаляется без проверки записи
+            orphan_grace: Минимальный возраст файла или записи без пары, после которого они удаляются
+            keep_file: Функция, возвращающая True для файлов, которые не удаляются (например, файлов кеша)
+            on_remove: Функция, вызываемая с путем каждого удаленного файла загрузки
+            on_record_remove: Функция, вызываемая с ID загрузки каждой удаленной записи
+            workers: Потоки для удаления файлов
+            batch_size: Файлов в одном пакете удаления
+        """
+        self.downloads_dir = downloads_dir
+        self.logs_dir = logs_dir
+        self.max_age = max_age
+        self.log_max_age = log_max_age
+        self.leftover_max_age = leftover_max_age
+        self.orphan_grace = orphan_grace
+        self.keep_file = keep_file
+        self.on_remove = on_remove
+        self.on_record_remove = on_record_remove
+        self.workers = workers
+        self.batch_size = batch_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = asyncio.Lock()
+        self.runs = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.totals = {"files_removed": 0, "bytes_freed": 0, "records_removed": 0}
+
+    @staticmethod
+    def _scan(directory: Optional[str]) -> List[Tuple[str, str, int, float]]:
+        """Один проход по директории: (имя, путь, размер, время изменения) обычных файлов"""
+        if not directory:
+            return []
+        files = []
+        try:
+            with os.scandir(os.path.abspath(directory)) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat_result = entry.stat(follow_symlinks=False)
+                    files.append((entry.name, entry.path, stat_result.st_size, stat_result.st_mtime))
+        except FileNotFoundError:
+            pass
+        return files
+
+    async def run(
+        self,
+        storage: Any = None,
+        record_ttl: Optional[float] = None,
+        downloads: bool = True,
+        logs: bool = True,
+        max_age: Optional[float] = None,
+        log_max_age: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Выполняет прогон очистки
+
+        Args:
+            storage: Хранилище состояний для сверки файлов с записями (None - очистка только по возрасту)
+            record_ttl: Удалить записи, не изменявшиеся дольше record_ttl секунд, вместе с их файлами
+            downloads: Очищать директорию загрузок
+            logs: Очищать директорию логов
+            max_age: Возраст готового файла для этого прогона (по умолчанию self.max_age)
+            log_max_age: Возраст лога для этого прогона (по умолчанию self.log_max_age)
+
+        Returns:
+            Dict[str, Any]: Метрики прогона
+        """
+        async with self._lock:
+            started = time.time()
+            max_age = self.max_age if max_age is None else max_age
+            log_max_age = self.log_max_age if log_max_age is None else log_max_age
+            metrics = {
+                "started_at": started, "files_scanned": 0, "files_removed": 0, "bytes_freed": 0,
+                "expired_records": 0, "orphan_files": 0, "orphan_records": 0, "leftovers": 0,
+                "logs_removed": 0, "errors": 0
+            }
+            to_remove: Dict[str, int] = {}  # Путь -> размер
+            log_paths = set()
+
+            # Просроченные записи извлекаются из кучи устаревания без обхода состояния
+            expired: Dict[str, Any] = {}
+            if storage is not None and record_ttl is not None and hasattr(storage, "cleanup_old_items"):
+                expired = await storage.cleanup_old_items(max_age_hours=record_ttl / 3600)
+                metrics["expired_records"] = len(expired)
+                for key in expired:
+                    self._record_removed(key)
+
+            if downloads:
+                files = await asyncio.to_thread(self._scan, self.downloads_dir)
+                metrics["files_scanned"] += len(files)
+                await self._plan_downloads(files, storage, expired, started, max_age, to_remove, metrics)
+
+            if logs and self.logs_dir:
+                log_files = await asyncio.to_thread(self._scan, self.logs_dir)
+                metrics["files_scanned"] += len(log_files)
+                for name, path, size, mtime in log_files:
+                    if name.endswith(".log") and started - mtime > log_max_age:
+                        to_remove[path] = size
+                        log_paths.add(path)
+                        metrics["logs_removed"] += 1
+
+            removed = await self._remove(to_remove, metrics)
+            if self.on_remove is not None:
+                for path in removed:
+                    if path not in log_paths:
+                        self.on_remove(path)
+
+            metrics["duration"] = time.time() - started
+            self.runs += 1
+            self.last_run = metrics
+            self.totals["files_removed"] += metrics["files_removed"]
+            self.totals["bytes_freed"] += metrics["bytes_freed"]
+            self.totals["records_removed"] += metrics["expired_records"] + metrics["orphan_records"]
+            if metrics["files_removed"] or metrics["orphan_records"] or metrics["expired_records"]:
+                logging.info(
+                    f"[CLEANUP] Просмотрено файлов: {metrics['files_scanned']}, удалено: {metrics['files_removed']} "
+                    f"({metrics['bytes_freed'] / 1024 / 1024:.1f} МБ), записей: "
+                    f"{metrics['expired_records'] + metrics['orphan_records']}, за {metrics['duration']:.2f} с"
+                )
+            return metrics
+
+    def _record_removed(self, key: str):
+        if self.on_record_remove is not None:
+            self.on_record_remove(key[len("download_"):] if key.startswith("download_") else key)
+
+    def _is_kept(self, path: str) -> bool:
+        return self.keep_file is not None and self.keep_file(path)
+
+    async def _plan_downloads(
+        self,
+        files: List[Tuple[str, str, int, float]],
+        storage: Any,
+        expired: Dict[str, Any],
+        now: float,
+        max_age: float,
+        to_remove: Dict[str, int],
+        metrics: Dict[str, Any]
+    ):
+        """Сверяет файлы директории загрузок с записями и отбирает файлы для удаления"""
+        sizes = {path: size for _, path, size, _ in files}
+
+        # Файлы просроченных записей
+        for record in expired.values():
+            file_path = record.get("file_path") if isinstance(record, dict) else None
+            if file_path and not self._is_kept(file_path):
+                to_remove[os.path.abspath(file_path)] = sizes.get(os.path.abspath(file_path), 0)
+
+        # Записи загрузок, ID которых есть в именах файлов (ключи бывают с префиксом download_)
+        records: Dict[str, Any] = {}
+        if storage is not None:
+            ids = {download_id for name, _, _, _ in files if (download_id := find_download_id(name))}
+            if ids:
+                found = await storage.get_items(list(ids) + [f"download_{download_id}" for download_id in ids])
+                records = {key[len("download_"):] if key.startswith("download_") else key: value for key, value in found.items()}
+
+        for name, path, size, mtime in files:
+            if not is_download_file(name) or path in to_remove or self._is_kept(path):
+                continue
+            download_id = find_download_id(name)
+            record = records.get(download_id) if download_id else None
+            status = record.get("status") if isinstance(record, dict) else None
+            # Время изменения готового файла - Last-Modified источника, поэтому учитывается и время записи
+            age = now - max(mtime, get_record_timestamp(record) or 0)
+
+            if is_leftover_file(name):
+                # Остатки выполняющейся загрузки удаляются, только если она давно не продвигается
+                if status in ACTIVE_STATUSES or storage is None:
+                    limit = self.leftover_max_age
+                else:
+                    limit = self.orphan_grace
+                if age > limit:
+                    to_remove[path] = size
+                    metrics["leftovers"] += 1
+            elif storage is not None and download_id and record is None and age > self.orphan_grace:
+                to_remove[path] = size
+                metrics["orphan_files"] += 1
+            elif age > max_age and status not in ACTIVE_STATUSES:
+                to_remove[path] = size
+
+        # Записи завершенных загрузок, файлов которых нет на диске
+        if storage is not None and hasattr(storage, "get_items_by_status") and hasattr(storage, "delete_item"):
+            completed = await storage.get_items_by_status("completed")
+            for key, record in completed.items():
+                file_path = record.get("file_path") if isinstance(record, dict) else None
+                if not file_path or os.path.dirname(os.path.abspath(file_path)) != os.path.abspath(self.downloads_dir):
+                    continue
+                updated = get_record_timestamp(record)
+                if os.path.abspath(file_path) in sizes or updated is None or now - updated <= self.orphan_grace:
+                    continue
+                await storage.delete_item(key)
+                self._record_removed(key)
+                metrics["orphan_records"] += 1
+                logging.info(f"[CLEANUP] Удалена запись {key}: файла {file_path} нет на диске")
+
+    async def _remove(self, to_remove: Dict[str, int], metrics: Dict[str, Any]) -> List[str]:
+        """Удаляет файлы пакетами в пуле потоков"""
+        if not to_remove:
+            return []
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cleanup")
+        items = list(to_remove.items())
+        batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, _remove_batch, batch) for batch in batches))
+
+        removed = []
+        for batch_removed, errors in results:
+            metrics["errors"] += errors
+            for path, size in batch_removed:
+                removed.append(path)
+                metrics["files_removed"] += 1
+                metrics["bytes_freed"] += size
+        return removed
+
+    def close(self):
+        """Останавливает пул потоков удаления"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики последнего прогона и суммарные счетчики"""
+        return {"runs": self.runs, "last_run": self.last_run, **self.totals}
@@ -1,18 +1,51 @@
-import os
-import time
 import logging
 import asyncio
-from typing import Optional
-import aiofiles
-import aiofiles.os
+from typing import Any, Awaitable, Callable, Dict, Optional
+from cleanup_engine import CleanupEngine
 from metrics import measure_time
 
 class CleanupManager:
     """Менеджер очистки файлов и логов"""
 
-    def __init__(self, downloads_dir: str, logs_dir: str):
+    def __init__(
+        self,
+        downloads_dir: str,
+        logs_dir: str,
+        keep_file: Optional[Callable[[str], bool]] = None,
+        on_remove: Optional[Callable[[str], None]] = None,
+        on_record_remove: Optional[Callable[[str], None]] = None,
+        storage: Any = None,
+        record_ttl: Optional[float] = None,
+        max_age: float = 30 * 60,
+        before_run: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        """
+        Args:
+            downloads_dir: Директория загрузок
+            logs_dir: Директория логов
+            keep_file: Функция, возвращающая True для файлов, которые не удаляются по возрасту
+            on_remove: Функция, вызываемая с путем каждого удаленного файла загрузки
+            on_record_remove: Функция, вызываемая с ID загрузки каждой удаленной записи
+            storage: Хранилище состояний для сверки файлов с записями загрузок
+            record_ttl: Время жизни записи загрузки в секундах (None - записи не удаляются по возрасту)
+            max_age: Возраст готового файла в секундах, после которого он удаляется
+            before_run: Корутина, вызываемая перед каждым полным прогоном (например, обрезка лога приложения)
+        """
         self.downloads_dir = downloads_dir
         self.logs_dir = logs_dir
+        self.keep_file = keep_file
+        self.on_remove = on_remove
+        self.storage = storage
+        self.record_ttl = record_ttl
+        self.before_run = before_run
+        self.engine = CleanupEngine(
+            downloads_dir,
+            logs_dir,
+            max_age=max_age,
+            keep_file=keep_file,
+            on_remove=on_remove,
+            on_record_remove=on_record_remove
+        )
         self._cleanup_task: Optional[asyncio.Task] = None
 
     @measure_time()
@@ -44,6 +77,7 @@ class CleanupManager:
                 logging.error(f"[CLEANUP] Ошибка при остановке задачи очистки: {str(e)}")
             finally:
                 self._cleanup_task = None
+        self.engine.close()
 
     async def _periodic_cleanup(self, interval: int):
         """Периодическая очистка"""
@@ -59,68 +93,32 @@ class CleanupManager:
 
     @measure_time()
     async def cleanup_all(self):
-        """Выполняет полную очистку"""
+        """Выполняет полную очистку: файлы загрузок, записи хранилища и логи за один прогон"""
         try:
-            # Очищаем старые файлы загрузок
-            await self.cleanup_downloads()
-            # Очищаем старые логи
-            await self.cleanup_logs()
+            if self.before_run is not None:
+                await self.before_run()
+            await self.engine.run(storage=self.storage, record_ttl=self.record_ttl)
         except Exception as e:
             logging.error(f"[CLEANUP] Error during cleanup: {str(e)}")
 
     @measure_time()
-    async def cleanup_downloads(self, max_age_hours: float = 0.5):  # 30 минут по умолчанию
-        """Очистка старых загрузок"""
+    async def cleanup_downloads(self, max_age_hours: Optional[float] = None):
+        """Очистка старых загрузок (по умолчанию - по возрасту из настроек менеджера)"""
         try:
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600  # Переводим часы в секунды
-
-            files = await aiofiles.os.listdir(self.downloads_dir)
-            for filename in files:
-                if filename.endswith('.json') or filename.startswith('.') or filename == 'logs':
-                    continue
-
-                file_path = os.path.join(self.downloads_dir, filename)
-                try:
-                    if not await aiofiles.os.path.isfile(file_path):
-                        continue
-
-                    stat = await aiofiles.os.stat(file_path)
-                    file_age_seconds = current_time - stat.st_mtime
-                    file_age_minutes = file_age_seconds / 60
-
-                    if file_age_seconds > max_age_seconds:
-                        await aiofiles.os.remove(file_path)
-                        logging.info(f"[CLEANUP] Удален старый файл: {filename} (возраст: {file_age_minutes:.1f} минут)")
-                except Exception as e:
-                    logging.error(f"[CLEANUP] Ошибка при обработке файла {filename}: {str(e)}")
-
+            max_age = None if max_age_hours is None else max_age_hours * 3600
+            await self.engine.run(storage=self.storage, logs=False, max_age=max_age)
         except Exception as e:
             logging.error(f"[CLEANUP] Ошибка при очистке загрузок: {str(e)}")
 
     @measure_time()
-    async def cleanup_logs(self, max_age_hours: int = 24):  # 24 часа по умолчанию
+    async def cleanup_logs(self, max_age_hours: Optional[float] = None):
         """Очистка старых логов"""
         try:
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-
-            files = await aiofiles.os.listdir(self.logs_dir)
-            for filename in files:
-                if not filename.endswith('.log'):
-                    continue
-
-                file_path = os.path.join(self.logs_dir, filename)
-                try:
-                    if not await aiofiles.os.path.isfile(file_path):
-                        continue
-
-                    stat = await aiofiles.os.stat(file_path)
-                    if current_time - stat.st_mtime > max_age_seconds:
-                        await aiofiles.os.remove(file_path)
-                        logging.info(f"[CLEANUP] Deleted old log: {filename}")
-                except Exception as e:
-                    logging.error(f"[CLEANUP] Error processing log {filename}: {str(e)}")
-
+            log_max_age = None if max_age_hours is None else max_age_hours * 3600
+            await self.engine.run(downloads=False, log_max_age=log_max_age)
         except Exception as e:
             logging.error(f"[CLEANUP] Error cleaning logs: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики прогонов очистки"""
+        return self.engine.stats()
@@ -0,0 +1,109 @@
+"""
+Учет времени жизни записей хранилища состояний.
+
+Записи упорядочены в min-куче по времени последнего изменения, поэтому
+очистка извлекает только просроченные записи и не обходит все состояние.
+"""
+
+import os
+import heapq
+import logging
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+class ExpiryHeap:
+    """Min-куча ключей по времени последнего изменения с ленивым удалением устаревших элементов"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._timestamps: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def schedule(self, key: str, timestamp: Optional[float]):
+        """
+        Запоминает время последнего изменения ключа
+
+        Args:
+            key: Ключ записи
+            timestamp: Unix-время изменения; None - запись не устаревает
+        """
+        if timestamp is None:
+            self.discard(key)
+            return
+
+        if self._timestamps.get(key) == timestamp:
+            return
+
+        self._timestamps[key] = timestamp
+        heapq.heappush(self._heap, (timestamp, key))
+
+        # Предыдущие элементы ключа остаются в куче до извлечения. Если их
+        # накопилось слишком много, пересобираем кучу по актуальным значениям.
+        if len(self._heap) > 2 * len(self._timestamps) + 64:
+            self._compact()
+
+    def discard(self, key: str):
+        """Исключает ключ из учета (элемент в куче удалится при извлечении)"""
+        self._timestamps.pop(key, None)
+
+    def clear(self):
+        """Очищает учет"""
+        self._heap = []
+        self._timestamps = {}
+
+    def pop_expired(self, cutoff: float) -> List[str]:
+        """
+        Извлекает ключи, измененные раньше cutoff
+
+        Args:
+            cutoff: Граница времени изменения
+
+        Returns:
+            List[str]: Просроченные ключи в порядке устаревания
+        """
+        expired = []
+        while self._heap and self._heap[0][0] < cutoff:
+            timestamp, key = heapq.heappop(self._heap)
+            # Пропускаем элементы, замененные более поздним изменением ключа
+            if self._timestamps.get(key) == timestamp:
+                del self._timestamps[key]
+                expired.append(key)
+        return expired
+
+    def _compact(self):
+        self._heap = [(timestamp, key) for key, timestamp in self._timestamps.items()]
+        heapq.heapify(self._heap)
+
+def remove_record_files(
+    records: Dict[str, Any],
+    keep: Optional[Callable[[str], bool]] = None,
+    on_remove: Optional[Callable[[str], None]] = None
+) -> int:
+    """
+    Удаляет с диска файлы, на которые ссылаются записи (поле file_path)
+
+    Args:
+        records: Удаленные записи хранилища
+        keep: Функция, возвращающая True для файлов, которые удалять нельзя (например, файлов кеша)
+        on_remove: Функция, вызываемая с путем каждого удаленного файла
+
+    Returns:
+        int: Количество удаленных файлов
+    """
+    removed = 0
+    for key, value in records.items():
+        file_path = value.get("file_path") if isinstance(value, dict) else None
+        if not file_path or (keep is not None and keep(file_path)):
+            continue
+        try:
+            os.remove(file_path)
+            removed += 1
+            if on_remove is not None:
+                on_remove(file_path)
+            logging.info(f"[CLEANUP] Удален файл {file_path} для {key}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"[CLEANUP] Ошибка при удалении файла {file_path}: {str(e)}")
+    return removed
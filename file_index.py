@@ -0,0 +1,148 @@
+"""
+Индекс готовых файлов загрузок.
+
+Эндпоинты /api/video и /api/status находили файл загрузки перебором
+директории загрузок и поиском ID в именах файлов на каждый запрос.
+FileIndex хранит соответствие download_id -> путь, контейнер и размер
+файла: запись добавляется при завершении загрузки и удаляется очисткой,
+а при запуске индекс один раз восстанавливается обходом директории
+(os.scandir) по ID в именах файлов.
+"""
+
+import os
+import re
+import time
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+# Контейнеры готовых файлов в порядке предпочтения
+CONTAINERS = ("mp4", "webm")
+
+# download_id - UUID в конце имени файла (%(title)s-{id}.%(ext)s, sc-...-{id}.mp4)
+_ID_PATTERN = re.compile(r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})$")
+
+def is_final_file(filename: str) -> bool:
+    """Является ли файл готовым результатом загрузки, а не промежуточным файлом"""
+    return (
+        filename.endswith(tuple(f".{container}" for container in CONTAINERS))
+        and ".fhls-raw-" not in filename
+        and ".temp." not in filename
+        and not filename.startswith(("converted-", "."))
+    )
+
+def extract_download_id(filename: str) -> Optional[str]:
+    """ID загрузки из имени готового файла"""
+    match = _ID_PATTERN.search(os.path.splitext(filename)[0])
+    return match.group(1) if match else None
+
+class FileIndex:
+    """Соответствие ID загрузки ее готовому файлу"""
+
+    def __init__(self, downloads_dir: str):
+        """
+        Args:
+            downloads_dir: Директория загрузок
+        """
+        self.downloads_dir = downloads_dir
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._paths: Dict[str, str] = {}  # Путь файла -> ID загрузки
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rebuild(self) -> int:
+        """
+        Восстанавливает индекс одним обходом директории загрузок
+
+        Returns:
+            int: Количество найденных файлов
+        """
+        entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with os.scandir(self.downloads_dir) as scan:
+                for entry in scan:
+                    if not is_final_file(entry.name):
+                        continue
+                    download_id = extract_download_id(entry.name)
+                    if download_id is None or not entry.is_file():
+                        continue
+                    candidate = self._make_entry(entry.path, entry.stat())
+                    current = entries.get(download_id)
+                    if current is None or self._preferred(candidate, current):
+                        entries[download_id] = candidate
+        except FileNotFoundError:
+            pass
+
+        self._entries = entries
+        self._paths = {entry["path"]: download_id for download_id, entry in entries.items()}
+        logging.info(f"[FILE_INDEX] Индекс восстановлен, файлов: {len(entries)}")
+        return len(entries)
+
+    @staticmethod
+    def _make_entry(file_path: str, stat_result: os.stat_result) -> Dict[str, Any]:
+        container = os.path.splitext(file_path)[1].lstrip(".").lower()
+        return {
+            "path": os.path.abspath(file_path),
+            "container": container,
+            "size": stat_result.st_size,
+            "mtime": stat_result.st_mtime,
+            "last_access": stat_result.st_mtime,
+            "indexed_at": time.time()  # Время появления в индексе (mtime - Last-Modified источника)
+        }
+
+    @staticmethod
+    def _preferred(candidate: Dict[str, Any], current: Dict[str, Any]) -> bool:
+        rank = {container: index for index, container in enumerate(CONTAINERS)}
+        return rank.get(candidate["container"], len(rank)) < rank.get(current["container"], len(rank))
+
+    def add(self, download_id: str, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Добавляет готовый файл загрузки (вызывается при ее завершении)
+
+        Returns:
+            Optional[Dict[str, Any]]: Запись индекса или None, если файл не найден
+        """
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+        self.discard(download_id)
+        entry = self._make_entry(file_path, stat_result)
+        # yt-dlp выставляет файлу время Last-Modified источника: завершенная загрузка не должна выглядеть давно использованной
+        entry["last_access"] = time.time()
+        self._entries[download_id] = entry
+        self._paths[entry["path"]] = download_id
+        return entry
+
+    def get(self, download_id: str) -> Optional[Dict[str, Any]]:
+        """Запись индекса: path, container, size, mtime, last_access, indexed_at"""
+        return self._entries.get(download_id)
+
+    def touch(self, download_id: str):
+        """Отмечает обращение к файлу загрузки (для вытеснения давно использованных)"""
+        entry = self._entries.get(download_id)
+        if entry is not None:
+            entry["last_access"] = time.time()
+
+    def lru(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """Записи от давно использованных к недавним"""
+        return sorted(self._entries.items(), key=lambda item: item[1]["last_access"])
+
+    def discard(self, download_id: str):
+        """Удаляет запись загрузки"""
+        entry = self._entries.pop(download_id, None)
+        if entry is not None:
+            self._paths.pop(entry["path"], None)
+
+    def discard_path(self, file_path: str):
+        """Удаляет запись по пути файла (вызывается при удалении файла)"""
+        download_id = self._paths.pop(os.path.abspath(file_path), None)
+        if download_id is not None:
+            self._entries.pop(download_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние индекса для метрик"""
+        return {
+            "files": len(self._entries),
+            "bytes": sum(entry["size"] for entry in self._entries.values())
+        }
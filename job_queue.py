@@ -0,0 +1,266 @@
+"""
+Очередь задач загрузки с ограниченным числом воркеров.
+
+Каждая задача выполняется воркером и в каждый момент занимает слот одной
+стадии: сетевой (скачивание) или процессорной (объединение и конвертация
+ffmpeg). Число слотов стадий ограничено отдельно, поэтому всплеск запросов
+не запускает одновременно десятки yt-dlp и ffmpeg на небольшой машине.
+
+Обработчик выполняется отдельной задачей asyncio: выполняющуюся задачу можно
+прервать (abort), обработчик получает CancelledError, а воркер переходит
+к следующей задаче.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from metrics import measure_time
+
+STAGE_NETWORK = "network"
+STAGE_CPU = "cpu"
+
+class QueueFullError(Exception):
+    """Очередь задач заполнена"""
+
+class DownloadJobQueue:
+    """Ограниченная очередь задач загрузки с пулом воркеров"""
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable[Any]],
+        workers: int = 3,
+        max_pending: int = 100,
+        network_limit: int = 2,
+        cpu_limit: int = 1
+    ):
+        """
+        Инициализация очереди
+
+        Args:
+            handler: Корутина, выполняющая задачу: handler(job_id, *args)
+            workers: Количество воркеров
+            max_pending: Максимальное количество задач, ожидающих выполнения
+            network_limit: Количество задач, одновременно находящихся в сетевой стадии
+            cpu_limit: Количество задач, одновременно находящихся в процессорной стадии
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: "OrderedDict[str, Tuple[Any, ...]]" = OrderedDict()
+        self._limits = {STAGE_NETWORK: max(1, network_limit), STAGE_CPU: max(1, cpu_limit)}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self._stages: Dict[str, str] = {}  # Текущая стадия выполняющихся задач
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}  # Задачи обработчика выполняющихся задач
+        self._aborted: Set[str] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.completed = 0
+        self.failed = 0
+        self.aborted = 0
+
+    @property
+    def running(self) -> bool:
+        """Запущены ли воркеры"""
+        return any(not task.done() for task in self._worker_tasks)
+
+    @measure_time()
+    async def start(self):
+        """Запускает воркеры"""
+        if self.running:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._slots = {stage: asyncio.Semaphore(limit) for stage, limit in self._limits.items()}
+        # Задачи, поставленные до запуска, сохраняют свой порядок
+        for job_id in self._pending:
+            self._queue.put_nowait(job_id)
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(number)) for number in range(self.workers)
+        ]
+        logging.info(
+            f"[QUEUE] Запущено воркеров: {self.workers}, слоты стадий: {self._limits}, "
+            f"размер очереди: {self.max_pending}"
+        )
+
+    @measure_time()
+    async def stop(self):
+        """Останавливает воркеры. Задачи, ожидающие в очереди, не выполняются."""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logging.error(f"[QUEUE] Ошибка при остановке воркера: {str(e)}")
+        self._worker_tasks = []
+        logging.info(f"[QUEUE] Воркеры остановлены, задач в очереди: {len(self._pending)}")
+
+    @property
+    def is_full(self) -> bool:
+        """Заполнена ли очередь"""
+        return len(self._pending) >= self.max_pending
+
+    def submit(self, job_id: str, *args) -> int:
+        """
+        Ставит задачу в очередь
+
+        Args:
+            job_id: Идентификатор задачи (ID загрузки)
+            *args: Аргументы обработчика
+
+        Returns:
+            int: Позиция задачи в очереди (начиная с 1)
+
+        Raises:
+            QueueFullError: В очереди уже max_pending задач
+        """
+        if job_id in self._pending:
+            return self.get_position(job_id)
+        if self.is_full:
+            raise QueueFullError(f"Очередь загрузок заполнена ({self.max_pending})")
+
+        self._pending[job_id] = args
+        if self._queue is not None:
+            self._queue.put_nowait(job_id)
+        return len(self._pending)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Убирает из очереди задачу, которая еще не начала выполняться
+
+        Returns:
+            bool: True, если задача была в очереди
+        """
+        return self._pending.pop(job_id, None) is not None
+
+    def is_running(self, job_id: str) -> bool:
+        """Выполняется ли задача воркером"""
+        return job_id in self._running
+
+    async def abort(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """
+        Прерывает выполняющуюся задачу: обработчик получает CancelledError
+
+        Args:
+            job_id: Идентификатор задачи
+            timeout: Сколько секунд ждать завершения обработчика (None - без ограничения)
+
+        Returns:
+            bool: True, если обработчик завершился; False, если задача не выполняется
+                или не завершилась за timeout
+        """
+        task = self._running.get(job_id)
+        if task is None:
+            return False
+        self._aborted.add(job_id)
+        task.cancel()
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        return bool(done)
+
+    def get_position(self, job_id: str) -> Optional[int]:
+        """Позиция задачи в очереди (начиная с 1) или None, если задача не ожидает"""
+        for position, pending_id in enumerate(self._pending, start=1):
+            if pending_id == job_id:
+                return position
+        return None
+
+    def get_stage(self, job_id: str) -> Optional[str]:
+        """Текущая стадия выполняющейся задачи"""
+        return self._stages.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди для метрик"""
+        stages = {stage: 0 for stage in self._limits}
+        for stage in self._stages.values():
+            stages[stage] += 1
+        return {
+            "pending": len(self._pending),
+            "running": len(self._stages),
+            "workers": self.workers,
+            "stages": stages,
+            "limits": dict(self._limits),
+            "completed": self.completed,
+            "failed": self.failed,
+            "aborted": self.aborted
+        }
+
+    async def enter_stage(self, job_id: str, stage: str):
+        """
+        Переводит задачу в другую стадию: освобождает слот текущей стадии и
+        ждет свободный слот новой
+
+        Args:
+            job_id: Идентификатор выполняющейся задачи
+            stage: STAGE_NETWORK или STAGE_CPU
+        """
+        current = self._stages.get(job_id)
+        if current == stage:
+            return
+        if current is not None:
+            self._slots[current].release()
+            del self._stages[job_id]
+        await self._slots[stage].acquire()
+        self._stages[job_id] = stage
+        logging.debug(f"[QUEUE] Задача {job_id} перешла в стадию {stage}")
+
+    def enter_stage_threadsafe(self, job_id: str, stage: str):
+        """Вариант enter_stage для вызова из потока (например, из хуков yt-dlp)"""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.enter_stage(job_id, stage), self._loop).result()
+
+    def leave_stage(self, job_id: str):
+        """
+        Освобождает слот текущей стадии задачи (например, пока она ждет места
+        на диске); вернуться в стадию можно через enter_stage
+        """
+        stage = self._stages.pop(job_id, None)
+        if stage is not None:
+            self._slots[stage].release()
+
+    async def _worker(self, number: int):
+        """Воркер: выполняет задачи из очереди по одной"""
+        while True:
+            job_id = await self._queue.get()
+            try:
+                # Задача могла быть отменена, пока ждала в очереди
+                if job_id not in self._pending:
+                    continue
+
+                # Пока задача ждет сетевой слот, она остается в очереди и ее можно отменить
+                await self.enter_stage(job_id, STAGE_NETWORK)
+                if job_id not in self._pending:
+                    self.leave_stage(job_id)
+                    logging.info(f"[QUEUE] Задача {job_id} отменена до начала выполнения")
+                    continue
+                args = self._pending.pop(job_id)
+                logging.info(f"[QUEUE] Воркер {number} начал задачу {job_id}, в очереди: {len(self._pending)}")
+                task = asyncio.ensure_future(self.handler(job_id, *args))
+                self._running[job_id] = task
+                try:
+                    await task
+                    self.completed += 1
+                except asyncio.CancelledError:
+                    # Прерванная задача не останавливает воркер; отмену самого воркера (stop) пропускаем дальше
+                    if job_id not in self._aborted or asyncio.current_task().cancelling():
+                        raise
+                    self.aborted += 1
+                    logging.info(f"[QUEUE] Задача {job_id} прервана")
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"[QUEUE] Ошибка в задаче {job_id}: {str(e)}")
+                    # Ошибка обработчика при остановке воркера не должна поглотить его отмену
+                    if asyncio.current_task().cancelling():
+                        raise asyncio.CancelledError() from e
+                finally:
+                    self._running.pop(job_id, None)
+                    self._aborted.discard(job_id)
+                    self.leave_stage(job_id)
+            finally:
+                self._queue.task_done()
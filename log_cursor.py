@@ -0,0 +1,140 @@
+"""
+Инкрементальное чтение логов загрузок yt-dlp.
+
+Определение зависших загрузок раньше на каждый опрос статуса читало лог
+загрузки целиком и искало последнюю строку "[download] xx.x%" по всему
+тексту. LogCursors хранит для каждого лога смещение прочитанной части,
+последний найденный прогресс и признак завершения, поэтому опрос читает
+только дописанные байты. Для еще не прочитанного лога последнее значение
+ищется чтением блоков с конца файла. Объем чтения за опрос ограничен и не
+зависит от размера лога.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional
+
+PROGRESS_PATTERN = re.compile(rb"\[download\]\s+(\d+\.\d+)%")
+# Признаки завершенной загрузки в логе
+COMPLETION_MARKERS = (b"download] 100%", b"[FixupM3u8] Fixing MPEG-TS in MP4 container")
+
+class LogState(NamedTuple):
+    """Результат чтения лога загрузки"""
+    progress: Optional[float]  # Последний прогресс из строки "[download] xx.x%"
+    completed: bool  # В логе встречался признак завершения
+    mtime: float  # Время последнего изменения лога
+    size: int
+
+class _Cursor:
+    __slots__ = ("inode", "offset", "tail", "progress", "completed")
+
+    def __init__(self, inode: int):
+        self.inode = inode
+        self.offset = 0  # Прочитано байт
+        self.tail = b""  # Незавершенная последняя строка
+        self.progress: Optional[float] = None
+        self.completed = False
+
+class LogCursors:
+    """Позиции чтения логов загрузок и найденный в них прогресс"""
+
+    def __init__(self, block_size: int = 64 * 1024, max_read: int = 1024 * 1024, max_entries: int = 1024):
+        """
+        Args:
+            block_size: Размер блока чтения в байтах
+            max_read: Максимум байт, читаемых за один опрос
+            max_entries: Максимум отслеживаемых логов (вытесняются давно опрошенные)
+        """
+        self.block_size = block_size
+        self.max_read = max_read
+        self.max_entries = max_entries
+        self._cursors: "OrderedDict[str, _Cursor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_read = 0
+
+    def read(self, log_path: str) -> Optional[LogState]:
+        """
+        Читает дописанную часть лога (блокирующий вызов, выполняется в потоке)
+
+        Args:
+            log_path: Путь к логу загрузки
+
+        Returns:
+            Optional[LogState]: Состояние лога или None, если лога нет
+        """
+        with self._lock:
+            try:
+                stat_result = os.stat(log_path)
+            except OSError:
+                self._cursors.pop(log_path, None)
+                return None
+
+            cursor = self._cursors.get(log_path)
+            if cursor is None or cursor.inode != stat_result.st_ino or stat_result.st_size < cursor.offset:
+                # Новый, пересозданный или усеченный лог
+                cursor = _Cursor(stat_result.st_ino)
+                self._cursors[log_path] = cursor
+            self._cursors.move_to_end(log_path)
+            while len(self._cursors) > self.max_entries:
+                self._cursors.popitem(last=False)
+
+            size = stat_result.st_size
+            if size > cursor.offset:
+                with open(log_path, "rb") as f:
+                    if cursor.offset == 0 and size > self.block_size:
+                        self._scan_backwards(f, cursor, size)
+                    else:
+                        self._scan_forward(f, cursor, size)
+                cursor.offset = size
+
+            return LogState(cursor.progress, cursor.completed, stat_result.st_mtime, size)
+
+    def _scan_forward(self, f, cursor: _Cursor, size: int):
+        """Разбирает байты, дописанные после предыдущего опроса"""
+        start = max(cursor.offset, size - self.max_read)
+        if start > cursor.offset:
+            # Дописано больше max_read: важна только последняя часть
+            cursor.tail = b""
+        f.seek(start)
+        data = f.read(size - start)
+        self.bytes_read += len(data)
+        self._parse(cursor, cursor.tail + data)
+
+    def _scan_backwards(self, f, cursor: _Cursor, size: int):
+        """Ищет последний прогресс блоками от конца лога, не дальше max_read байт"""
+        end = size
+        data = b""
+        while end > 0 and size - end < self.max_read:
+            start = max(0, end - self.block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            self.bytes_read += end - start
+            end = start
+            if PROGRESS_PATTERN.search(data) or any(marker in data for marker in COMPLETION_MARKERS):
+                break
+        self._parse(cursor, data)
+
+    @staticmethod
+    def _parse(cursor: _Cursor, data: bytes):
+        # Последняя строка может быть дописана не полностью: разбираем ее при следующем опросе
+        boundary = max(data.rfind(b"\n"), data.rfind(b"\r")) + 1
+        complete, cursor.tail = data[:boundary], data[boundary:][-1024:]
+
+        if not cursor.completed and any(marker in complete for marker in COMPLETION_MARKERS):
+            cursor.completed = True
+        last = None
+        for last in PROGRESS_PATTERN.finditer(complete):
+            pass
+        if last is not None:
+            cursor.progress = float(last.group(1))
+
+    def discard(self, log_path: str):
+        """Забывает позицию чтения лога (например, после его удаления)"""
+        with self._lock:
+            self._cursors.pop(log_path, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние для метрик"""
+        return {"tracked": len(self._cursors), "bytes_read": self.bytes_read}
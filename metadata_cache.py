@@ -0,0 +1,170 @@
+"""
+Кеш информации о видео, извлеченной yt-dlp.
+
+extract_info загружает страницу, разбирает JS плеера и перечисляет форматы.
+Результат (без выбора форматов) хранится по нормализованному URL заданное
+время и используется эндпоинтом /api/info и загрузками, которые начинаются
+через process_ie_result без повторного извлечения. Время жизни записи
+не превышает срока действия подписанных ссылок форматов (параметр expire).
+"""
+
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from single_flight import normalize_url
+
+# Поля информации о видео, которые возвращает /api/info
+INFO_FIELDS = ("id", "title", "duration", "thumbnail", "uploader", "extractor", "webpage_url", "upload_date", "view_count")
+FORMAT_FIELDS = ("format_id", "ext", "width", "height", "fps", "vcodec", "acodec", "filesize", "filesize_approx", "tbr")
+
+def signed_url_expiry(info: Dict[str, Any]) -> Optional[float]:
+    """
+    Наименьший срок действия подписанных ссылок форматов (параметр expire)
+
+    Returns:
+        Optional[float]: Unix-время или None, если ссылки не ограничены по времени
+    """
+    expiry = None
+    for fmt in info.get("formats") or ():
+        url = fmt.get("url") if isinstance(fmt, dict) else None
+        if not url or "expire" not in url:
+            continue
+        values = parse_qs(urlsplit(url).query).get("expire")
+        try:
+            expire = float(values[0]) if values else None
+        except ValueError:
+            continue
+        if expire is not None and (expiry is None or expire < expiry):
+            expiry = expire
+    return expiry
+
+def is_single_video(info: Optional[Dict[str, Any]]) -> bool:
+    """
+    Информация об отдельном видео, а не о плейлисте или ссылке на другую страницу
+
+    Только такую информацию можно передать загрузке вместо повторного
+    извлечения: sanitize_info удаляет entries плейлистов.
+    """
+    return isinstance(info, dict) and info.get("_type", "video") == "video"
+
+def summarize_info(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Краткая информация о видео и его форматах для клиента"""
+    summary = {field: info[field] for field in INFO_FIELDS if info.get(field) is not None}
+    summary["formats"] = [
+        {field: fmt[field] for field in FORMAT_FIELDS if fmt.get(field) is not None}
+        for fmt in info.get("formats") or () if isinstance(fmt, dict)
+    ]
+    return summary
+
+class MetadataCache:
+    """TTL-кеш информации о видео с ограничением числа записей"""
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 256, expiry_margin: float = 300.0):
+        """
+        Args:
+            ttl: Время жизни записи в секундах (0 - кеш отключен)
+            max_entries: Максимальное количество записей (вытесняются давно использованные)
+            expiry_margin: Запас до истечения подписанных ссылок в секундах
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.expiry_margin = expiry_margin
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Информация о видео или None, если записи нет или она устарела"""
+        key = normalize_url(url)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, info = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return info
+
+    def put(self, url: str, info: Dict[str, Any]) -> bool:
+        """
+        Сохраняет информацию о видео
+
+        Сохраняется только информация об отдельном видео; время жизни
+        сокращается до срока действия подписанных ссылок форматов.
+
+        Returns:
+            bool: True, если информация сохранена
+        """
+        if self.ttl <= 0 or not is_single_video(info):
+            return False
+        now = time.time()
+        expires_at = now + self.ttl
+        signed_expiry = signed_url_expiry(info)
+        if signed_expiry is not None:
+            expires_at = min(expires_at, signed_expiry - self.expiry_margin)
+        if expires_at <= now:
+            return False
+
+        key = normalize_url(url)
+        self._entries[key] = (expires_at, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def discard(self, url: str):
+        """Удаляет информацию о видео (например, если ее ссылки перестали работать)"""
+        self._entries.pop(normalize_url(url), None)
+
+    async def get_or_load(self, url: str, loader: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Возвращает информацию из кеша или загружает ее
+
+        Одновременные запросы одного URL ждут одного вызова loader.
+
+        Args:
+            url: URL видео
+            loader: Корутина извлечения информации
+
+        Returns:
+            Tuple[Dict[str, Any], bool]: Информация и признак попадания в кеш
+        """
+        info = self.get(url)
+        if info is not None:
+            return info, True
+
+        key = normalize_url(url)
+        loading = self._loading.get(key)
+        if loading is not None:
+            return await asyncio.shield(loading), False
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            info = await loader()
+            self.put(url, info)
+            future.set_result(info)
+            return info, False
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение передается ожидающим; без них не логируем его как необработанное
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние кеша для метрик"""
+        return {
+            "entries": len(self._entries),
+            "loading": len(self._loading),
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -7,6 +7,7 @@ from datetime import datetime
 class DownloadStatus(str, Enum):
     INITIALIZING = "initializing"  # Начальная инициализация
     PENDING = "pending"            # Ожидание начала загрузки
+    WAITING_FOR_SPACE = "waiting_for_space"  # Ожидание свободного места на диске
     DOWNLOADING = "downloading"    # Процесс загрузки
     CONVERTING = "converting"      # Конвертация видео
     PROCESSING = "processing"      # Обработка видео
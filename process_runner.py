@@ -0,0 +1,159 @@
+"""
+Асинхронный запуск внешних процессов (yt-dlp, ffprobe).
+
+Вывод процесса читается неблокирующе и разбивается на строки как по \n, так
+и по \r (yt-dlp обновляет строку прогресса возвратом каретки). Строки
+пишутся в лог пакетами через aiofiles, поэтому длительная загрузка не
+блокирует цикл событий.
+"""
+
+import re
+import time
+import codecs
+import asyncio
+import inspect
+import logging
+import subprocess
+from typing import Awaitable, Callable, List, Optional, Sequence, Union
+import aiofiles
+
+LineHandler = Callable[[str], Union[None, Awaitable[None]]]
+
+_LINE_SEPARATOR = re.compile(r"\r\n|\r|\n")
+_READ_CHUNK_SIZE = 64 * 1024
+
+async def terminate_process(process: asyncio.subprocess.Process, timeout: float = 5.0):
+    """
+    Завершает процесс: сначала SIGTERM, после таймаута SIGKILL
+
+    Args:
+        process: Запущенный процесс
+        timeout: Время ожидания корректного завершения в секундах
+    """
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=timeout)
+            return
+        except asyncio.TimeoutError:
+            logging.warning(f"[PROCESS] Процесс {process.pid} не завершился за {timeout} с, отправляем SIGKILL")
+        process.kill()
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+async def _read_lines(stream: asyncio.StreamReader, on_line: Callable[[str], Awaitable[None]]):
+    """Читает поток блоками и передает строки обработчику"""
+    # Символ UTF-8, разрезанный границей блока, декодируется вместе со следующим блоком
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    tail = ""
+    while True:
+        chunk = await stream.read(_READ_CHUNK_SIZE)
+        parts = _LINE_SEPARATOR.split(tail + decoder.decode(chunk, final=not chunk))
+        tail = parts.pop()
+        for line in parts:
+            if line:
+                await on_line(line)
+        if not chunk:
+            break
+    if tail:
+        await on_line(tail)
+
+async def run_process(
+    cmd: Sequence[str],
+    log_file: Optional[str] = None,
+    on_line: Optional[LineHandler] = None,
+    timeout: Optional[float] = None,
+    check: bool = False,
+    terminate_timeout: float = 5.0,
+    flush_lines: int = 50,
+    flush_interval: float = 0.5,
+    cwd: Optional[str] = None
+) -> int:
+    """
+    Запускает процесс и построчно обрабатывает его вывод (stdout и stderr)
+
+    Args:
+        cmd: Команда и аргументы
+        log_file: Файл, в который пишется вывод процесса
+        on_line: Обработчик строки вывода (функция или корутина)
+        timeout: Максимальное время выполнения в секундах
+        check: Выбросить CalledProcessError при ненулевом коде возврата
+        terminate_timeout: Время ожидания завершения процесса после SIGTERM
+        flush_lines: Количество строк, после которого буфер лога записывается в файл
+        flush_interval: Максимальное время хранения строк в буфере лога в секундах
+        cwd: Рабочая директория процесса
+
+    Returns:
+        int: Код возврата процесса
+
+    Raises:
+        subprocess.TimeoutExpired: Процесс не завершился за timeout секунд
+        subprocess.CalledProcessError: Ненулевой код возврата при check=True
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd
+    )
+    logging.info(f"[PROCESS] Запущен процесс {process.pid}: {cmd[0]}")
+
+    log = await aiofiles.open(log_file, "w") if log_file else None
+    buffer: List[str] = []
+    last_flush = time.monotonic()
+
+    async def flush_log():
+        nonlocal last_flush
+        if log is not None and buffer:
+            await log.write("\n".join(buffer) + "\n")
+            await log.flush()
+            buffer.clear()
+        last_flush = time.monotonic()
+
+    async def handle_line(line: str):
+        if log is not None:
+            buffer.append(line)
+            if len(buffer) >= flush_lines or time.monotonic() - last_flush >= flush_interval:
+                await flush_log()
+        if on_line is not None:
+            result = on_line(line)
+            if inspect.isawaitable(result):
+                await result
+
+    try:
+        try:
+            await asyncio.wait_for(_read_lines(process.stdout, handle_line), timeout=timeout)
+            returncode = await process.wait()
+        except asyncio.TimeoutError:
+            logging.error(f"[PROCESS] Процесс {process.pid} превысил таймаут {timeout} с")
+            await terminate_process(process, terminate_timeout)
+            raise subprocess.TimeoutExpired(list(cmd), timeout)
+    finally:
+        # Процесс завершается и при отмене задачи, которая его ждет
+        if process.returncode is None:
+            await asyncio.shield(terminate_process(process, terminate_timeout))
+        if log is not None:
+            await flush_log()
+            await log.close()
+
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, list(cmd))
+    return returncode
+
+async def capture_output(cmd: Sequence[str], timeout: Optional[float] = None) -> str:
+    """
+    Запускает процесс и возвращает его вывод
+
+    Args:
+        cmd: Команда и аргументы
+        timeout: Максимальное время выполнения в секундах
+
+    Returns:
+        str: Вывод процесса (stdout и stderr)
+    """
+    lines: List[str] = []
+    await run_process(cmd, on_line=lines.append, timeout=timeout)
+    return "\n".join(lines)
@@ -0,0 +1,422 @@
+"""
+Шина событий прогресса загрузок.
+
+Производители (хуки yt-dlp, разбор вывода процессов) публикуют события в
+шину, потребители (хранилище, эндпоинты статуса и потоковой передачи)
+подписываются на одну загрузку или на все сразу. Последнее событие каждой
+загрузки кешируется, поэтому текущий прогресс доступен без чтения файлов
+и хранилища. Изменения из других процессов сервиса передает в шину
+ProgressRelay.
+
+Каждое событие получает версию (поле version) из общего возрастающего
+счетчика, поэтому версии загрузки не повторяются даже после удаления ее
+события из кеша. Версия входит в ETag ответов о состоянии загрузки вместе
+с хешем их содержимого, а запросы с ожиданием просыпаются при ее
+изменении (wait_for_version).
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Dict, NamedTuple, Optional, Set
+from metrics import measure_time
+from models import DownloadStatus
+
+# Статусы, после которых прогресс загрузки больше не меняется
+TERMINAL_STATUSES = {
+    DownloadStatus.COMPLETED.value,
+    DownloadStatus.ERROR.value,
+    DownloadStatus.CANCELLED.value,
+}
+
+class ProgressEvent(NamedTuple):
+    """Событие прогресса"""
+    download_id: str
+    data: Dict[str, Any]
+    persist: bool  # Событие еще не записано в хранилище
+
+class Subscription:
+    """Подписка на события одной загрузки (или всех, если download_id=None)"""
+
+    def __init__(self, bus: "ProgressBus", download_id: Optional[str], maxsize: int):
+        self.download_id = download_id
+        self.dropped = 0
+        self._bus = bus
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def _put(self, event: ProgressEvent):
+        # Медленный подписчик теряет самые старые события: актуально последнее значение
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[ProgressEvent]:
+        """
+        Ждет следующее событие
+
+        Args:
+            timeout: Время ожидания в секундах
+
+        Returns:
+            Optional[ProgressEvent]: Событие или None, если время ожидания истекло
+        """
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def get_nowait(self) -> Optional[ProgressEvent]:
+        """Возвращает событие из очереди или None, если очередь пуста"""
+        try:
+            return self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    def close(self):
+        """Отписывается от шины"""
+        self._bus._unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ProgressEvent:
+        return await self._queue.get()
+
+class ProgressBus:
+    """Шина событий прогресса с темами по загрузкам и кешем последних значений"""
+
+    def __init__(self, queue_size: int = 100, retain_seconds: float = 300.0):
+        """
+        Args:
+            queue_size: Размер очереди подписчика
+            retain_seconds: Время хранения последнего события завершенной загрузки
+        """
+        self.queue_size = queue_size
+        self.retain_seconds = retain_seconds
+        self._last: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._sequence = 0
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._topics: Dict[Optional[str], Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+
+    def _bind_loop(self):
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+
+    def publish(self, download_id: str, data: Dict[str, Any], persist: bool = True):
+        """
+        Публикует событие (вызывается из цикла событий)
+
+        Args:
+            download_id: ID загрузки
+            data: Изменившиеся поля состояния (status, progress, error ...)
+            persist: Событие должно быть записано в хранилище подписчиком-хранилищем
+        """
+        self._bind_loop()
+        self._sequence += 1
+        version = self._versions[download_id] = self._sequence
+        data = {**self._last.get(download_id, {}), **data, "updated_at": time.time(), "version": version}
+        self._last[download_id] = data
+        self.published += 1
+
+        for waiter in self._waiters.pop(download_id, ()):
+            if not waiter.done():
+                waiter.set_result(version)
+
+        event = ProgressEvent(download_id, data, persist)
+        for subscription in self._topics.get(download_id, ()):
+            subscription._put(event)
+        for subscription in self._topics.get(None, ()):
+            subscription._put(event)
+
+        if data.get("status") in TERMINAL_STATUSES and self._loop is not None:
+            self._loop.call_later(self.retain_seconds, self._expire, download_id, data["updated_at"])
+
+    def publish_threadsafe(self, download_id: str, data: Dict[str, Any], persist: bool = True):
+        """Публикует событие из другого потока (например, из хука yt-dlp)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            logging.debug(f"[PROGRESS] Нет цикла событий для публикации события {download_id}")
+            return
+        loop.call_soon_threadsafe(self.publish, download_id, data, persist)
+
+    def get_last(self, download_id: str) -> Optional[Dict[str, Any]]:
+        """Последнее событие загрузки"""
+        data = self._last.get(download_id)
+        return dict(data) if data is not None else None
+
+    def get_version(self, download_id: str) -> int:
+        """Текущая версия загрузки (0, если событий не было или они устарели)"""
+        return self._versions.get(download_id, 0)
+
+    async def wait_for_version(self, download_id: str, version: int, timeout: float) -> int:
+        """
+        Ждет, пока версия загрузки станет отличной от version
+
+        Args:
+            download_id: ID загрузки
+            version: Версия, известная клиенту
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            int: Текущая версия (равна version, если время ожидания истекло)
+        """
+        current = self.get_version(download_id)
+        if current != version or timeout <= 0:
+            return current
+
+        self._bind_loop()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(download_id, set()).add(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            return self.get_version(download_id)
+        finally:
+            waiters = self._waiters.get(download_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[download_id]
+
+    def subscribe(self, download_id: Optional[str] = None) -> Subscription:
+        """
+        Подписывается на события
+
+        Args:
+            download_id: ID загрузки; None - события всех загрузок
+
+        Returns:
+            Subscription: Подписка (закрывается через close() или контекстный менеджер)
+        """
+        self._bind_loop()
+        subscription = Subscription(self, download_id, self.queue_size)
+        self._topics.setdefault(download_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        subscribers = self._topics.get(subscription.download_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._topics[subscription.download_id]
+
+    def discard(self, download_id: str):
+        """
+        Удаляет последнее событие загрузки из кеша
+
+        Событие завершенной загрузки удаляется само через retain_seconds;
+        события зависших и удаленных загрузок удаляются вместе с их записью
+        (очистка хранилища вызывает discard).
+        """
+        self._last.pop(download_id, None)
+        self._versions.pop(download_id, None)
+
+    def _expire(self, download_id: str, updated_at: float):
+        # Не удаляем событие, если после завершения загрузка была перезапущена
+        data = self._last.get(download_id)
+        if data is not None and data.get("updated_at") == updated_at:
+            del self._last[download_id]
+            self._versions.pop(download_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние шины для метрик"""
+        return {
+            "published": self.published,
+            "cached": len(self._last),
+            "waiters": sum(len(waiters) for waiters in self._waiters.values()),
+            "subscribers": sum(len(subscribers) for subscribers in self._topics.values())
+        }
+
+class ProgressPersister:
+    """
+    Подписчик, записывающий события шины в хранилище.
+
+    Частые события одной загрузки объединяются: за один проход в хранилище
+    записывается только последнее значение.
+    """
+
+    def __init__(self, bus: ProgressBus, storage, interval: float = 0.5):
+        """
+        Args:
+            bus: Шина событий
+            storage: Хранилище состояний (метод update_item)
+            interval: Минимальный интервал между проходами записи в секундах
+        """
+        self.bus = bus
+        self.storage = storage
+        self.interval = interval
+        self._subscription: Optional[Subscription] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._finished: Dict[str, float] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @measure_time()
+    async def start(self):
+        """Запускает запись событий в хранилище"""
+        if self.running:
+            return
+        self._subscription = self.bus.subscribe()
+        self._task = asyncio.create_task(self._run())
+
+    @measure_time()
+    async def stop(self):
+        """Останавливает запись и сохраняет накопленные события"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._subscription is not None:
+            self._collect()
+            self._subscription.close()
+            self._subscription = None
+        await self._write_pending()
+
+    async def finish(self, download_id: str):
+        """
+        Прекращает запись событий загрузки перед записью итогового состояния.
+
+        Дожидается текущей записи загрузки и отбрасывает ее необработанные
+        события, чтобы они не перезаписали итоговое состояние.
+        """
+        async with self._lock(download_id):
+            self._pending.pop(download_id, None)
+            self._finished[download_id] = time.monotonic()
+
+    def _lock(self, download_id: str) -> asyncio.Lock:
+        lock = self._locks.get(download_id)
+        if lock is None:
+            lock = self._locks[download_id] = asyncio.Lock()
+        return lock
+
+    def _collect(self):
+        """Забирает накопленные события из подписки, оставляя последнее по каждой загрузке"""
+        while True:
+            event = self._subscription.get_nowait()
+            if event is None:
+                break
+            if event.persist:
+                self._pending[event.download_id] = event.data
+
+    async def _write_pending(self):
+        pending, self._pending = self._pending, {}
+        for download_id, data in pending.items():
+            async with self._lock(download_id):
+                if download_id in self._finished:
+                    continue
+                try:
+                    await self.storage.update_item(download_id, data)
+                except Exception as e:
+                    logging.error(f"[PROGRESS] Ошибка записи прогресса {download_id}: {str(e)}")
+
+    def _prune_finished(self):
+        cutoff = time.monotonic() - self.bus.retain_seconds
+        for download_id in [key for key, finished_at in self._finished.items() if finished_at < cutoff]:
+            del self._finished[download_id]
+            self._locks.pop(download_id, None)
+
+    async def _run(self):
+        while True:
+            try:
+                event = await self._subscription.get()
+                if event.persist:
+                    self._pending[event.download_id] = event.data
+                self._collect()
+                await self._write_pending()
+                self._prune_finished()
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"[PROGRESS] Ошибка в записи прогресса: {str(e)}")
+                await asyncio.sleep(1)
+
+# Глобальная шина событий прогресса
+progress_bus = ProgressBus()
+
+class ProgressRelay:
+    """
+    Передает в шину изменения записей, сделанные другими процессами сервиса.
+
+    Хранилище с уведомлениями (RedisStateStorage.subscribe) сообщает об
+    изменениях записей из всех воркеров; события из них публикуются в шину
+    без записи в хранилище, поэтому клиенты получают прогресс загрузки,
+    даже если она выполняется в другом процессе.
+    """
+
+    def __init__(self, bus: ProgressBus, storage, fields=("status", "progress", "speed", "eta", "error", "log")):
+        """
+        Args:
+            bus: Шина событий
+            storage: Хранилище с асинхронным итератором subscribe()
+            fields: Поля записи, которые передаются в событие
+        """
+        self.bus = bus
+        self.storage = storage
+        self.fields = fields
+        self._task: Optional[asyncio.Task] = None
+        self.relayed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Запускает передачу изменений в шину"""
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает передачу изменений"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def relay(self, download_id: str, value: Any):
+        """Публикует изменение записи в шину (value=None - запись удалена)"""
+        if value is None:
+            self.bus.discard(download_id)
+            return
+        if not isinstance(value, dict):
+            return
+        data = {field: value[field] for field in self.fields if field in value}
+        if data:
+            self.bus.publish(download_id, data, persist=False)
+            self.relayed += 1
+
+    async def _run(self):
+        while True:
+            try:
+                async for download_id, value in self.storage.subscribe():
+                    if download_id:
+                        self.relay(download_id, value)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"[PROGRESS] Ошибка получения изменений хранилища: {str(e)}")
+            # Подписка оборвалась: переподключаемся
+            await asyncio.sleep(1)
@@ -0,0 +1,234 @@
+"""
+Прореживание обновлений прогресса загрузок.
+
+Хуки yt-dlp и цикл чтения HTTP-ответа сообщают прогресс десятки раз в
+секунду. ProgressReporter объединяет такие обновления по загрузкам:
+дальше передается только обновление, в котором прогресс сдвинулся на
+min_delta процентов, изменился статус или прошло min_interval секунд с
+предыдущей передачи. Завершающие статусы передаются всегда. Последнее
+придержанное обновление передается по таймеру, поэтому итоговый
+прогресс не теряется.
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+from enum import Enum
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Union
+from progress_bus import TERMINAL_STATUSES
+
+EmitHandler = Callable[[str, Dict[str, Any]], Union[None, Awaitable[None]]]
+
+class _Track:
+    """Состояние передачи обновлений одной загрузки"""
+    __slots__ = ("last", "last_emit", "queue", "held", "task", "timer", "closed")
+
+    def __init__(self):
+        self.last: Optional[Dict[str, Any]] = None  # Последнее принятое к передаче обновление
+        self.last_emit = 0.0
+        self.queue: Deque[Dict[str, Any]] = deque()  # Обновления, ожидающие передачи по порядку
+        self.held: Optional[Dict[str, Any]] = None  # Придержанное обновление
+        self.task: Optional[asyncio.Task] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.closed = False  # Принят завершающий статус
+
+class ProgressReporter:
+    """Объединяет частые обновления прогресса и передает их обработчику"""
+
+    def __init__(
+        self,
+        emit: EmitHandler,
+        min_delta: float = 1.0,
+        min_interval: float = 1.0,
+        retain_seconds: float = 30.0
+    ):
+        """
+        Args:
+            emit: Обработчик обновления (функция или корутина): emit(download_id, update)
+            min_delta: Изменение прогресса в процентах, после которого обновление передается сразу
+            min_interval: Максимальный интервал между передачами обновлений в секундах
+            retain_seconds: Время, в течение которого обновления завершенной загрузки отбрасываются
+        """
+        self.emit = emit
+        self.min_delta = min_delta
+        self.min_interval = min_interval
+        self.retain_seconds = retain_seconds
+        self._tracks: Dict[str, _Track] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.emitted = 0
+        self.dropped = 0
+
+    def report(
+        self,
+        download_id: str,
+        status: str,
+        progress: Optional[float] = None,
+        error: Optional[str] = None,
+        **fields
+    ) -> bool:
+        """
+        Сообщает обновление прогресса (вызывается из цикла событий)
+
+        Args:
+            download_id: ID загрузки
+            status: Статус загрузки
+            progress: Прогресс загрузки (0-100)
+            error: Сообщение об ошибке
+            **fields: Дополнительные поля (speed, eta ...)
+
+        Returns:
+            bool: True, если обновление передается сразу, False - если придержано или отброшено
+        """
+        self._loop = asyncio.get_running_loop()
+        status = status.value if isinstance(status, Enum) else status
+        update = {"status": status}
+        if progress is not None:
+            update["progress"] = progress
+        if error:
+            update["error"] = error
+        update.update(fields)
+
+        track = self._tracks.get(download_id)
+        if track is None:
+            track = self._tracks[download_id] = _Track()
+        elif track.closed:
+            # Запоздавшее обновление уже завершенной загрузки
+            self.dropped += 1
+            return False
+
+        if track.held is not None:
+            self.dropped += 1
+            track.held = None
+
+        terminal = status in TERMINAL_STATUSES
+        if terminal or self._is_due(track, update):
+            track.closed = terminal
+            self._cancel_timer(track)
+            self._accept(download_id, track, update)
+            return True
+
+        track.held = update
+        if track.timer is None:
+            delay = max(0.0, track.last_emit + self.min_interval - time.monotonic())
+            track.timer = self._loop.call_later(delay, self._on_timer, download_id, track)
+        return False
+
+    def report_threadsafe(self, download_id: str, status: str, progress: Optional[float] = None,
+                          error: Optional[str] = None, **fields):
+        """Вариант report для вызова из потока (например, из хука yt-dlp)"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            logging.debug(f"[PROGRESS] Нет цикла событий для обновления {download_id}")
+            return
+        loop.call_soon_threadsafe(lambda: self.report(download_id, status, progress, error, **fields))
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Задает цикл событий для report_threadsafe до первого вызова report"""
+        self._loop = loop
+
+    def _is_due(self, track: _Track, update: Dict[str, Any]) -> bool:
+        last = track.last
+        if last is None or last.get("status") != update["status"] or last.get("error") != update.get("error"):
+            return True
+        if time.monotonic() - track.last_emit >= self.min_interval:
+            return True
+        progress = update.get("progress")
+        last_progress = last.get("progress")
+        if progress is None or last_progress is None:
+            return progress is not last_progress
+        return abs(progress - last_progress) >= self.min_delta
+
+    @staticmethod
+    def _cancel_timer(track: _Track):
+        if track.timer is not None:
+            track.timer.cancel()
+            track.timer = None
+
+    def _accept(self, download_id: str, track: _Track, update: Dict[str, Any]):
+        """Ставит обновление в очередь передачи"""
+        track.last = update
+        track.last_emit = time.monotonic()
+        track.queue.append(update)
+        if track.task is None or track.task.done():
+            track.task = asyncio.create_task(self._drain(download_id, track))
+
+    def _on_timer(self, download_id: str, track: _Track):
+        track.timer = None
+        if track.held is not None and not track.closed:
+            update, track.held = track.held, None
+            self._accept(download_id, track, update)
+
+    async def _drain(self, download_id: str, track: _Track):
+        """Передает обновления загрузки по одному, сохраняя их порядок"""
+        while track.queue:
+            update = track.queue.popleft()
+            self.emitted += 1
+            try:
+                result = self.emit(download_id, update)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logging.error(f"[PROGRESS] Ошибка передачи прогресса {download_id}: {str(e)}")
+
+        if track.closed:
+            self._loop.call_later(self.retain_seconds, self._release, download_id, track)
+
+    def _release(self, download_id: str, track: _Track):
+        if self._tracks.get(download_id) is track:
+            del self._tracks[download_id]
+
+    def _discard(self, track: _Track):
+        self._cancel_timer(track)
+        self.dropped += len(track.queue) + (track.held is not None)
+        track.queue.clear()
+        track.held = None
+
+    async def flush(self, download_id: Optional[str] = None):
+        """
+        Передает придержанные обновления и дожидается их обработки
+
+        Args:
+            download_id: ID загрузки; None - все загрузки
+        """
+        ids = [download_id] if download_id is not None else list(self._tracks)
+        for key in ids:
+            track = self._tracks.get(key)
+            if track is None:
+                continue
+            self._cancel_timer(track)
+            if track.held is not None:
+                update, track.held = track.held, None
+                self._accept(key, track, update)
+            if track.task is not None:
+                await track.task
+
+    def finish(self, download_id: str):
+        """
+        Закрывает загрузку, итоговое состояние которой записано в обход reporter:
+        непереданные и последующие обновления отбрасываются
+        """
+        track = self._tracks.get(download_id)
+        if track is None:
+            track = self._tracks[download_id] = _Track()
+        self._discard(track)
+        if not track.closed:
+            track.closed = True
+            loop = self._loop or asyncio.get_running_loop()
+            loop.call_later(self.retain_seconds, self._release, download_id, track)
+
+    def forget(self, download_id: str):
+        """Сбрасывает состояние загрузки (например, перед ее повторным запуском)"""
+        track = self._tracks.pop(download_id, None)
+        if track is not None:
+            self._discard(track)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики для метрик"""
+        return {
+            "emitted": self.emitted,
+            "dropped": self.dropped,
+            "pending": sum(len(track.queue) + (track.held is not None) for track in self._tracks.values()),
+            "tracked": len(self._tracks)
+        }
@@ -0,0 +1,256 @@
+"""
+Учет места на диске для загрузок.
+
+Перед запуском загрузка резервирует ожидаемый размер файла (по filesize
+или filesize_approx из extract_info) с запасом на объединение и
+конвертацию ffmpeg, которым нужны одновременно исходные и итоговый файлы.
+Если свободного места с учетом уже зарезервированного не хватает,
+удаляются давно использованные готовые файлы. Загрузка, которой места
+не хватит даже на пустом диске, отклоняется сразу; остальные ждут
+освобождения места ограниченное время. Так загрузка не обрывается на
+середине объединения из-за заполненного диска.
+
+Байты, уже записанные загрузкой (record_written), занимают место на диске
+и уменьшают свободное место сами, поэтому из доступного места вычитается
+только незаписанный остаток каждого резерва.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from file_index import FileIndex
+
+DiskSpaceGetter = Callable[[str], Awaitable[Tuple[int, int]]]
+WaitHandler = Callable[[int, int], Awaitable[None]]
+
+class QuotaExceededError(Exception):
+    """Для загрузки недостаточно места на диске"""
+
+def estimate_download_size(info: Optional[Dict[str, Any]]) -> Optional[int]:
+    """
+    Оценивает размер загружаемого файла по информации о видео
+
+    Берется размер самого большого формата со звуком и видео (или любого
+    формата, если таких нет): это верхняя граница для выбора "best".
+    Размер формата - filesize, filesize_approx или битрейт, умноженный на длительность.
+
+    Returns:
+        Optional[int]: Размер в байтах или None, если оценить нельзя
+    """
+    if not info:
+        return None
+    size = info.get("filesize") or info.get("filesize_approx")
+    if size:
+        return int(size)
+
+    duration = info.get("duration") or 0
+    complete, other = [], []
+    for fmt in info.get("formats") or ():
+        if not isinstance(fmt, dict):
+            continue
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size and fmt.get("tbr") and duration:
+            size = fmt["tbr"] * 1000 / 8 * duration
+        if not size:
+            continue
+        has_video = fmt.get("vcodec") not in (None, "none")
+        has_audio = fmt.get("acodec") not in (None, "none")
+        (complete if has_video and has_audio else other).append(int(size))
+    sizes = complete or other
+    return max(sizes) if sizes else None
+
+class QuotaManager:
+    """Резервирование места на диске под загрузки"""
+
+    def __init__(
+        self,
+        downloads_dir: str,
+        disk_space: DiskSpaceGetter,
+        file_index: Optional[FileIndex] = None,
+        min_free_bytes: int = 400 * 1024 * 1024,
+        reserve_factor: float = 2.0,
+        default_estimate: int = 200 * 1024 * 1024,
+        wait_timeout: float = 600.0,
+        poll_interval: float = 5.0,
+        protect: Optional[Callable[[str], bool]] = None,
+        on_evict: Optional[Callable[[str, str], Awaitable[None]]] = None
+    ):
+        """
+        Args:
+            downloads_dir: Директория загрузок
+            disk_space: Корутина, возвращающая (общее, свободное) место в байтах для пути
+            file_index: Индекс готовых файлов, из которого удаляются давно использованные файлы
+            min_free_bytes: Место, которое всегда остается свободным
+            reserve_factor: Множитель ожидаемого размера (исходные файлы и результат ffmpeg)
+            default_estimate: Ожидаемый размер, если оценить его по информации о видео нельзя
+            wait_timeout: Максимальное ожидание свободного места в секундах
+            poll_interval: Интервал повторной проверки места при ожидании
+            protect: Функция, возвращающая True для файлов, которые удалять нельзя
+            on_evict: Корутина, вызываемая для загрузки, файл которой удален ради места: on_evict(download_id, path)
+        """
+        self.downloads_dir = downloads_dir
+        self.disk_space = disk_space
+        self.file_index = file_index
+        self.min_free_bytes = min_free_bytes
+        self.reserve_factor = reserve_factor
+        self.default_estimate = default_estimate
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.protect = protect
+        self.on_evict = on_evict
+        self._reservations: Dict[str, int] = {}
+        self._written: Dict[str, Dict[str, int]] = {}  # Записанные байты загрузок по файлам
+        self._lock = asyncio.Lock()
+        self._waiters: Set[asyncio.Future] = set()  # Загрузки, ждущие освобождения места
+        self.rejected = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._reservations.values())
+
+    @property
+    def outstanding_bytes(self) -> int:
+        """Незаписанный остаток резервов: место, которое загрузки еще займут"""
+        return sum(
+            max(0, required - sum(self._written.get(download_id, {}).values()))
+            for download_id, required in self._reservations.items()
+        )
+
+    def record_written(self, download_id: str, filename: str, written: int):
+        """
+        Отмечает байты, записанные загрузкой в файл (по событиям прогресса)
+
+        Args:
+            download_id: ID загрузки
+            filename: Файл, в который пишет загрузка (у форматов видео и звука - разные)
+            written: Записано байт в этот файл
+        """
+        if download_id in self._reservations and written:
+            self._written.setdefault(download_id, {})[filename] = int(written)
+
+    def required_bytes(self, expected_size: Optional[int]) -> int:
+        """Объем резерва для загрузки ожидаемого размера"""
+        return int((expected_size or self.default_estimate) * self.reserve_factor)
+
+    async def reserve(
+        self,
+        download_id: str,
+        expected_size: Optional[int],
+        on_wait: Optional[WaitHandler] = None
+    ) -> int:
+        """
+        Резервирует место под загрузку
+
+        Args:
+            download_id: ID загрузки
+            expected_size: Ожидаемый размер файла (None - default_estimate)
+            on_wait: Корутина, вызываемая один раз перед ожиданием места: on_wait(нужно, доступно)
+
+        Returns:
+            int: Зарезервировано байт
+
+        Raises:
+            QuotaExceededError: Места не хватит даже на пустом диске или оно не освободилось за wait_timeout
+        """
+        required = self.required_bytes(expected_size)
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            async with self._lock:
+                total, free = await self.disk_space(self.downloads_dir)
+                if required > total - self.min_free_bytes:
+                    self.rejected += 1
+                    raise QuotaExceededError(
+                        f"Недостаточно места на диске: требуется {required // 2 ** 20} МБ, "
+                        f"объем диска {total // 2 ** 20} МБ"
+                    )
+
+                available = free - self.min_free_bytes - self.outstanding_bytes
+                if available < required:
+                    await self.evict(required - available)
+                    _, free = await self.disk_space(self.downloads_dir)
+                    available = free - self.min_free_bytes - self.outstanding_bytes
+                if available >= required:
+                    self._reservations[download_id] = required
+                    logging.info(f"[QUOTA] Зарезервировано {required // 2 ** 20} МБ для {download_id}")
+                    return required
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.rejected += 1
+                raise QuotaExceededError(
+                    f"Недостаточно места на диске: требуется {required // 2 ** 20} МБ, "
+                    f"доступно {max(0, available) // 2 ** 20} МБ"
+                )
+            if not waiting:
+                waiting = True
+                logging.warning(f"[QUOTA] Загрузка {download_id} ждет места: требуется {required} байт, доступно {available}")
+                if on_wait is not None:
+                    await on_wait(required, max(0, available))
+            # Место проверяется снова после снятия резерва или через poll_interval (его могла освободить очистка)
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+
+    def release(self, download_id: str):
+        """Снимает резерв загрузки (после ее завершения, ошибки или отмены)"""
+        self._written.pop(download_id, None)
+        if self._reservations.pop(download_id, None) is not None:
+            self._wake()
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def evict(self, needed: int) -> int:
+        """
+        Удаляет давно использованные готовые файлы, пока не освободится needed байт
+
+        Returns:
+            int: Освобождено байт
+        """
+        if self.file_index is None:
+            return 0
+        freed = 0
+        for download_id, entry in self.file_index.lru():
+            if freed >= needed:
+                break
+            if download_id in self._reservations or (self.protect is not None and self.protect(entry["path"])):
+                continue
+            try:
+                await asyncio.to_thread(os.remove, entry["path"])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"[QUOTA] Ошибка при удалении файла {entry['path']}: {str(e)}")
+                continue
+            self.file_index.discard(download_id)
+            freed += entry["size"]
+            self.evicted_files += 1
+            self.evicted_bytes += entry["size"]
+            logging.info(f"[QUOTA] Удален давно использованный файл {entry['path']} ({entry['size']} байт)")
+            if self.on_evict is not None:
+                await self.on_evict(download_id, entry["path"])
+        return freed
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние для метрик"""
+        return {
+            "reservations": len(self._reservations),
+            "reserved_bytes": self.reserved_bytes,
+            "outstanding_bytes": self.outstanding_bytes,
+            "waiting": len(self._waiters),
+            "rejected": self.rejected,
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes
+        }
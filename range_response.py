@@ -0,0 +1,193 @@
+"""
+Отдача файлов с поддержкой HTTP Range (206 Partial Content).
+
+Плеер браузера при перемотке и клиент при докачке запрашивают части
+файла заголовком Range. RangeFileResponse отвечает на одиночные и
+множественные (multipart/byteranges) диапазоны, учитывает If-Range и
+всегда передает Content-Length. Если сервер поддерживает расширение ASGI
+http.response.zerocopysend, данные передаются через sendfile без
+копирования в Python; иначе файл читается блоками по 1 МБ, выровненными
+по границе блока.
+"""
+
+import os
+import stat
+import anyio
+import uuid
+from typing import BinaryIO, List, Optional, Tuple
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 1024 * 1024  # Размер и выравнивание блока чтения
+MAX_RANGES = 16  # Запрос с большим числом диапазонов получает файл целиком
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+def parse_range_header(value: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Разбирает заголовок Range
+
+    Args:
+        value: Значение заголовка Range
+        size: Размер файла в байтах
+
+    Returns:
+        Optional[List[Tuple[int, int]]]: Отсортированные диапазоны (start, end) включительно,
+            с объединенными пересечениями; [] - ни один диапазон не попадает в файл (416);
+            None - заголовок отсутствует или некорректен (отдается весь файл)
+    """
+    if not value:
+        return None
+    unit, _, ranges_spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not ranges_spec.strip():
+        return None
+
+    specs = [spec.strip() for spec in ranges_spec.split(",") if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+            return None
+        if first == "":
+            # Суффикс: последние N байт
+            if last == "":
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(0, size - length), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            end = min(end, size - 1)
+        if start < size:
+            ranges.append((start, end))
+
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class RangeFileResponse(FileResponse):
+    """FileResponse с поддержкой Range, If-Range и передачи через sendfile"""
+
+    chunk_size = CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stat_result = self.stat_result
+        if stat_result is None:
+            try:
+                stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            if not stat.S_ISREG(stat_result.st_mode):
+                raise RuntimeError(f"File at path {self.path} is not a file.")
+            self.set_stat_headers(stat_result)
+        size = stat_result.st_size
+        self.headers.setdefault("accept-ranges", "bytes")
+
+        request_headers = Headers(scope=scope)
+        ranges = None
+        if self.status_code == 200 and self._if_range_matches(request_headers.get("if-range")):
+            ranges = parse_range_header(request_headers.get("range"), size)
+
+        header_only = self.send_header_only or scope.get("method", "").upper() == "HEAD"
+        if ranges is None:
+            segments = [(None, 0, size)]
+        elif not ranges:
+            await self._send_unsatisfiable(size, send)
+            return
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+            segments = [(None, start, end - start + 1)]
+        else:
+            self.status_code = 206
+            segments = self._multipart_segments(ranges, size)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            zerocopy = ZEROCOPY_EXTENSION in (scope.get("extensions") or {})
+            file = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                for prefix, offset, count in segments:
+                    if prefix:
+                        await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                    if not count:
+                        continue
+                    if zerocopy:
+                        await send({
+                            "type": ZEROCOPY_EXTENSION, "file": file,
+                            "offset": offset, "count": count, "more_body": True
+                        })
+                    else:
+                        await self._send_chunks(file, offset, count, send)
+            finally:
+                file.close()
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+    def _if_range_matches(self, if_range: Optional[str]) -> bool:
+        """Диапазон применяется, только если файл не изменился с указанной в If-Range версии"""
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith("W/"):
+            return False
+        return if_range.strip('"') == self.headers.get("etag", "").strip('"') or if_range == self.headers.get("last-modified")
+
+    def _multipart_segments(self, ranges: List[Tuple[int, int]], size: int) -> List[Tuple[bytes, int, int]]:
+        """Части ответа multipart/byteranges: заголовок части, смещение и длина данных"""
+        boundary = uuid.uuid4().hex
+        media_type = self.media_type or "application/octet-stream"
+        segments = []
+        for index, (start, end) in enumerate(ranges):
+            prefix = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            segments.append(((b"\r\n" if index else b"") + prefix, start, end - start + 1))
+        segments.append((f"\r\n--{boundary}--\r\n".encode("latin-1"), 0, 0))
+
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(sum(len(prefix) + count for prefix, _, count in segments))
+        return segments
+
+    async def _send_unsatisfiable(self, size: int, send: Send):
+        self.status_code = 416
+        self.headers["content-range"] = f"bytes */{size}"
+        self.headers["content-length"] = "0"
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_chunks(self, file: BinaryIO, offset: int, count: int, send: Send):
+        """Читает диапазон блоками, выровненными по chunk_size (одно обращение к потоку на блок)"""
+        end = offset + count
+        while offset < end:
+            length = min(self.chunk_size - offset % self.chunk_size, end - offset)
+            chunk = await anyio.to_thread.run_sync(_read_at, file, offset, length)
+            if not chunk:
+                break
+            offset += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+def _read_at(file: BinaryIO, offset: int, length: int) -> bytes:
+    file.seek(offset)
+    return file.read(length)
@@ -0,0 +1,446 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+from enum import Enum
+from typing import Dict, Any, Callable, Optional, List, AsyncIterator, Tuple
+from contextlib import asynccontextmanager
+from metrics import measure_time
+from state_storage import get_record_timestamp, get_record_status
+from expiry import remove_record_files
+
+# Поле хеша для записей, которые не являются словарем
+_SCALAR_FIELD = "__value__"
+# Повторы транзакции, если записи изменил другой воркер между чтением и записью
+WATCH_RETRIES = 32
+
+def _watch_errors() -> Tuple[type, ...]:
+    """Исключения клиентов Redis о конфликте WATCH"""
+    errors = []
+    try:
+        from redis.exceptions import WatchError
+        errors.append(WatchError)
+    except ImportError:
+        pass
+    try:
+        from aioredis.exceptions import WatchError as AioredisWatchError
+        errors.append(AioredisWatchError)
+    except Exception:
+        # aioredis не установлен или не импортируется на Python >= 3.11
+        pass
+    return tuple(errors)
+
+_WATCH_ERRORS = _watch_errors()
+
+def _create_client(url: str):
+    """Создает асинхронный клиент Redis"""
+    try:
+        import redis.asyncio as aioredis
+    except ImportError:
+        # Отдельный пакет aioredis работает только на Python < 3.11
+        import aioredis
+    return aioredis.from_url(url, decode_responses=True)
+
+class RedisStateStorage:
+    """
+    Хранилище состояний загрузок в Redis.
+
+    Повторяет асинхронный интерфейс StateStorage, но не держит состояние в
+    памяти процесса, поэтому все воркеры и машины видят одни и те же данные.
+
+    Раскладка ключей (prefix по умолчанию "downloads"):
+        {prefix}:item:{key}      - хеш с полями записи (значения в JSON)
+        {prefix}:keys            - множество всех ключей
+        {prefix}:status:{status} - множество ключей с данным статусом
+        {prefix}:statuses        - множество встречавшихся статусов
+        {prefix}:expiry          - sorted set ключей по времени последнего изменения
+        {prefix}:progress        - канал pub/sub с уведомлениями об изменениях
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "downloads", client=None):
+        """
+        Инициализация хранилища
+
+        Args:
+            url: Адрес сервера Redis
+            prefix: Префикс ключей и каналов
+            client: Готовый асинхронный клиент (например, для тестов)
+        """
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+        self._owns_client = client is None
+        self._initialized = False
+        # Отметка уведомлений этого экземпляра, чтобы не получать свои изменения обратно
+        self.instance_id = uuid.uuid4().hex
+
+    # ==================== Ключи Redis ====================
+
+    def _item_key(self, key: str) -> str:
+        return f"{self.prefix}:item:{key}"
+
+    def _status_key(self, status: Optional[str]) -> str:
+        return f"{self.prefix}:status:{status}"
+
+    @property
+    def _keys_key(self) -> str:
+        return f"{self.prefix}:keys"
+
+    @property
+    def _statuses_key(self) -> str:
+        return f"{self.prefix}:statuses"
+
+    @property
+    def _expiry_key(self) -> str:
+        return f"{self.prefix}:expiry"
+
+    @property
+    def progress_channel(self) -> str:
+        return f"{self.prefix}:progress"
+
+    # ==================== Сериализация ====================
+
+    @staticmethod
+    def _encode(value: Any) -> Dict[str, str]:
+        """Преобразует запись в поля хеша"""
+        if isinstance(value, dict):
+            return {
+                field: json.dumps(item.value if isinstance(item, Enum) else item, separators=(',', ':'))
+                for field, item in value.items()
+            }
+        return {_SCALAR_FIELD: json.dumps(value, separators=(',', ':'))}
+
+    @staticmethod
+    def _decode(fields: Dict[str, str]) -> Any:
+        """Восстанавливает запись из полей хеша"""
+        if not fields:
+            return None
+        if _SCALAR_FIELD in fields:
+            return json.loads(fields[_SCALAR_FIELD])
+        return {field: json.loads(item) for field, item in fields.items()}
+
+    def _queue_write(self, pipe, key: str, old_value: Any, new_value: Any, changed: Dict[str, str]):
+        """Добавляет в pipeline запись ключа вместе с обновлением индексов"""
+        if changed:
+            pipe.hset(self._item_key(key), mapping=changed)
+        pipe.sadd(self._keys_key, key)
+
+        old_status = get_record_status(old_value) if old_value is not None else None
+        new_status = get_record_status(new_value)
+        if old_value is not None and old_status != new_status:
+            pipe.srem(self._status_key(old_status), key)
+        if new_status is not None:
+            pipe.sadd(self._status_key(new_status), key)
+            pipe.sadd(self._statuses_key, new_status)
+
+        timestamp = get_record_timestamp(new_value)
+        if timestamp is not None:
+            pipe.zadd(self._expiry_key, {key: timestamp})
+        else:
+            pipe.zrem(self._expiry_key, key)
+
+        self._queue_notify(pipe, key, new_value)
+
+    def _queue_notify(self, pipe, key: str, value: Any):
+        """Добавляет в pipeline уведомление об изменении записи (value=None - запись удалена)"""
+        pipe.publish(self.progress_channel, json.dumps(
+            {"key": key, "value": value, "origin": self.instance_id},
+            separators=(',', ':'),
+            default=str
+        ))
+
+    def _queue_delete(self, pipe, key: str, old_value: Any):
+        """Добавляет в pipeline удаление ключа вместе с индексами"""
+        pipe.delete(self._item_key(key))
+        pipe.srem(self._keys_key, key)
+        status = get_record_status(old_value)
+        if status is not None:
+            pipe.srem(self._status_key(status), key)
+        pipe.zrem(self._expiry_key, key)
+        self._queue_notify(pipe, key, None)
+
+    async def _transaction(self, keys: List[str], queue: Callable[[Any, Dict[str, Any]], Any]) -> Any:
+        """
+        Выполняет read-modify-write записей одной транзакцией
+
+        Ключи записей отслеживаются WATCH до чтения, поэтому если другой воркер
+        изменит запись между чтением и EXEC, транзакция отменяется и повторяется
+        с новым значением. Так индексы статусов и времени изменения всегда
+        соответствуют записи, а одновременные изменения не теряют поля.
+
+        Args:
+            keys: Ключи записей
+            queue: Функция queue(pipe, current), добавляющая команды в pipeline по текущим записям
+
+        Returns:
+            Any: Результат queue
+        """
+        for _ in range(WATCH_RETRIES):
+            async with self._client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(*(self._item_key(key) for key in keys))
+                    current = await self._get_many(keys)
+                    pipe.multi()
+                    result = queue(pipe, current)
+                    await pipe.execute()
+                    return result
+                except _WATCH_ERRORS:
+                    continue
+        raise RuntimeError(f"Не удалось изменить записи {keys}: постоянные конфликты с другими воркерами")
+
+    # ==================== Жизненный цикл ====================
+
+    @measure_time()
+    async def initialize(self):
+        """Подключается к Redis и проверяет соединение"""
+        try:
+            if self._client is None:
+                self._client = _create_client(self.url)
+            await self._client.ping()
+            self._initialized = True
+            logging.info(f"[STATE] Redis хранилище инициализировано: {self.url}")
+        except ImportError:
+            logging.error("[STATE] Клиент Redis не установлен (пакет redis или aioredis)")
+            self._initialized = False
+            raise
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при подключении к Redis: {str(e)}")
+            self._initialized = False
+            raise
+
+    @measure_time()
+    async def stop(self):
+        """Закрывает соединение с Redis"""
+        if self._client is not None and self._owns_client:
+            await self._client.close()
+            self._client = None
+        self._initialized = False
+
+    async def _ensure_initialized(self) -> bool:
+        """Ленивая инициализация для вызовов до старта приложения"""
+        if self._initialized:
+            return True
+        try:
+            await self.initialize()
+        except Exception as e:
+            logging.error(f"[STATE] Не удалось инициализировать хранилище: {e}")
+        return self._initialized
+
+    # ==================== Операции с записями ====================
+
+    @measure_time()
+    async def get_item(self, key: str) -> Optional[Dict]:
+        """Получить значение по ключу"""
+        if not await self._ensure_initialized():
+            return None
+        try:
+            return self._decode(await self._client.hgetall(self._item_key(key)))
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка чтения состояния: {str(e)}")
+            return None
+
+    @measure_time()
+    async def set_item(self, key: str, value: Any, flush: bool = False):
+        """Устанавливает состояние по ключу. Запись фиксируется сразу, flush оставлен для совместимости."""
+        if not self._initialized:
+            logging.error("[STATE] Попытка установить состояние до инициализации")
+            raise RuntimeError("RedisStateStorage не инициализирован")
+
+        def queue(pipe, current: Dict[str, Any]):
+            pipe.delete(self._item_key(key))
+            self._queue_write(pipe, key, current.get(key), value, self._encode(value))
+
+        try:
+            await self._transaction([key], queue)
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при установке состояния для {key}: {str(e)}")
+            raise
+
+    @measure_time()
+    async def update_item(self, key: str, value: Any = None, flush: bool = False, **kwargs):
+        """
+        Обновляет существующее состояние по ключу. Допускает передачу дополнительных полей как именованных аргументов.
+        Записываются только переданные поля, поэтому одновременные изменения разных полей не затирают друг друга.
+        """
+        if not await self._ensure_initialized():
+            logging.error("[STATE] Хранилище не инициализировано, операция update_item не выполнена.")
+            return
+
+        if kwargs:
+            if value is None:
+                value = {}
+            if isinstance(value, dict):
+                value.update(kwargs)
+            else:
+                value = kwargs
+
+        def queue(pipe, records: Dict[str, Any]) -> Any:
+            current = records.get(key)
+            if isinstance(current, dict) and isinstance(value, dict):
+                new_value = {**current, **value}
+            else:
+                new_value = value
+                pipe.delete(self._item_key(key))
+            self._queue_write(pipe, key, current, new_value, self._encode(value))
+            return current
+
+        try:
+            if await self._transaction([key], queue) is None:
+                logging.warning(f"[STATE] Попытка обновить несуществующий ключ: {key}")
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при обновлении состояния для {key}: {str(e)}")
+            raise
+
+    @measure_time()
+    async def delete_item(self, key: str):
+        """Удаляет состояние по ключу"""
+        if not await self._ensure_initialized():
+            return
+        await self._transaction([key], lambda pipe, current: self._queue_delete(pipe, key, current.get(key)))
+
+    async def _get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Читает несколько записей одним pipeline"""
+        if not keys:
+            return {}
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(self._item_key(key))
+            results = await pipe.execute()
+        return {key: self._decode(fields) for key, fields in zip(keys, results) if fields}
+
+    async def get_all_items(self) -> Dict:
+        """Получает все состояния"""
+        if not await self._ensure_initialized():
+            return {}
+        return await self._get_many(sorted(await self._client.smembers(self._keys_key)))
+
+    async def get_items(self, keys: List[str]) -> Dict[str, Any]:
+        """Получает состояния по списку ключей одним pipeline"""
+        if not await self._ensure_initialized():
+            return {}
+        return await self._get_many(list(dict.fromkeys(keys)))
+
+    async def count_by_status(self) -> Dict[Optional[str], int]:
+        """Возвращает количество записей по каждому статусу"""
+        if not await self._ensure_initialized():
+            return {}
+        statuses = sorted(await self._client.smembers(self._statuses_key))
+        if not statuses:
+            return {}
+        async with self._client.pipeline(transaction=False) as pipe:
+            for status in statuses:
+                pipe.scard(self._status_key(status))
+            counts = await pipe.execute()
+        return {status: count for status, count in zip(statuses, counts) if count}
+
+    async def get_keys_by_status(self, status: str) -> List[str]:
+        """Возвращает ключи записей с указанным статусом"""
+        if isinstance(status, Enum):
+            status = status.value
+        if not await self._ensure_initialized():
+            return []
+        return list(await self._client.smembers(self._status_key(status)))
+
+    async def get_items_by_status(self, status: str) -> Dict[str, Any]:
+        """Возвращает записи с указанным статусом"""
+        return await self._get_many(await self.get_keys_by_status(status))
+
+    @asynccontextmanager
+    async def atomic_operation(self):
+        """
+        Операция со всем состоянием.
+
+        Изменения применяются одной транзакцией, но чтение состояния не
+        блокирует другие воркеры.
+        """
+        await self._ensure_initialized()
+        before = await self.get_all_items()
+        state = json.loads(json.dumps(before))
+        try:
+            yield state
+        except Exception as e:
+            logging.error(f"[STATE] Error in atomic operation: {str(e)}", exc_info=True)
+            raise
+
+        async with self._client.pipeline(transaction=True) as pipe:
+            for key in before.keys() - state.keys():
+                self._queue_delete(pipe, key, before[key])
+            for key, value in state.items():
+                if key not in before or before[key] != value:
+                    pipe.delete(self._item_key(key))
+                    self._queue_write(pipe, key, before.get(key), value, self._encode(value))
+            await pipe.execute()
+
+    @measure_time()
+    async def cleanup_old_items(self, max_age_hours: float = 0.5, remove_files: bool = False) -> Dict[str, Any]:  # 30 минут по умолчанию
+        """
+        Очищает старые состояния по sorted set времени изменения
+
+        Args:
+            max_age_hours: Максимальное время с последнего изменения записи в часах
+            remove_files: Удалить также файлы загрузок (поле file_path) удаленных записей
+
+        Returns:
+            Dict[str, Any]: Удаленные записи
+        """
+        if not await self._ensure_initialized():
+            return {}
+
+        cutoff = time.time() - max_age_hours * 3600
+        keys = list(await self._client.zrangebyscore(self._expiry_key, "-inf", f"({cutoff}"))
+        if not keys:
+            return {}
+
+        def queue(pipe, current: Dict[str, Any]) -> Dict[str, Any]:
+            # Запись могла измениться после выборки из sorted set: удаляются только все еще устаревшие
+            expired = {}
+            for key in keys:
+                value = current.get(key)
+                timestamp = get_record_timestamp(value)
+                if timestamp is not None and timestamp >= cutoff:
+                    continue
+                self._queue_delete(pipe, key, value)
+                if value is not None:
+                    expired[key] = value
+            return expired
+
+        expired = await self._transaction(keys, queue)
+
+        for key in expired:
+            logging.info(f"[STATE] Удален ключ: {key}")
+        if expired:
+            logging.info(f"[STATE] Удалено {len(expired)} старых записей")
+            if remove_files:
+                await asyncio.to_thread(remove_record_files, expired)
+        return expired
+
+    # ==================== Уведомления ====================
+
+    async def subscribe(self, include_own: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Подписка на изменения записей из всех воркеров
+
+        Args:
+            include_own: Получать и изменения, сделанные этим экземпляром
+
+        Yields:
+            Tuple[str, Any]: Ключ и новое значение записи (None - запись удалена)
+        """
+        await self._ensure_initialized()
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(self.progress_channel)
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                if not include_own and data.get("origin") == self.instance_id:
+                    continue
+                yield data.get("key"), data.get("value")
+        finally:
+            await pubsub.unsubscribe(self.progress_channel)
+            await pubsub.close()
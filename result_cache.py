@@ -0,0 +1,227 @@
+"""
+Кеш результатов завершенных загрузок.
+
+Ключ кеша - нормализованный URL, формат и качество (как у объединения
+загрузок в single_flight), значение - путь к готовому файлу и его
+метаданные. Повторный запрос того же видео сразу получает завершенную
+загрузку. Файлы кеша не удаляются очисткой по возрасту: при превышении
+бюджета байт вытесняются файлы, к которым дольше всего не обращались.
+Индекс кеша хранится в JSON-файле и переживает перезапуск.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+class ResultCache:
+    """LRU-кеш готовых файлов с ограничением суммарного размера"""
+
+    def __init__(
+        self,
+        max_bytes: int,
+        index_path: Optional[str] = None,
+        on_remove: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            max_bytes: Бюджет суммарного размера файлов кеша в байтах (0 - кеш отключен)
+            index_path: Файл индекса кеша; None - индекс только в памяти
+            on_remove: Функция, вызываемая с путем каждого вытесненного файла
+        """
+        self.max_bytes = max_bytes
+        self.index_path = index_path
+        self.on_remove = on_remove
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # От давно использованных к недавним
+        self._paths: Dict[str, str] = {}  # Путь файла -> ключ
+        self._lock = asyncio.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def is_cached(self, file_path: str) -> bool:
+        """Защищен ли файл от очистки по возрасту"""
+        return os.path.abspath(file_path) in self._paths
+
+    async def load(self):
+        """Загружает индекс, пропуская записи, файлы которых удалены"""
+        if not self.index_path:
+            return
+
+        def _read() -> List[Dict[str, Any]]:
+            try:
+                with open(self.index_path, "r") as f:
+                    entries = json.load(f)
+            except FileNotFoundError:
+                return []
+            valid = []
+            for entry in entries:
+                try:
+                    entry["size"] = os.path.getsize(entry["file_path"])
+                except OSError:
+                    continue
+                valid.append(entry)
+            return valid
+
+        async with self._lock:
+            try:
+                entries = await asyncio.to_thread(_read)
+            except (ValueError, TypeError, KeyError) as e:
+                logging.error(f"[CACHE] Поврежденный индекс кеша {self.index_path}: {str(e)}")
+                entries = []
+            self._entries.clear()
+            self._paths.clear()
+            self.total_bytes = 0
+            for entry in sorted(entries, key=lambda entry: entry.get("last_access", 0)):
+                self._add(entry)
+            evicted = self._evict_over_budget()
+            await self._remove_files(evicted)
+            if evicted:
+                await self._save()
+        logging.info(f"[CACHE] Загружено записей кеша: {len(self._entries)}, размер: {self.total_bytes} байт")
+
+    def _add(self, entry: Dict[str, Any]):
+        self._entries[entry["key"]] = entry
+        self._paths[entry["file_path"]] = entry["key"]
+        self.total_bytes += entry["size"]
+
+    def _pop(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._paths.pop(entry["file_path"], None)
+            self.total_bytes -= entry["size"]
+        return entry
+
+    def _evict_over_budget(self, keep: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Вытесняет давно использованные записи, пока размер кеша превышает бюджет"""
+        evicted = []
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key != keep:
+                evicted.append(self._pop(key))
+        self.evictions += len(evicted)
+        return evicted
+
+    async def _remove_files(self, entries: List[Dict[str, Any]]):
+        for entry in entries:
+            try:
+                await asyncio.to_thread(os.remove, entry["file_path"])
+                if self.on_remove is not None:
+                    self.on_remove(entry["file_path"])
+                logging.info(f"[CACHE] Вытеснен файл {entry['file_path']} ({entry['size']} байт)")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"[CACHE] Ошибка при удалении файла {entry['file_path']}: {str(e)}")
+
+    async def _save(self):
+        if not self.index_path:
+            return
+        entries = [dict(entry) for entry in self._entries.values()]
+
+        def _write():
+            temp_path = f"{self.index_path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(entries, f, separators=(',', ':'))
+            os.replace(temp_path, self.index_path)
+
+        try:
+            await asyncio.to_thread(_write)
+        except Exception as e:
+            logging.error(f"[CACHE] Ошибка при сохранении индекса кеша: {str(e)}")
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает запись кеша и отмечает обращение к ней
+
+        Returns:
+            Optional[Dict[str, Any]]: Запись (file_path, size, download_id и метаданные) или None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if not await asyncio.to_thread(os.path.exists, entry["file_path"]):
+            # Файл удален в обход кеша
+            async with self._lock:
+                self._pop(key)
+                await self._save()
+            self.misses += 1
+            return None
+
+        entry["last_access"] = time.time()
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry)
+
+    async def put(self, key: str, file_path: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Добавляет готовый файл в кеш и вытесняет файлы сверх бюджета
+
+        Args:
+            key: Ключ кеша
+            file_path: Путь к готовому файлу
+            metadata: Метаданные загрузки (download_id, original_filename ...)
+
+        Returns:
+            bool: True, если файл добавлен в кеш
+        """
+        if not self.enabled:
+            return False
+        file_path = os.path.abspath(file_path)
+        try:
+            size = await asyncio.to_thread(os.path.getsize, file_path)
+        except OSError:
+            return False
+        if size > self.max_bytes:
+            logging.info(f"[CACHE] Файл {file_path} ({size} байт) больше бюджета кеша")
+            return False
+
+        now = time.time()
+        entry = {**(metadata or {}), "key": key, "file_path": file_path, "size": size,
+                 "created_at": now, "last_access": now}
+        async with self._lock:
+            self._pop(key)
+            previous_key = self._paths.get(file_path)
+            if previous_key is not None:
+                self._pop(previous_key)
+            self._add(entry)
+            evicted = self._evict_over_budget(keep=key)
+            await self._remove_files(evicted)
+            await self._save()
+        return True
+
+    async def discard(self, key: str):
+        """Удаляет запись из кеша, не удаляя файл"""
+        async with self._lock:
+            if self._pop(key) is not None:
+                await self._save()
+
+    async def discard_file(self, file_path: str):
+        """Удаляет запись файла, удаленного в обход кеша"""
+        async with self._lock:
+            key = self._paths.get(os.path.abspath(file_path))
+            if key is not None:
+                self._pop(key)
+                await self._save()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние кеша для метрик"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,165 @@
+"""
+Объединение одинаковых загрузок, выполняющихся одновременно.
+
+Запросы одного и того же видео (после нормализации URL) с одинаковыми
+форматом и качеством присоединяются к уже выполняющейся загрузке: вместо
+новой задачи создается запись-псевдоним (alias_of) со своим download_id,
+которая использует прогресс и итоговый файл основной загрузки.
+
+Отмена основной загрузки не прерывает ее, пока к ней присоединены другие
+запросы: после завершения ее запись отмечается отмененной, а результат
+переходит первому присоединенному запросу.
+"""
+
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Параметры запроса, которые не влияют на загружаемое видео
+_IGNORED_PARAMS = ("utm_", "fbclid", "gclid", "si", "feature", "ref", "t")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def _is_ignored_param(name: str) -> bool:
+    name = name.lower()
+    return any(name == param or (param.endswith("_") and name.startswith(param)) for param in _IGNORED_PARAMS)
+
+def normalize_url(url: str) -> str:
+    """
+    Приводит URL видео к каноническому виду
+
+    Схема и хост приводятся к нижнему регистру, http заменяется на https,
+    убираются префиксы www./m., фрагмент, отслеживающие параметры и
+    завершающий слеш. Ссылки youtu.be и youtube.com/shorts приводятся к
+    youtube.com/watch?v=ID.
+
+    Args:
+        url: URL видео
+
+    Returns:
+        str: Нормализованный URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    if scheme == "http":
+        scheme = "https"
+
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or port == _DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+
+    path = parts.path.rstrip("/") or "/"
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not _is_ignored_param(key)]
+
+    if host == "youtu.be" and path != "/":
+        netloc, query = "youtube.com", [("v", path.lstrip("/"))]
+        path = "/watch"
+    elif host == "youtube.com" and path.startswith("/shorts/"):
+        query = [("v", path[len("/shorts/"):])]
+        path = "/watch"
+    elif host == "youtube.com" and path == "/watch":
+        query = [(key, value) for key, value in query if key == "v"]
+
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
+
+def make_flight_key(url: str, format: Optional[str] = None, quality: Optional[str] = None) -> str:
+    """Ключ объединения загрузок: нормализованный URL, формат и качество"""
+    return f"{normalize_url(url)}|{format or ''}|{quality or ''}"
+
+class SingleFlight:
+    """Реестр выполняющихся загрузок и присоединенных к ним запросов"""
+
+    def __init__(self):
+        self._primary: Dict[str, str] = {}  # Ключ -> ID основной загрузки
+        self._keys: Dict[str, str] = {}  # ID основной загрузки -> ключ
+        self._aliases: Dict[str, List[str]] = {}  # ID основной загрузки -> ID псевдонимов
+        self._abandoned: Set[str] = set()  # Основные загрузки, отмененные их запросом
+        self.joined = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """ID выполняющейся загрузки с таким ключом"""
+        return self._primary.get(key)
+
+    def start(self, key: str, download_id: str):
+        """Регистрирует новую основную загрузку"""
+        self._primary[key] = download_id
+        self._keys[download_id] = key
+        self._aliases[download_id] = []
+
+    def get_key(self, download_id: str) -> Optional[str]:
+        """Ключ выполняющейся загрузки"""
+        return self._keys.get(download_id)
+
+    def attach(self, download_id: str, alias_id: str):
+        """Присоединяет запрос alias_id к выполняющейся загрузке"""
+        self._aliases[download_id].append(alias_id)
+        self.joined += 1
+
+    def get_primary(self, alias_id: str) -> Optional[str]:
+        """ID загрузки, к которой присоединен запрос"""
+        for download_id, aliases in self._aliases.items():
+            if alias_id in aliases:
+                return download_id
+        return None
+
+    def has_aliases(self, download_id: str) -> bool:
+        """Присоединены ли к загрузке другие запросы"""
+        return bool(self._aliases.get(download_id))
+
+    def abandon(self, download_id: str) -> bool:
+        """
+        Отмечает основную загрузку отмененной ее запросом
+
+        Returns:
+            bool: True, если к загрузке присоединены другие запросы и она
+                должна продолжиться для них
+        """
+        if not self.has_aliases(download_id):
+            return False
+        self._abandoned.add(download_id)
+        return True
+
+    def is_abandoned(self, download_id: str) -> bool:
+        """Отменена ли основная загрузка ее запросом"""
+        return download_id in self._abandoned
+
+    def detach(self, alias_id: str) -> bool:
+        """
+        Отсоединяет запрос от загрузки (например, при его отмене)
+
+        Returns:
+            bool: True, если alias_id был присоединен к загрузке
+        """
+        for aliases in self._aliases.values():
+            if alias_id in aliases:
+                aliases.remove(alias_id)
+                return True
+        return False
+
+    def complete(self, download_id: str) -> List[str]:
+        """
+        Снимает загрузку с регистрации после ее завершения
+
+        Returns:
+            List[str]: ID присоединенных запросов
+        """
+        self._abandoned.discard(download_id)
+        key = self._keys.pop(download_id, None)
+        if key is not None and self._primary.get(key) == download_id:
+            del self._primary[key]
+        return self._aliases.pop(download_id, [])
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние реестра для метрик"""
+        return {
+            "in_flight": len(self._primary),
+            "aliases": sum(len(aliases) for aliases in self._aliases.values()),
+            "abandoned": len(self._abandoned),
+            "joined": self.joined
+        }
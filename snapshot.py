@@ -0,0 +1,132 @@
+"""
+Формат снимка состояния хранилища.
+
+Бинарный снимок начинается с сигнатуры SNAPSHOT_MAGIC, за которой следуют
+записи вида:
+
+    длина (4 байта, big-endian) | CRC32 (4 байта) | JSON [ключ, значение]
+
+Каждая запись проверяется отдельно, поэтому при чтении поврежденного файла
+теряются только записи после первого испорченного места, а не весь снимок.
+Файлы без сигнатуры читаются как JSON прежних версий.
+
+Служебные данные снимка (например, номер последней записи журнала, которую
+он уже содержит) хранятся под ключом SNAPSHOT_META_KEY: в бинарном формате
+первой записью, в JSON - ключом словаря.
+"""
+
+import os
+import json
+import struct
+import logging
+import zlib
+from typing import Dict, Any, Iterator, Optional, Tuple, BinaryIO
+
+SNAPSHOT_MAGIC = b"DMSNAP1\n"
+SNAPSHOT_FORMATS = ("json", "binary")
+SNAPSHOT_META_KEY = "__snapshot__"
+
+_HEADER = struct.Struct(">II")
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+class SnapshotError(Exception):
+    """Снимок не удалось прочитать"""
+
+def _encode_record(key: str, value: Any) -> bytes:
+    payload = json.dumps([key, value], separators=(',', ':')).encode("utf-8")
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+def write_snapshot(
+    path: str,
+    state: Dict[str, Any],
+    snapshot_format: str = "binary",
+    meta: Optional[Dict[str, Any]] = None
+):
+    """
+    Записывает снимок состояния в файл и синхронизирует его с диском
+
+    Args:
+        path: Путь к файлу
+        state: Состояние хранилища
+        snapshot_format: "binary" - записи с контрольными суммами, "json" - компактный JSON
+        meta: Служебные данные снимка (читаются через read_snapshot)
+    """
+    with open(path, "wb", buffering=_WRITE_BUFFER_SIZE) as f:
+        if snapshot_format == "json":
+            document = {SNAPSHOT_META_KEY: meta, **state} if meta else state
+            f.write(json.dumps(document, separators=(',', ':')).encode("utf-8"))
+        else:
+            f.write(SNAPSHOT_MAGIC)
+            if meta:
+                f.write(_encode_record(SNAPSHOT_META_KEY, meta))
+            for key, value in state.items():
+                f.write(_encode_record(key, value))
+        f.flush()
+        os.fsync(f.fileno())
+
+def _iter_records(f: BinaryIO, path: str) -> Iterator[Tuple[str, Any]]:
+    count = 0
+    while True:
+        header = f.read(_HEADER.size)
+        if not header:
+            return
+        if len(header) < _HEADER.size:
+            logging.warning(f"[STATE] Обрезанная запись снимка {path} после {count} записей")
+            return
+
+        length, checksum = _HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            logging.warning(f"[STATE] Поврежденная запись снимка {path} после {count} записей")
+            return
+
+        try:
+            key, value = json.loads(payload)
+        except (ValueError, TypeError):
+            logging.warning(f"[STATE] Некорректная запись снимка {path} после {count} записей")
+            return
+        count += 1
+        yield key, value
+
+def iter_snapshot(path: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Потоково читает записи снимка
+
+    Для бинарного формата записи читаются по одной, чтение прекращается на
+    первой поврежденной записи. JSON-снимок читается целиком.
+
+    Args:
+        path: Путь к файлу
+
+    Yields:
+        Tuple[str, Any]: Ключ и значение записи
+
+    Raises:
+        SnapshotError: JSON-снимок поврежден
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(SNAPSHOT_MAGIC))
+        if magic == SNAPSHOT_MAGIC:
+            yield from _iter_records(f, path)
+            return
+
+        content = magic + f.read()
+        if not content.strip():
+            return
+        try:
+            state = json.loads(content)
+        except ValueError as e:
+            raise SnapshotError(f"Ошибка декодирования JSON в {path}: {e}") from e
+        if not isinstance(state, dict):
+            raise SnapshotError(f"Снимок {path} не является словарем")
+        yield from state.items()
+
+def read_snapshot(path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Загружает снимок: состояние и служебные данные (см. iter_snapshot)"""
+    state = dict(iter_snapshot(path))
+    meta = state.pop(SNAPSHOT_META_KEY, None)
+    return state, meta if isinstance(meta, dict) else {}
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    """Загружает снимок в словарь без служебных данных (см. iter_snapshot)"""
+    return read_snapshot(path)[0]
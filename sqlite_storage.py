@@ -0,0 +1,335 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from enum import Enum
+from typing import Dict, Any, Optional, List, Tuple
+from contextlib import asynccontextmanager
+from metrics import measure_time
+from state_storage import get_record_timestamp
+from expiry import remove_record_files
+
+class SQLiteStateStorage:
+    """
+    Хранилище состояний загрузок на SQLite.
+
+    Повторяет асинхронный интерфейс StateStorage. Статус и метки времени
+    вынесены в индексируемые колонки, поэтому очистка устаревших записей и
+    подсчет по статусам выполняются запросами по индексу. База в режиме WAL
+    может одновременно использоваться несколькими воркерами gunicorn.
+    """
+
+    def __init__(self, db_file: str, busy_timeout: float = 5.0):
+        """
+        Инициализация хранилища
+
+        Args:
+            db_file: Путь к файлу базы данных
+            busy_timeout: Время ожидания блокировки базы другим процессом в секундах
+        """
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.lock = asyncio.Lock()  # Сериализует доступ к соединению внутри процесса
+        self._conn: Optional[sqlite3.Connection] = None
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение и создает схему"""
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            isolation_level=None  # Транзакциями управляем явно
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT PRIMARY KEY,"
+            " status TEXT,"
+            " created_at REAL,"
+            " updated_at REAL,"
+            " data TEXT NOT NULL"
+            ")"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_status ON state(status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_created_at ON state(created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_state_updated_at ON state(updated_at)")
+        return conn
+
+    @staticmethod
+    def _columns(value: Any) -> Tuple[Optional[str], Optional[float], Optional[float]]:
+        """Извлекает значения индексируемых колонок из записи"""
+        if not isinstance(value, dict):
+            return None, None, None
+
+        status = value.get("status")
+        if isinstance(status, Enum):
+            status = status.value
+
+        updated_at = get_record_timestamp(value)
+        created_at = get_record_timestamp({"created_at": value.get("created_at")}) or updated_at
+        return status, created_at, updated_at
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: Any):
+        """Вставляет или заменяет запись (вызывается внутри транзакции)"""
+        status, created_at, updated_at = self._columns(value)
+        conn.execute(
+            "INSERT INTO state (key, status, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET status=excluded.status, created_at=excluded.created_at, "
+            "updated_at=excluded.updated_at, data=excluded.data",
+            (key, status, created_at, updated_at, json.dumps(value, separators=(',', ':')))
+        )
+
+    async def _run(self, func, *args):
+        """Выполняет операцию с базой в отдельном потоке"""
+        async with self.lock:
+            return await asyncio.to_thread(func, *args)
+
+    @measure_time()
+    async def initialize(self):
+        """Открывает базу данных и создает схему при необходимости"""
+        try:
+            if self._conn is None:
+                self._conn = await asyncio.to_thread(self._connect)
+            self._initialized = True
+            logging.info(f"[STATE] SQLite хранилище инициализировано: {self.db_file}")
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при инициализации SQLite хранилища: {str(e)}")
+            self._initialized = False
+            raise
+
+    @measure_time()
+    async def stop(self):
+        """Закрывает соединение с базой"""
+        if self._conn is not None:
+            async with self.lock:
+                await asyncio.to_thread(self._conn.close)
+            self._conn = None
+        self._initialized = False
+
+    async def _ensure_initialized(self) -> bool:
+        """Ленивая инициализация для вызовов до старта приложения"""
+        if self._initialized:
+            return True
+        try:
+            await self.initialize()
+        except Exception as e:
+            logging.error(f"[STATE] Не удалось инициализировать хранилище: {e}")
+        return self._initialized
+
+    @asynccontextmanager
+    async def atomic_operation(self):
+        """
+        Атомарная операция со всем состоянием.
+
+        Состояние загружается в словарь, после выхода из блока изменения
+        применяются к базе одной транзакцией.
+        """
+        await self._ensure_initialized()
+        async with self.lock:
+            before = await asyncio.to_thread(self._load_all)
+            state = {key: json.loads(json.dumps(value)) for key, value in before.items()}
+            try:
+                yield state
+                await asyncio.to_thread(self._apply_diff, before, state)
+            except Exception as e:
+                logging.error(f"[STATE] Error in atomic operation: {str(e)}", exc_info=True)
+                raise
+
+    def _load_all(self) -> Dict[str, Any]:
+        rows = self._conn.execute("SELECT key, data FROM state").fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def _apply_diff(self, before: Dict[str, Any], after: Dict[str, Any]):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key in before.keys() - after.keys():
+                conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            for key, value in after.items():
+                if key not in before or before[key] != value:
+                    self._write(conn, key, value)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @measure_time()
+    async def get_item(self, key: str) -> Optional[Dict]:
+        """Получить значение по ключу"""
+        if not await self._ensure_initialized():
+            return None
+
+        def _get():
+            row = self._conn.execute("SELECT data FROM state WHERE key = ?", (key,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+        try:
+            return await self._run(_get)
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка чтения состояния: {str(e)}")
+            return None
+
+    @measure_time()
+    async def set_item(self, key: str, value: Any, flush: bool = False):
+        """Устанавливает состояние по ключу. Каждая запись фиксируется сразу, flush оставлен для совместимости."""
+        if not self._initialized:
+            logging.error("[STATE] Попытка установить состояние до инициализации")
+            raise RuntimeError("SQLiteStateStorage не инициализирован")
+
+        def _set():
+            self._write(self._conn, key, value)
+
+        try:
+            await self._run(_set)
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при установке состояния для {key}: {str(e)}")
+            raise
+
+    @measure_time()
+    async def update_item(self, key: str, value: Any = None, flush: bool = False, **kwargs):
+        """
+        Обновляет существующее состояние по ключу. Допускает передачу дополнительных полей как именованных аргументов.
+        Каждая запись фиксируется сразу, flush оставлен для совместимости со StateStorage.
+        """
+        if not await self._ensure_initialized():
+            logging.error("[STATE] Хранилище не инициализировано, операция update_item не выполнена.")
+            return
+
+        if kwargs:
+            if value is None:
+                value = {}
+            if isinstance(value, dict):
+                value.update(kwargs)
+            else:
+                value = kwargs
+
+        def _update():
+            conn = self._conn
+            # BEGIN IMMEDIATE защищает чтение-изменение-запись от других процессов
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT data FROM state WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    logging.warning(f"[STATE] Попытка обновить несуществующий ключ: {key}")
+                    new_value = value
+                else:
+                    current = json.loads(row[0])
+                    if isinstance(current, dict) and isinstance(value, dict):
+                        current.update(value)
+                        new_value = current
+                    else:
+                        new_value = value
+                self._write(conn, key, new_value)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        try:
+            await self._run(_update)
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при обновлении состояния для {key}: {str(e)}")
+            raise
+
+    @measure_time()
+    async def delete_item(self, key: str):
+        """Удаляет состояние по ключу"""
+        await self._ensure_initialized()
+        await self._run(lambda: self._conn.execute("DELETE FROM state WHERE key = ?", (key,)))
+
+    async def get_all_items(self) -> Dict:
+        """Получает все состояния"""
+        if not await self._ensure_initialized():
+            return {}
+        return await self._run(self._load_all)
+
+    async def get_items(self, keys: List[str]) -> Dict[str, Any]:
+        """Получает состояния по списку ключей одним запросом"""
+        keys = list(dict.fromkeys(keys))
+        if not keys or not await self._ensure_initialized():
+            return {}
+
+        def _select():
+            placeholders = ",".join("?" * len(keys))
+            rows = self._conn.execute(f"SELECT key, data FROM state WHERE key IN ({placeholders})", keys).fetchall()
+            return {key: json.loads(data) for key, data in rows}
+
+        return await self._run(_select)
+
+    async def get_keys_by_status(self, status: str) -> List[str]:
+        """Возвращает ключи записей с указанным статусом (запрос по индексу)"""
+        if isinstance(status, Enum):
+            status = status.value
+
+        def _select():
+            return [row[0] for row in self._conn.execute("SELECT key FROM state WHERE status = ?", (status,))]
+
+        await self._ensure_initialized()
+        return await self._run(_select)
+
+    async def get_items_by_status(self, status: str) -> Dict[str, Any]:
+        """Возвращает записи с указанным статусом (запрос по индексу)"""
+        if isinstance(status, Enum):
+            status = status.value
+
+        def _select():
+            rows = self._conn.execute("SELECT key, data FROM state WHERE status = ?", (status,)).fetchall()
+            return {key: json.loads(data) for key, data in rows}
+
+        await self._ensure_initialized()
+        return await self._run(_select)
+
+    async def count_by_status(self) -> Dict[str, int]:
+        """Возвращает количество записей по каждому статусу (запрос по индексу)"""
+        def _count():
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM state GROUP BY status").fetchall()
+            return {status: count for status, count in rows}
+
+        await self._ensure_initialized()
+        return await self._run(_count)
+
+    @measure_time()
+    async def cleanup_old_items(self, max_age_hours: float = 0.5, remove_files: bool = False) -> Dict[str, Any]:  # 30 минут по умолчанию
+        """
+        Очищает старые состояния запросом по индексу updated_at
+
+        Args:
+            max_age_hours: Максимальное время с последнего изменения записи в часах
+            remove_files: Удалить также файлы загрузок (поле file_path) удаленных записей
+
+        Returns:
+            Dict[str, Any]: Удаленные записи
+        """
+        cutoff = time.time() - max_age_hours * 3600
+
+        def _cleanup() -> Dict[str, Any]:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT key, data FROM state WHERE updated_at < ?", (cutoff,)
+                ).fetchall()
+                conn.execute("DELETE FROM state WHERE updated_at < ?", (cutoff,))
+                conn.execute("COMMIT")
+                return {key: json.loads(data) for key, data in rows}
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        await self._ensure_initialized()
+        expired = await self._run(_cleanup)
+        for key in expired:
+            logging.info(f"[STATE] Удален ключ: {key}")
+        if expired:
+            logging.info(f"[STATE] Удалено {len(expired)} старых записей")
+            if remove_files:
+                await asyncio.to_thread(remove_record_files, expired)
+        return expired
@@ -3,102 +3,512 @@ import json
 import asyncio
 import logging
 import aiofiles
-from typing import Dict, Any, AsyncGenerator, Optional
+from enum import Enum
+from typing import Dict, Any, AsyncGenerator, Optional, Iterable, Set, List
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import time
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка журнала между процессами недоступна
+    fcntl = None
 from metrics import measure_time
 from common import CommonState
+from models import DownloadStatus
+from expiry import ExpiryHeap, remove_record_files
+from snapshot import SNAPSHOT_FORMATS, SnapshotError, read_snapshot, write_snapshot
+
+# Статусы завершения загрузки, которые в режиме отложенной записи
+# сохраняются на диск сразу
+SYNC_FLUSH_STATUSES = {
+    DownloadStatus.COMPLETED.value,
+    DownloadStatus.ERROR.value,
+    DownloadStatus.CANCELLED.value,
+}
+
+def get_record_timestamp(value: Any) -> Optional[float]:
+    """
+    Возвращает время последнего изменения записи в секундах
+
+    Args:
+        value: Запись хранилища
+
+    Returns:
+        Optional[float]: Unix-время из полей timestamp/updated_at/created_at или None
+    """
+    if not isinstance(value, dict):
+        return None
+
+    # Проверяем разные поля для времени
+    timestamp = value.get("timestamp") or value.get("updated_at") or value.get("created_at")
+    if not timestamp:
+        return None
+
+    if isinstance(timestamp, str):
+        try:
+            # Пробуем преобразовать строку в timestamp
+            return datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            try:
+                return float(timestamp)
+            except ValueError:
+                return None
+
+    try:
+        return float(timestamp)
+    except (TypeError, ValueError):
+        return None
+
+def get_record_status(value: Any) -> Optional[str]:
+    """Возвращает статус записи хранилища в виде строки"""
+    if not isinstance(value, dict):
+        return None
+    status = value.get("status")
+    if isinstance(status, Enum):
+        status = status.value
+    return status
 
 class StateStorage:
-    """Хранилище состояний загрузок с поддержкой атомарных операций и асинхронной синхронизации"""
+    """
+    Хранилище состояний загрузок с поддержкой атомарных операций и асинхронной синхронизации.
+
+    Записи не изменяются на месте: каждое изменение заменяет значение ключа
+    новым словарем (copy-on-write). Поэтому чтение не берет блокировок и не
+    ждет записи на диск, а писатели сериализуются только по своему ключу.
+
+    Для каждого статуса поддерживается набор ключей, поэтому подсчет и
+    выборка загрузок по статусу не требуют обхода всех записей. Время
+    последнего изменения записей хранится в min-куче, и очистка извлекает
+    только просроченные записи.
+
+    Снимок и журнал рассчитаны на один процесс. Если файл состояния открыт
+    несколькими процессами (например, воркерами gunicorn), журнал ведет только
+    процесс, получивший блокировку файла журнала; остальные сохраняют полные
+    снимки и журнал не читают и не очищают. Номера записей журнала у каждого
+    процесса свои, поэтому общий журнал потерял бы изменения. Для нескольких
+    воркеров подходят хранилища SQLite и Redis.
+    """
+
+    def __init__(
+        self,
+        state_file: str,
+        wal_enabled: bool = False,
+        compact_interval: float = 60.0,
+        compact_threshold: int = 1000,
+        flush_interval: Optional[float] = None,
+        flush_batch_size: int = 100,
+        lock_stripes: int = 64,
+        snapshot_format: str = "json"
+    ):
+        """
+        Инициализация хранилища состояний
 
-    def __init__(self, state_file: str):
-        """Инициализация хранилища состояний"""
+        Args:
+            state_file: Путь к файлу снимка состояния
+            wal_enabled: Записывать изменения в журнал (WAL) вместо полной перезаписи снимка
+            compact_interval: Интервал фонового сжатия журнала в секундах
+            compact_threshold: Количество записей в журнале, после которого сжатие запускается досрочно
+            flush_interval: Интервал отложенной записи в секундах; None - запись на диск при каждом изменении
+            flush_batch_size: Количество изменений, после которого отложенная запись выполняется досрочно
+            lock_stripes: Количество блокировок, между которыми распределяются ключи
+            snapshot_format: Формат снимка: "json" или "binary" (записи с контрольными суммами).
+                При загрузке формат определяется по содержимому файла.
+        """
         self.state_file = state_file
         self.state: Dict[str, CommonState] = {}
         self.lock = asyncio.Lock()  # Для операций с файлом
+        self._key_locks = [asyncio.Lock() for _ in range(max(1, lock_stripes))]  # Для изменений ключей
         self._initialized = False
         self._backup_file = f"{state_file}.backup"
         self._temp_file = f"{state_file}.temp"
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Неизвестный формат снимка: {snapshot_format}")
+        self.snapshot_format = snapshot_format
+
+        # Журнал изменений (write-ahead log)
+        self.wal_enabled = wal_enabled
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self._wal_file = f"{state_file}.wal"
+        self._wal_records = 0
+        self._wal_seq = 0  # Номер последней записи журнала; снимок хранит номер, до которого он актуален
+        self._wal_lock_file = f"{state_file}.wal.lock"
+        self._wal_lock_fd: Optional[int] = None  # Открыт, пока процесс владеет журналом
+        self._compact_requested = asyncio.Event()
+        self._compact_task: Optional[asyncio.Task] = None
+
+        # Отложенная запись (write-behind)
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._dirty: Set[str] = set()
+        self._pending_mutations = 0
+        self._flush_requested = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # Вторичный индекс: статус -> ключи и ключ -> статус
+        self._status_index: Dict[Optional[str], Set[str]] = {}
+        self._status_by_key: Dict[str, Optional[str]] = {}
+        self._expiry = ExpiryHeap()
+
+    @property
+    def write_behind(self) -> bool:
+        """Включен ли режим отложенной записи"""
+        return self.flush_interval is not None
 
     @measure_time()
     async def initialize(self):
         """Асинхронная инициализация хранилища с восстановлением из бэкапа при необходимости"""
         try:
             if os.path.exists(self.state_file):
-                async with aiofiles.open(self.state_file, 'r') as f:
-                    content = await f.read()
-                    if content:
-                        try:
-                            self.state = json.loads(content)
-                        except json.JSONDecodeError:
-                            logging.error("[STATE] Ошибка декодирования JSON в основном файле")
-                            # Пробуем восстановить из бэкапа
-                            if os.path.exists(self._backup_file):
-                                logging.info("[STATE] Восстановление из резервной копии")
-                                async with aiofiles.open(self._backup_file, 'r') as bf:
-                                    backup_content = await bf.read()
-                                    try:
-                                        self.state = json.loads(backup_content)
-                                    except json.JSONDecodeError:
-                                        logging.error("[STATE] Ошибка декодирования JSON в бэкапе")
-                                        self.state = {}
-                            else:
-                                self.state = {}
-                    else:
-                        self.state = {}
+                try:
+                    self.state = await self._read_snapshot(self.state_file)
+                except SnapshotError as e:
+                    logging.error(f"[STATE] Ошибка чтения основного файла: {str(e)}")
+                    # Пробуем восстановить из бэкапа
+                    self.state = await self._load_backup()
             elif os.path.exists(self._backup_file):
-                # Пробуем восстановить из бэкапа
-                logging.info("[STATE] Восстановление из резервной копии")
-                async with aiofiles.open(self._backup_file, 'r') as f:
-                    content = await f.read()
-                    try:
-                        self.state = json.loads(content)
-                    except json.JSONDecodeError:
-                        logging.error("[STATE] Ошибка декодирования JSON в бэкапе")
-                        self.state = {}
+                self.state = await self._load_backup()
                 await self._save_state()
             else:
                 # Создаем новый файл
                 self.state = {}
                 await self._save_state()
 
+            # Применяем журнал поверх снимка. Журнал читается даже при выключенном
+            # WAL, чтобы не потерять изменения после смены режима.
+            uses_wal = self.wal_enabled or os.path.exists(self._wal_file)
+            if uses_wal and self._acquire_wal_lock():
+                if await self._replay_wal():
+                    async with self.lock:
+                        await self._compact()
+            elif self.wal_enabled:
+                # Журналом владеет другой процесс, пишем полные снимки
+                logging.warning(
+                    f"[STATE] Журнал {self._wal_file} используется другим процессом, "
+                    f"WAL отключен; для нескольких воркеров используйте STATE_BACKEND=sqlite или redis"
+                )
+                self.wal_enabled = False
+
+            self._rebuild_index()
+
+            if self.wal_enabled and (self._compact_task is None or self._compact_task.done()):
+                self._compact_task = asyncio.create_task(self._periodic_compact())
+
+            if self.write_behind and (self._flush_task is None or self._flush_task.done()):
+                self._flush_task = asyncio.create_task(self._periodic_flush())
+
             self._initialized = True
             logging.info("[STATE] Хранилище успешно инициализировано")
         except Exception as e:
             logging.error(f"[STATE] Ошибка при инициализации хранилища: {str(e)}")
             self._initialized = False
+            self._release_wal_lock()
             raise
 
+    def _acquire_wal_lock(self) -> bool:
+        """
+        Берет блокировку журнала, если она еще не взята этим хранилищем
+
+        Returns:
+            bool: True, если журналом владеет этот процесс
+        """
+        if self._wal_lock_fd is not None or fcntl is None:
+            return True
+        fd = os.open(self._wal_lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._wal_lock_fd = fd
+        return True
+
+    def _release_wal_lock(self):
+        """Освобождает блокировку журнала"""
+        if self._wal_lock_fd is not None:
+            os.close(self._wal_lock_fd)
+            self._wal_lock_fd = None
+
+    @property
+    def _owns_wal(self) -> bool:
+        """Владеет ли процесс журналом (может писать и очищать его)"""
+        return self._wal_lock_fd is not None or fcntl is None
+
+    async def _read_snapshot(self, path: str) -> Dict[str, CommonState]:
+        """Загружает снимок и номер последней записи журнала, которую он содержит"""
+        state, meta = await asyncio.to_thread(read_snapshot, path)
+        self._wal_seq = int(meta.get("wal_seq") or 0)
+        return state
+
+    async def _load_backup(self) -> Dict[str, CommonState]:
+        """Загружает состояние из резервной копии снимка"""
+        if not os.path.exists(self._backup_file):
+            return {}
+        logging.info("[STATE] Восстановление из резервной копии")
+        try:
+            return await self._read_snapshot(self._backup_file)
+        except SnapshotError as e:
+            logging.error(f"[STATE] Ошибка чтения бэкапа: {str(e)}")
+            return {}
+
     @measure_time()
     async def stop(self):
         """Остановка хранилища с сохранением состояния"""
+        for task in (self._flush_task, self._compact_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = None
+        self._compact_task = None
+
         if self._initialized:
+            # Снимок включает все отложенные изменения
             async with self.lock:
-                await self._save_state()
+                await self._compact()
             self._initialized = False
+        self._release_wal_lock()
+
+    def _key_lock(self, key: str) -> asyncio.Lock:
+        """Возвращает блокировку, отвечающую за ключ"""
+        return self._key_locks[hash(key) % len(self._key_locks)]
 
     @asynccontextmanager
     async def atomic_operation(self):
-        """Атомарная операция с состоянием"""
-        async with self.lock:
+        """Атомарная операция с состоянием (блокирует всех писателей)"""
+        # Блокировки ключей берутся в фиксированном порядке, чтобы избежать взаимоблокировок
+        for key_lock in self._key_locks:
+            await key_lock.acquire()
+        try:
+            async with self.lock:
+                try:
+                    try:
+                        yield self.state
+                    finally:
+                        self._rebuild_index()
+                    # Произвольные изменения нельзя выразить записями журнала,
+                    # поэтому сохраняем полный снимок
+                    await self._compact()
+                except Exception as e:
+                    logging.error(f"[STATE] Error in atomic operation: {str(e)}", exc_info=True)
+                    raise
+        finally:
+            for key_lock in self._key_locks:
+                key_lock.release()
+
+    @staticmethod
+    def _needs_sync_flush(value: Any) -> bool:
+        """Проверяет, переводит ли запись загрузку в завершающий статус"""
+        return get_record_status(value) in SYNC_FLUSH_STATUSES
+
+    def _index_key(self, key: str):
+        """Обновляет индекс статусов и время устаревания после изменения ключа"""
+        if key in self._status_by_key:
+            old_status = self._status_by_key.pop(key)
+            keys = self._status_index.get(old_status)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._status_index[old_status]
+
+        if key in self.state:
+            status = get_record_status(self.state[key])
+            self._status_by_key[key] = status
+            self._status_index.setdefault(status, set()).add(key)
+            self._expiry.schedule(key, get_record_timestamp(self.state[key]))
+        else:
+            self._expiry.discard(key)
+
+    def _rebuild_index(self):
+        """Перестраивает индекс статусов и кучу устаревания по всему состоянию"""
+        self._status_index = {}
+        self._status_by_key = {}
+        self._expiry.clear()
+        for key, value in self.state.items():
+            status = get_record_status(value)
+            self._status_by_key[key] = status
+            self._status_index.setdefault(status, set()).add(key)
+            self._expiry.schedule(key, get_record_timestamp(value))
+
+    async def _commit(self, key: str, flush: bool = False):
+        """
+        Фиксирует изменение одного ключа (вызывается под блокировкой ключа)
+
+        Args:
+            key: Измененный ключ
+            flush: Записать на диск немедленно даже в режиме отложенной записи
+        """
+        if not self.write_behind:
+            async with self.lock:
+                await self._persist([key])
+            return
+
+        self._dirty.add(key)
+        self._pending_mutations += 1
+        if flush or self._needs_sync_flush(self.state.get(key)):
+            async with self.lock:
+                await self._flush_dirty()
+        elif self._pending_mutations >= self.flush_batch_size:
+            self._flush_requested.set()
+
+    async def _persist(self, keys: Iterable[str]):
+        """Сохраняет изменения ключей: записями журнала или полным снимком"""
+        if self.wal_enabled:
+            await self._append_wal(keys)
+        else:
+            await self._save_state()
+
+    async def _flush_dirty(self):
+        """Сохраняет все накопленные изменения одной записью на диск (вызывается под self.lock)"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        self._pending_mutations = 0
+        self._flush_requested.clear()
+        try:
+            await self._persist(keys)
+        except Exception:
+            # Не теряем изменения: попробуем сохранить при следующем сбросе
+            self._dirty |= keys
+            raise
+
+    async def _periodic_flush(self):
+        """Фоновая отложенная запись по таймеру или по числу изменений"""
+        while True:
             try:
-                yield self.state
-                await self._save_state()
+                try:
+                    await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                if self._dirty:
+                    async with self.lock:
+                        await self._flush_dirty()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logging.error(f"[STATE] Ошибка при отложенной записи: {str(e)}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def _append_wal(self, keys: Iterable[str]):
+        """Дописывает в журнал компактные записи о текущих значениях ключей одной синхронизацией"""
+        lines = []
+        for key in keys:
+            self._wal_seq += 1
+            if key in self.state:
+                record = {"seq": self._wal_seq, "op": "set", "key": key, "value": self.state[key]}
+            else:
+                record = {"seq": self._wal_seq, "op": "del", "key": key}
+            lines.append(json.dumps(record, separators=(',', ':')) + "\n")
+
+        try:
+            async with aiofiles.open(self._wal_file, 'a') as f:
+                await f.write("".join(lines))
+                await f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            logging.error(f"[STATE] Ошибка при записи в журнал: {str(e)}", exc_info=True)
+            raise
+
+        self._wal_records += len(lines)
+        if self._wal_records >= self.compact_threshold:
+            self._compact_requested.set()
+
+    async def _replay_wal(self) -> int:
+        """
+        Применяет записи журнала к загруженному снимку
+
+        Записи с номером не больше сохраненного в снимке пропускаются: они
+        остаются в журнале, если процесс упал после записи снимка, но до
+        очистки журнала, и вернули бы ключам прежние значения.
+
+        Returns:
+            int: Количество примененных записей
+        """
+        if not os.path.exists(self._wal_file):
+            return 0
+
+        snapshot_seq = self._wal_seq
+        applied = 0
+        async with aiofiles.open(self._wal_file, 'r') as f:
+            async for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная последняя запись после сбоя - дальше читать нечего
+                    logging.warning(f"[STATE] Поврежденная запись в журнале, применено {applied} записей")
+                    break
+
+                seq = record.get("seq")
+                if seq is not None:
+                    if seq <= snapshot_seq:
+                        continue
+                    self._wal_seq = max(self._wal_seq, seq)
+                if record.get("op") == "set":
+                    self.state[record["key"]] = record["value"]
+                elif record.get("op") == "del":
+                    self.state.pop(record["key"], None)
+                applied += 1
+
+        if applied:
+            logging.info(f"[STATE] Из журнала восстановлено {applied} записей")
+        return applied
+
+    async def _compact(self):
+        """Сохраняет полный снимок и очищает журнал (вызывается под self.lock)"""
+        # Снимок будет содержать все отложенные изменения. Сбрасываем их до
+        # сериализации: ключи, измененные во время записи, снова станут грязными.
+        dirty, self._dirty = self._dirty, set()
+        self._pending_mutations = 0
+        try:
+            await self._save_state()
+        except Exception:
+            self._dirty |= dirty
+            raise
+        # Журнал другого процесса не очищается: его записей нет в этом снимке
+        if self._owns_wal and os.path.exists(self._wal_file):
+            async with aiofiles.open(self._wal_file, 'w') as f:
+                await f.flush()
+                os.fsync(f.fileno())
+        self._wal_records = 0
+        self._compact_requested.clear()
+
+    async def _periodic_compact(self):
+        """Фоновое сжатие журнала по таймеру или по числу записей"""
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._compact_requested.wait(), timeout=self.compact_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                if self._wal_records:
+                    async with self.lock:
+                        records = self._wal_records
+                        await self._compact()
+                    logging.debug(f"[STATE] Журнал сжат, записей: {records}")
+            except asyncio.CancelledError:
+                break
             except Exception as e:
-                logging.error(f"[STATE] Error in atomic operation: {str(e)}", exc_info=True)
-                raise
+                logging.error(f"[STATE] Ошибка при сжатии журнала: {str(e)}")
+                await asyncio.sleep(self.compact_interval)
 
     async def _save_state(self):
         """Сохраняет состояние в файл"""
         try:
-            # Создаем временный файл
+            # Создаем временный файл. Значения записей не изменяются на месте
+            # (copy-on-write), поэтому достаточно поверхностной копии словаря.
+            # Снимок содержит все записи журнала, добавленные до копирования состояния
             temp_file = self._temp_file
-            async with aiofiles.open(temp_file, 'w') as f:
-                await f.write(json.dumps(self.state, indent=2))
-                await f.flush()
-                os.fsync(f.fileno())
+            # Снимок процесса, не владеющего журналом, номер не хранит: при запуске
+            # применяются все записи журнала
+            meta = {"wal_seq": self._wal_seq} if self._owns_wal and self._wal_seq else None
+            await asyncio.to_thread(write_snapshot, temp_file, dict(self.state), self.snapshot_format, meta)
 
             # Атомарно заменяем основной файл
             if os.path.exists(self.state_file):
@@ -115,28 +525,35 @@ class StateStorage:
             await self.initialize()
 
         try:
-            async with self.lock:
-                return self.state.get(key)
+            # Значения не изменяются на месте, поэтому блокировка не нужна.
+            # Возвращаем копию, чтобы вызывающий код не испортил хранимую запись.
+            value = self.state.get(key)
+            return dict(value) if isinstance(value, dict) else value
         except Exception as e:
             logging.error(f"[STATE] Ошибка чтения состояния: {str(e)}")
             return None
 
     @measure_time()
-    async def set_item(self, key: str, value: CommonState):
-        """Устанавливает состояние по ключу"""
+    async def set_item(self, key: str, value: CommonState, flush: bool = False):
+        """Устанавливает состояние по ключу. flush=True сохраняет изменение на диск немедленно."""
         if not self._initialized:
             logging.error("[STATE] Попытка установить состояние до инициализации")
             raise RuntimeError("StateStorage не инициализирован")
         try:
-            async with self.atomic_operation():
-                self.state[key] = value
+            async with self._key_lock(key):
+                self.state[key] = dict(value) if isinstance(value, dict) else value
+                self._index_key(key)
+                await self._commit(key, flush)
         except Exception as e:
             logging.error(f"[STATE] Ошибка при установке состояния для {key}: {str(e)}")
             raise
 
     @measure_time()
-    async def update_item(self, key: str, value: CommonState = None, **kwargs):
-        """Обновляет существующее состояние по ключу. Допускает передачу дополнительных полей как именованных аргументов."""
+    async def update_item(self, key: str, value: CommonState = None, flush: bool = False, **kwargs):
+        """
+        Обновляет существующее состояние по ключу. Допускает передачу дополнительных полей как именованных аргументов.
+        flush=True сохраняет изменение на диск немедленно даже в режиме отложенной записи.
+        """
         if not self._initialized:
             if not hasattr(self, '_lazy_init_attempted') or not self._lazy_init_attempted:
                 self._lazy_init_attempted = True
@@ -160,16 +577,19 @@ class StateStorage:
                 else:
                     value = kwargs
 
-            async with self.atomic_operation():
+            async with self._key_lock(key):
+                current = self.state.get(key)
                 if key not in self.state:
                     logging.warning(f"[STATE] Попытка обновить несуществующий ключ: {key}")
-                    self.state[key] = value
+                    new_value = dict(value) if isinstance(value, dict) else value
+                elif isinstance(current, dict):
+                    # Copy-on-write: читатели продолжают видеть прежнюю запись целиком
+                    new_value = {**current, **value}
                 else:
-                    current = self.state[key]
-                    if isinstance(current, dict):
-                        current.update(value)
-                    else:
-                        self.state[key] = value
+                    new_value = value
+                self.state[key] = new_value
+                self._index_key(key)
+                await self._commit(key, flush)
         except Exception as e:
             logging.error(f"[STATE] Ошибка при обновлении состояния для {key}: {str(e)}")
             raise
@@ -177,48 +597,86 @@ class StateStorage:
     @measure_time()
     async def delete_item(self, key: str):
         """Удаляет состояние по ключу"""
-        async with self.atomic_operation():
+        async with self._key_lock(key):
             if key in self.state:
                 del self.state[key]
+                self._index_key(key)
+                await self._commit(key)
 
     async def get_all_items(self) -> Dict:
-        """Получает все состояния"""
-        return self.state
+        """Получает согласованный снимок всех состояний (записи в нем изменять нельзя)"""
+        return dict(self.state)
+
+    async def get_items(self, keys: List[str]) -> Dict[str, Any]:
+        """Получает снимок состояний по списку ключей (отсутствующие ключи пропускаются)"""
+        if not self._initialized:
+            await self.initialize()
+        state = self.state
+        return {key: dict(state[key]) if isinstance(state[key], dict) else state[key] for key in keys if key in state}
+
+    async def count_by_status(self) -> Dict[Optional[str], int]:
+        """Возвращает количество записей по каждому статусу без обхода состояния"""
+        if not self._initialized:
+            await self.initialize()
+        return {status: len(keys) for status, keys in self._status_index.items()}
+
+    async def get_keys_by_status(self, status: str) -> List[str]:
+        """Возвращает ключи записей с указанным статусом"""
+        if not self._initialized:
+            await self.initialize()
+        if isinstance(status, Enum):
+            status = status.value
+        return list(self._status_index.get(status, ()))
+
+    async def get_items_by_status(self, status: str) -> Dict[str, Any]:
+        """Возвращает копии записей с указанным статусом"""
+        return await self.get_items(await self.get_keys_by_status(status))
 
     @measure_time()
-    async def cleanup_old_items(self, max_age_hours: float = 0.5):  # 30 минут по умолчанию
-        """Очищает старые состояния"""
-        async with self.atomic_operation():
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600  # Переводим часы в секунды
-
-            keys_to_delete = []
-            for key, value in self.state.items():
-                if isinstance(value, dict):
-                    # Проверяем разные поля для времени
-                    timestamp = value.get("timestamp") or value.get("updated_at") or value.get("created_at")
-                    if timestamp:
-                        if isinstance(timestamp, str):
-                            try:
-                                # Пробуем преобразовать строку в timestamp
-                                timestamp = datetime.fromisoformat(timestamp).timestamp()
-                            except ValueError:
-                                # Если не получилось, пропускаем
-                                continue
-
-                        age = current_time - float(timestamp)
-                        age_minutes = age / 60
-
-                        if age > max_age_seconds:
-                            keys_to_delete.append(key)
-                            logging.info(f"[STATE] Помечен на удаление ключ: {key} (возраст: {age_minutes:.1f} минут)")
-
-            for key in keys_to_delete:
-                del self.state[key]
-                logging.info(f"[STATE] Удален ключ: {key}")
+    async def cleanup_old_items(self, max_age_hours: float = 0.5, remove_files: bool = False) -> Dict[str, Any]:  # 30 минут по умолчанию
+        """
+        Очищает старые состояния. Стоимость пропорциональна числу просроченных записей.
+
+        Args:
+            max_age_hours: Максимальное время с последнего изменения записи в часах
+            remove_files: Удалить также файлы загрузок (поле file_path) удаленных записей
+
+        Returns:
+            Dict[str, Any]: Удаленные записи
+        """
+        current_time = time.time()
+        cutoff = current_time - max_age_hours * 3600  # Переводим часы в секунды
+
+        expired: Dict[str, Any] = {}
+        for key in self._expiry.pop_expired(cutoff):
+            async with self._key_lock(key):
+                # Запись могла обновиться, пока ждали блокировку
+                timestamp = get_record_timestamp(self.state.get(key))
+                if key not in self.state or timestamp is None or timestamp >= cutoff:
+                    continue
+
+                expired[key] = self.state.pop(key)
+                self._index_key(key)
+                age_minutes = (current_time - timestamp) / 60
+                logging.info(f"[STATE] Удален ключ: {key} (возраст: {age_minutes:.1f} минут)")
+
+        if not expired:
+            return expired
+
+        if self.write_behind:
+            self._dirty.update(expired)
+            self._pending_mutations += len(expired)
+            self._flush_requested.set()
+        else:
+            async with self.lock:
+                await self._persist(expired.keys())
+
+        logging.info(f"[STATE] Удалено {len(expired)} старых записей")
+
+        if remove_files:
+            await asyncio.to_thread(remove_record_files, expired)
 
-            if keys_to_delete:
-                logging.info(f"[STATE] Удалено {len(keys_to_delete)} старых записей")
+        return expired
 
 # Создаем экземпляр хранилища состояний
 state_storage = StateStorage(os.path.join(os.getcwd(), "state.json"))
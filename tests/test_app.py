@@ -31,7 +31,7 @@ async def state_storage(tmp_path):
     await storage.stop()
 
 @pytest_asyncio.fixture
-async def test_app():
+async def test_app(monkeypatch):
     """Фикстура для тестового приложения"""
     # Создаем временную директорию для тестов
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -45,7 +45,15 @@ async def test_app():
         os.makedirs(logs_dir, exist_ok=True)
         
         # Создаем приложение
+        import app as app_module
         from app import app
+
+        # Загрузки, кеш результатов и логи пишутся во временную директорию, а не в downloads проекта
+        monkeypatch.setattr(app_module, "DOWNLOADS_DIR", downloads_dir)
+        monkeypatch.setattr(app_module, "LOG_DIR", logs_dir)
+        monkeypatch.setattr(app_module.file_index, "downloads_dir", downloads_dir)
+        monkeypatch.setattr(app_module.disk_quota, "downloads_dir", downloads_dir)
+        monkeypatch.setattr(app_module.result_cache, "index_path", os.path.join(downloads_dir, "result_cache.json"))
         
         # Инициализируем хранилище
         app.state.storage = StateStorage(state_file)
@@ -60,7 +68,12 @@ async def test_app():
         
         yield app
         
-        # Очищаем после тестов
+        # Очищаем после тестов: загрузки из очереди не должны писать во временную директорию после ее удаления
+        for name in ("download_queue", "ydl_pool", "progress_persister"):
+            service = getattr(app.state, name, None)
+            if service is not None:
+                await service.stop()
+                setattr(app.state, name, None)
         await app.state.cleanup.stop()
         await app.state.cleanup.cleanup_all()
 
@@ -536,6 +549,577 @@ async def test_cancel_download(async_client):
     data = status_response.json()
     assert data["status"] == "cancelled"
 
+@pytest.mark.asyncio
+async def test_download_events_stream(test_app, async_client):
+    """Тест потока событий SSE с объединением обновлений"""
+    from sse_starlette.sse import AppStatus
+    from progress_bus import progress_bus
+    AppStatus.should_exit_event = None
+
+    download_id = str(uuid.uuid4())
+    await test_app.state.storage.set_item(download_id, {"status": "downloading", "progress": 10, "updated_at": time.time()})
+
+    async def publish_updates():
+        await asyncio.sleep(0.1)
+        for progress in range(20, 100, 10):
+            progress_bus.publish(download_id, {"status": "downloading", "progress": progress, "speed": 1024, "eta": 5})
+        progress_bus.publish(download_id, {"status": "completed", "progress": 100})
+
+    publisher = asyncio.create_task(publish_updates())
+    response = await async_client.get(f"/api/events/{download_id}")
+    await publisher
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[5:]) for line in response.text.splitlines() if line.startswith("data:")]
+    assert events[0] == {"status": "downloading", "progress": 10}
+    assert events[-1]["status"] == "completed"
+    # Частые события объединяются
+    assert len(events) < 10
+
+@pytest.mark.asyncio
+async def test_download_events_not_found(async_client):
+    """Тест потока событий для неизвестной загрузки"""
+    response = await async_client.get(f"/api/events/{uuid.uuid4()}")
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+async def test_batch_status(test_app, async_client):
+    """Тест статусов нескольких загрузок одним запросом и фильтра since"""
+    first, second, missing = (str(uuid.uuid4()) for _ in range(3))
+    await test_app.state.storage.set_item(first, {"status": "downloading", "progress": 40, "updated_at": time.time()})
+    await test_app.state.storage.set_item(second, {"status": "error", "error": "boom", "updated_at": time.time()})
+
+    response = await async_client.post("/api/status/batch", json={"ids": [first, second, missing]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["downloads"][first]["progress"] == 40
+    assert data["downloads"][second] == {"status": "error", "error": "boom", "updated_at": data["downloads"][second]["updated_at"]}
+    assert data["missing"] == [missing]
+
+    await test_app.state.storage.update_item(first, {"progress": 60, "updated_at": time.time() + 1})
+    response = await async_client.post("/api/status/batch", json={"ids": [first, second], "since": data["server_time"]})
+    assert list(response.json()["downloads"]) == [first]
+
+    response = await async_client.post("/api/status/batch", json={"ids": ["x"] * 2 + [str(i) for i in range(1000)]})
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_batch_status_completion_after_since(test_app, async_client, monkeypatch, tmp_path):
+    """Тест: завершение после since видно, даже если mtime файла - давний Last-Modified источника"""
+    import app as app_module
+    from file_index import FileIndex
+
+    download_id = str(uuid.uuid4())
+    index = FileIndex(str(tmp_path))
+    monkeypatch.setattr(app_module, "file_index", index)
+    await test_app.state.storage.set_item(download_id, {"status": "downloading", "progress": 90, "updated_at": time.time()})
+
+    response = await async_client.post("/api/status/batch", json={"ids": [download_id]})
+    since = response.json()["server_time"]
+
+    file_path = tmp_path / f"title-{download_id}.mp4"
+    file_path.write_bytes(b"video")
+    os.utime(file_path, (time.time() - 365 * 86400, time.time() - 365 * 86400))
+    index.add(download_id, str(file_path))
+
+    response = await async_client.post("/api/status/batch", json={"ids": [download_id], "since": since})
+    status = response.json()["downloads"][download_id]
+    assert status["status"] == "completed"
+    assert status["updated_at"] > since
+
+@pytest.mark.asyncio
+async def test_progress_etag_long_poll(test_app, async_client, monkeypatch):
+    """Тест ETag, ответа 304 и ожидания изменения по параметру wait"""
+    import app as app_module
+    from progress_bus import progress_bus
+
+    # Ожидание завершается событием шины, а не периодическим пересчетом
+    monkeypatch.setattr(app_module, "LONG_POLL_RECHECK_INTERVAL", 30)
+
+    download_id = str(uuid.uuid4())
+    await test_app.state.storage.set_item(download_id, {"status": "downloading", "progress": 10, "updated_at": time.time()})
+    progress_bus.publish(download_id, {"status": "downloading", "progress": 10}, persist=False)
+
+    response = await async_client.get(f"/api/progress/{download_id}")
+    etag = response.headers["etag"]
+    assert etag.startswith(f'"{progress_bus.get_version(download_id)}-')
+    response = await async_client.get(f"/api/progress/{download_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    async def publish_update():
+        await asyncio.sleep(0.1)
+        progress_bus.publish(download_id, {"status": "downloading", "progress": 50}, persist=False)
+
+    response = await async_client.get(f"/api/status/{download_id}")
+    etag = response.headers["etag"]
+
+    publisher = asyncio.create_task(publish_update())
+    started = time.monotonic()
+    response = await async_client.get(f"/api/status/{download_id}?wait=5", headers={"If-None-Match": etag})
+    await publisher
+    assert time.monotonic() - started < 1
+    assert response.status_code == 200
+    assert response.json()["progress"] == 50
+    assert response.headers["etag"] != etag
+
+    response = await async_client.get(
+        f"/api/status/{download_id}?wait=0.1", headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+    progress_bus.discard(download_id)
+
+@pytest.mark.asyncio
+async def test_progress_etag_queue_position(test_app, async_client, monkeypatch):
+    """Тест: смена позиции в очереди без событий шины меняет ETag и завершает ожидание"""
+    import app as app_module
+    from job_queue import DownloadJobQueue
+
+    async def handler(download_id, url):
+        pass
+
+    queue = DownloadJobQueue(handler)
+    queue.submit("ahead", "https://example.com/a")
+    download_id = str(uuid.uuid4())
+    queue.submit(download_id, "https://example.com/b")
+    monkeypatch.setattr(test_app.state, "download_queue", queue, raising=False)
+    monkeypatch.setattr(app_module, "LONG_POLL_RECHECK_INTERVAL", 0.05)
+    await test_app.state.storage.set_item(download_id, {"status": "pending", "progress": 0, "updated_at": time.time()})
+
+    response = await async_client.get(f"/api/progress/{download_id}")
+    assert response.json()["queue_position"] == 2
+    etag = response.headers["etag"]
+
+    async def cancel_ahead():
+        await asyncio.sleep(0.1)
+        queue.cancel("ahead")
+
+    canceller = asyncio.create_task(cancel_ahead())
+    response = await async_client.get(f"/api/progress/{download_id}?wait=5", headers={"If-None-Match": etag})
+    await canceller
+    assert response.status_code == 200
+    assert response.json()["queue_position"] == 1
+    assert response.headers["etag"] != etag
+
+@pytest.mark.asyncio
+async def test_single_flight_download(test_app, async_client, monkeypatch):
+    """Тест присоединения одинаковых запросов к выполняющейся загрузке"""
+    import app as app_module
+
+    release = asyncio.Event()
+    started = []
+
+    async def fake_process_download(download_id, url):
+        started.append(download_id)
+        await test_app.state.storage.update_item(download_id, {"status": "downloading", "progress": 30, "updated_at": time.time()})
+        await release.wait()
+        await test_app.state.storage.update_item(download_id, {
+            "status": "completed", "progress": 100, "file_path": "/tmp/video.mp4", "updated_at": time.time()
+        })
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    test_app.state.download_queue = None
+    try:
+        response = await async_client.post("/api/download", json={"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ&utm_source=x"})
+        primary_id = response.json()["download_id"]
+        response = await async_client.post("/api/download", json={"url": "https://youtu.be/dQw4w9WgXcQ"})
+        alias = response.json()
+        assert alias["alias_of"] == primary_id
+        alias_id = alias["download_id"]
+
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+        response = await async_client.get(f"/api/progress/{alias_id}")
+        assert response.json()["progress"] == 30
+
+        release.set()
+        for _ in range(100):
+            state = await test_app.state.storage.get_item(alias_id)
+            if state.get("status") == "completed":
+                break
+            await asyncio.sleep(0.01)
+        assert state["file_path"] == "/tmp/video.mp4"
+        assert state["alias_of"] == primary_id
+        assert started == [primary_id]
+
+        # Завершенная загрузка больше не принимает присоединенные запросы
+        response = await async_client.post("/api/download", json={"url": "https://youtu.be/dQw4w9WgXcQ"})
+        assert "alias_of" not in response.json()
+    finally:
+        release.set()
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_cancel_pending_download(test_app, async_client, monkeypatch):
+    """Тест отмены загрузки, ожидающей в очереди"""
+    import app as app_module
+
+    release = asyncio.Event()
+    started = []
+
+    async def fake_process_download(download_id, url):
+        started.append(download_id)
+        await test_app.state.storage.update_item(download_id, {"status": "downloading", "progress": 30, "updated_at": time.time()})
+        await release.wait()
+        await test_app.state.storage.update_item(download_id, {
+            "status": "completed", "progress": 100, "file_path": "/tmp/video.mp4", "updated_at": time.time()
+        })
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    monkeypatch.setattr(app_module, "DOWNLOAD_WORKERS", 1)
+    test_app.state.download_queue = None
+    try:
+        video = uuid.uuid4().int % 10 ** 9
+        response = await async_client.post("/api/download", json={"url": f"https://vimeo.com/{video}"})
+        primary_id = response.json()["download_id"]
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+
+        # Второй загрузке воркер не достался, она ждет в очереди
+        response = await async_client.post("/api/download", json={"url": f"https://vimeo.com/{video + 1}"})
+        pending_id = response.json()["download_id"]
+        assert test_app.state.download_queue.get_position(pending_id) == 1
+
+        response = await async_client.post(f"/api/cancel/{pending_id}")
+        assert response.status_code == 200
+        assert test_app.state.download_queue.get_position(pending_id) is None
+        assert (await test_app.state.storage.get_item(pending_id))["status"] == "cancelled"
+
+        # Освободившийся воркер не запускает отмененную загрузку
+        release.set()
+        for _ in range(100):
+            if (await test_app.state.storage.get_item(primary_id)).get("status") == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert started == [primary_id]
+    finally:
+        release.set()
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_cancel_running_download(test_app, async_client, monkeypatch):
+    """Тест отмены выполняющейся загрузки: задача прерывается, результат не перезаписывает отмену"""
+    import app as app_module
+
+    started = asyncio.Event()
+    finished = []
+
+    async def fake_process_download(download_id, url):
+        await test_app.state.storage.update_item(download_id, {"status": "downloading", "progress": 30, "updated_at": time.time()})
+        started.set()
+        await asyncio.sleep(60)
+        finished.append(download_id)
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    test_app.state.download_queue = None
+    try:
+        response = await async_client.post("/api/download", json={"url": f"https://vimeo.com/{uuid.uuid4().int % 10 ** 9}"})
+        download_id = response.json()["download_id"]
+        await asyncio.wait_for(started.wait(), timeout=1)
+        assert test_app.state.download_queue.is_running(download_id)
+
+        response = await async_client.post(f"/api/cancel/{download_id}")
+        assert response.status_code == 200
+        assert not test_app.state.download_queue.is_running(download_id)
+        assert test_app.state.download_queue.stats()["aborted"] == 1
+        state = await test_app.state.storage.get_item(download_id)
+        assert state["status"] == "cancelled"
+        assert finished == []
+
+        # Результат, пришедший после отмены (например, из другого процесса), не перезаписывает ее
+        await app_module.save_final_state(download_id, {"status": "completed", "progress": 100, "updated_at": time.time()})
+        assert (await test_app.state.storage.get_item(download_id))["status"] == "cancelled"
+    finally:
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_cancel_alias_keeps_primary(test_app, async_client, monkeypatch):
+    """Тест: отмена присоединенного запроса отсоединяет его, общая загрузка продолжается"""
+    import app as app_module
+
+    release = asyncio.Event()
+    started = []
+
+    async def fake_process_download(download_id, url):
+        started.append(download_id)
+        await test_app.state.storage.update_item(download_id, {"status": "downloading", "progress": 30, "updated_at": time.time()})
+        await release.wait()
+        await test_app.state.storage.update_item(download_id, {
+            "status": "completed", "progress": 100, "file_path": "/tmp/video.mp4", "updated_at": time.time()
+        })
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    test_app.state.download_queue = None
+    try:
+        url = f"https://vimeo.com/{uuid.uuid4().int % 10 ** 9}"
+        response = await async_client.post("/api/download", json={"url": url})
+        primary_id = response.json()["download_id"]
+        response = await async_client.post("/api/download", json={"url": url})
+        assert response.json()["alias_of"] == primary_id
+        alias_id = response.json()["download_id"]
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+
+        response = await async_client.post(f"/api/cancel/{alias_id}")
+        assert response.status_code == 200
+        assert (await test_app.state.storage.get_item(alias_id))["status"] == "cancelled"
+        assert (await test_app.state.storage.get_item(primary_id))["status"] == "downloading"
+
+        release.set()
+        for _ in range(100):
+            state = await test_app.state.storage.get_item(primary_id)
+            if state.get("status") == "completed":
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert state["status"] == "completed"
+        # Результат общей загрузки не копируется в отсоединенный запрос
+        alias = await test_app.state.storage.get_item(alias_id)
+        assert alias["status"] == "cancelled"
+        assert not alias.get("alias_of")
+        assert started == [primary_id]
+    finally:
+        release.set()
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_cancel_primary_keeps_alias(test_app, async_client, monkeypatch, tmp_path):
+    """Тест: отмена основной загрузки не прерывает ее для присоединенного запроса"""
+    import app as app_module
+
+    release = asyncio.Event()
+    started = []
+
+    async def fake_process_download(download_id, url):
+        started.append(download_id)
+        await test_app.state.storage.update_item(download_id, {"status": "downloading", "progress": 30, "updated_at": time.time()})
+        await release.wait()
+        video_path = tmp_path / f"video-{download_id}.mp4"
+        video_path.write_bytes(b"video")
+        await test_app.state.storage.update_item(download_id, {
+            "status": "completed", "progress": 100, "file_path": str(video_path), "updated_at": time.time()
+        })
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    test_app.state.download_queue = None
+    try:
+        url = f"https://vimeo.com/{uuid.uuid4().int % 10 ** 9}"
+        response = await async_client.post("/api/download", json={"url": url})
+        primary_id = response.json()["download_id"]
+        response = await async_client.post("/api/download", json={"url": url})
+        alias_id = response.json()["download_id"]
+        for _ in range(100):
+            if started:
+                break
+            await asyncio.sleep(0.01)
+
+        response = await async_client.post(f"/api/cancel/{primary_id}")
+        assert response.status_code == 200
+        assert test_app.state.download_queue.is_running(primary_id)
+        assert test_app.state.download_queue.stats()["aborted"] == 0
+
+        release.set()
+        for _ in range(100):
+            alias = await test_app.state.storage.get_item(alias_id)
+            if alias.get("status") == "completed":
+                break
+            await asyncio.sleep(0.01)
+        # Результат переходит присоединенному запросу, запись основной загрузки отменена
+        assert alias["status"] == "completed"
+        assert not alias.get("alias_of")
+        assert app_module.file_index.get(alias_id)["path"] == str(tmp_path / f"video-{primary_id}.mp4")
+        primary = await test_app.state.storage.get_item(primary_id)
+        assert primary["status"] == "cancelled"
+        assert not primary.get("file_path")
+        assert app_module.file_index.get(primary_id) is None
+    finally:
+        release.set()
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_result_cache_hit(test_app, async_client, monkeypatch, tmp_path):
+    """Тест мгновенного ответа на повторный запрос уже загруженного видео"""
+    import app as app_module
+    from result_cache import ResultCache
+
+    calls = []
+
+    async def fake_process_download(download_id, url):
+        calls.append(download_id)
+        video_path = tmp_path / f"video-{download_id}.mp4"
+        video_path.write_bytes(b"video")
+        await test_app.state.storage.update_item(download_id, {
+            "status": "completed", "progress": 100, "file_path": str(video_path), "updated_at": time.time()
+        })
+
+    monkeypatch.setattr(app_module, "process_download", fake_process_download)
+    monkeypatch.setattr(app_module, "result_cache", ResultCache(10 ** 6))
+    test_app.state.download_queue = None
+    try:
+        url = f"https://vimeo.com/{uuid.uuid4().int % 10 ** 9}"
+        response = await async_client.post("/api/download", json={"url": url})
+        first_id = response.json()["download_id"]
+        for _ in range(100):
+            if app_module.result_cache.stats()["entries"]:
+                break
+            await asyncio.sleep(0.01)
+
+        response = await async_client.post("/api/download", json={"url": url + "?utm_source=mail"})
+        data = response.json()
+        assert data["status"] == "completed" and data["cached"] is True
+        assert calls == [first_id]
+
+        response = await async_client.get(f"/api/video/{data['download_id']}")
+        assert response.status_code == 200
+        assert response.content == b"video"
+    finally:
+        await test_app.state.download_queue.stop()
+        test_app.state.download_queue = None
+
+@pytest.mark.asyncio
+async def test_video_info_cached(async_client, monkeypatch):
+    """Тест /api/info: повторный запрос отвечает из кеша"""
+    import app as app_module
+    from metadata_cache import MetadataCache
+
+    calls = []
+
+    async def fake_extract(url):
+        calls.append(url)
+        return {"id": "v1", "title": "Видео", "formats": [{"format_id": "18", "ext": "mp4", "url": "https://cdn/v1"}]}
+
+    monkeypatch.setattr(app_module, "extract_video_info", fake_extract)
+    monkeypatch.setattr(app_module, "metadata_cache", MetadataCache(ttl=60))
+
+    response = await async_client.get("/api/info", params={"url": "https://vimeo.com/1"})
+    assert response.status_code == 200
+    assert response.json()["cached"] is False
+    assert response.json()["formats"] == [{"format_id": "18", "ext": "mp4"}]
+
+    response = await async_client.get("/api/info", params={"url": "https://vimeo.com/1/"})
+    assert response.json()["cached"] is True
+    assert len(calls) == 1
+
+    response = await async_client.get("/api/info", params={"url": "ftp://example.com"})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_playlist_info_not_used_for_download(monkeypatch):
+    """Тест: информация о плейлисте не передается загрузке вместо извлечения"""
+    import app as app_module
+    from metadata_cache import MetadataCache
+
+    async def fake_extract(url):
+        if "list" in url:
+            return {"_type": "playlist", "id": "pl", "title": "Плейлист"}
+        return {"id": "v1", "title": "Видео", "formats": []}
+
+    monkeypatch.setattr(app_module, "extract_video_info", fake_extract)
+    monkeypatch.setattr(app_module, "metadata_cache", MetadataCache(ttl=60))
+
+    assert await app_module.load_video_info("https://vimeo.com/list") is None
+    assert (await app_module.load_video_info("https://vimeo.com/1"))["id"] == "v1"
+
+@pytest.mark.asyncio
+async def test_video_from_file_index(test_app, async_client, monkeypatch, tmp_path):
+    """Тест отдачи файла и статуса по индексу готовых файлов"""
+    import app as app_module
+    from file_index import FileIndex
+
+    download_id = str(uuid.uuid4())
+    (tmp_path / f"title-{download_id}.webm").write_bytes(b"webm-video")
+    index = FileIndex(str(tmp_path))
+    index.rebuild()
+    monkeypatch.setattr(app_module, "file_index", index)
+
+    response = await async_client.get(f"/api/status/{download_id}")
+    assert response.json() == {"status": "completed", "progress": 100}
+
+    response = await async_client.get(f"/api/video/{download_id}", headers={"Range": "bytes=0-3"})
+    assert response.status_code == 206
+    assert response.content == b"webm"
+    assert response.headers["content-type"] == "video/webm"
+
+    (tmp_path / f"title-{download_id}.webm").unlink()
+    response = await async_client.get(f"/api/video/{download_id}")
+    assert response.status_code == 404
+    assert index.get(download_id) is None
+
+def test_progress_websocket_deltas():
+    """Тест подписки на несколько загрузок и кадров только с изменениями"""
+    from starlette.testclient import TestClient
+    from app import app, DummyStorage
+    from progress_bus import progress_bus
+
+    previous_storage = app.state.storage
+    app.state.storage = DummyStorage()
+    app.state.storage.data = {
+        "ws-a": {"status": "downloading", "progress": 10},
+        "ws-b": {"status": "pending", "progress": 0}
+    }
+    try:
+        with TestClient(app).websocket_connect("/ws/progress") as websocket:
+            websocket.send_json({"action": "subscribe", "ids": ["ws-a", "ws-b", "ws-missing"]})
+            assert websocket.receive_json() == {"type": "missing", "ids": ["ws-missing"]}
+            frame = websocket.receive_json()
+            assert frame["type"] == "delta"
+            assert frame["downloads"] == {
+                "ws-a": {"status": "downloading", "progress": 10},
+                "ws-b": {"status": "pending", "progress": 0}
+            }
+
+            progress_bus.publish("ws-a", {"status": "downloading", "progress": 55})
+            frame = websocket.receive_json()
+            assert list(frame["downloads"]) == ["ws-a"]
+            assert frame["downloads"]["ws-a"]["progress"] == 55
+
+            websocket.send_json({"action": "unsubscribe", "ids": ["ws-a"]})
+            websocket.send_json({"action": "bogus"})
+            assert websocket.receive_json()["type"] == "error"
+    finally:
+        app.state.storage = previous_storage
+        progress_bus.discard("ws-a")
+
+def test_progress_websocket_numeric_ids():
+    """Тест: числовые ID одинаково работают при подписке и отписке"""
+    from starlette.testclient import TestClient
+    from app import app, DummyStorage
+    from progress_bus import progress_bus
+
+    previous_storage = app.state.storage
+    app.state.storage = DummyStorage()
+    app.state.storage.data = {"123": {"status": "downloading", "progress": 10}}
+    try:
+        with TestClient(app).websocket_connect("/ws/progress") as websocket:
+            websocket.send_json({"action": "subscribe", "ids": [123]})
+            assert websocket.receive_json()["downloads"] == {"123": {"status": "downloading", "progress": 10}}
+
+            websocket.send_json({"action": "unsubscribe", "ids": [123]})
+            websocket.send_json({"action": "bogus"})
+            assert websocket.receive_json()["type"] == "error"
+
+            # После отписки изменения загрузки больше не приходят
+            progress_bus.publish("123", {"status": "downloading", "progress": 70})
+            websocket.send_json({"action": "bogus"})
+            assert websocket.receive_json()["type"] == "error"
+            websocket.send_json({"action": "bogus"})
+            assert websocket.receive_json()["type"] == "error"
+    finally:
+        app.state.storage = previous_storage
+        progress_bus.discard("123")
+
 class MockYDL:
     """Мок для yt-dlp"""
     def __init__(self, *args, **kwargs):
@@ -576,3 +1160,33 @@ class MockFailedYDL:
 
 if __name__ == "__main__":
     pytest.main(["-v", "test_app.py"])
+
+@pytest.mark.asyncio
+async def test_quota_eviction_expires_aliases(test_app, async_client, tmp_path):
+    """Тест: вытеснение файла отмечает устаревшими и запросы, получившие этот файл"""
+    import app as app_module
+
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"video")
+    owner_id, alias_id, other_id = (str(uuid.uuid4()) for _ in range(3))
+    storage = test_app.state.storage
+    await storage.update_item(owner_id, {"status": "completed", "file_path": str(video_path)})
+    await storage.update_item(alias_id, {"status": "completed", "file_path": str(video_path), "alias_of": owner_id})
+    await storage.update_item(other_id, {"status": "completed", "file_path": str(tmp_path / "other.mp4")})
+
+    # Файл, который отдается клиенту, не вытесняется
+    assert app_module.disk_quota.protect is app_module.is_file_serving
+    app_module.serving_files[str(video_path)] = 1
+    try:
+        assert app_module.is_file_serving(str(video_path))
+    finally:
+        del app_module.serving_files[str(video_path)]
+    assert not app_module.is_file_serving(str(video_path))
+
+    await app_module.on_quota_evict(owner_id, str(video_path))
+
+    assert (await storage.get_item(owner_id))["status"] == "expired"
+    assert (await storage.get_item(alias_id))["status"] == "expired"
+    assert (await storage.get_item(other_id))["status"] == "completed"
+    response = await async_client.get(f"/api/progress/{alias_id}")
+    assert response.json()["status"] == "expired"
@@ -0,0 +1,182 @@
+import os
+import time
+import uuid
+import pytest
+import pytest_asyncio
+from cleanup_engine import CleanupEngine, find_download_id, is_leftover_file
+from state_storage import StateStorage
+
+@pytest.fixture
+def tmp_dirs(tmp_path):
+    """Фикстура для создания временных директорий"""
+    downloads_dir = tmp_path / "downloads"
+    logs_dir = downloads_dir / "logs"
+    logs_dir.mkdir(parents=True)
+    return str(downloads_dir), str(logs_dir)
+
+@pytest_asyncio.fixture
+async def storage(tmp_path):
+    """Фикстура для хранилища состояний"""
+    storage = StateStorage(str(tmp_path / "state.json"))
+    await storage.initialize()
+    yield storage
+    await storage.stop()
+
+def make_file(directory: str, name: str, age: float = 0, size: int = 10) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_leftover_detection():
+    """Тест распознавания промежуточных файлов"""
+    download_id = str(uuid.uuid4())
+    assert is_leftover_file(f"video-{download_id}.mp4.part")
+    assert is_leftover_file(f"video-{download_id}.mp4.ytdl")
+    assert is_leftover_file(f"video-{download_id}.f137.mp4")
+    assert is_leftover_file(f"video-{download_id}.mp4.part-Frag12")
+    assert is_leftover_file(f"video-{download_id}.temp.mp4")
+    assert not is_leftover_file(f"video-{download_id}.mp4")
+    assert find_download_id(f"video-{download_id}.f137.mp4.part") == download_id
+    assert find_download_id("video.mp4") is None
+
+@pytest.mark.asyncio
+async def test_age_cleanup_and_metrics(tmp_dirs):
+    """Тест удаления по возрасту и метрик прогона"""
+    downloads_dir, logs_dir = tmp_dirs
+    old_file = make_file(downloads_dir, "old.mp4", age=3600, size=100)
+    new_file = make_file(downloads_dir, "new.mp4")
+    json_file = make_file(downloads_dir, "meta.json", age=3600)
+    old_log = make_file(logs_dir, "old.log", age=2 * 86400, size=5)
+    new_log = make_file(logs_dir, "new.log")
+
+    removed = []
+    engine = CleanupEngine(downloads_dir, logs_dir, max_age=1800, on_remove=removed.append)
+    metrics = await engine.run()
+    engine.close()
+
+    assert not os.path.exists(old_file)
+    assert not os.path.exists(old_log)
+    assert all(os.path.exists(path) for path in (new_file, json_file, new_log))
+    assert removed == [old_file]
+    assert metrics["files_scanned"] == 5
+    assert metrics["files_removed"] == 2
+    assert metrics["bytes_freed"] == 105
+    assert metrics["logs_removed"] == 1
+    assert engine.stats()["runs"] == 1
+    assert engine.stats()["bytes_freed"] == 105
+
+@pytest.mark.asyncio
+async def test_keep_file(tmp_dirs):
+    """Тест пропуска защищенных файлов"""
+    downloads_dir, _ = tmp_dirs
+    cached_file = make_file(downloads_dir, "cached.mp4", age=3600)
+
+    engine = CleanupEngine(downloads_dir, max_age=60, keep_file=lambda path: path == cached_file)
+    metrics = await engine.run()
+    engine.close()
+
+    assert os.path.exists(cached_file)
+    assert metrics["files_removed"] == 0
+
+@pytest.mark.asyncio
+async def test_reconcile_with_storage(tmp_dirs, storage):
+    """Тест сверки файлов с записями: сироты, остатки и записи без файлов"""
+    downloads_dir, _ = tmp_dirs
+    active_id, done_id, orphan_id, missing_id = (str(uuid.uuid4()) for _ in range(4))
+    stale = time.time() - 3600
+
+    await storage.update_item(active_id, {"status": "downloading", "timestamp": time.time()})
+    await storage.update_item(done_id, {"status": "completed", "timestamp": stale})
+    await storage.update_item(missing_id, {
+        "status": "completed", "timestamp": stale,
+        "file_path": os.path.join(downloads_dir, f"gone-{missing_id}.mp4")
+    })
+
+    active_part = make_file(downloads_dir, f"video-{active_id}.mp4.part", age=1200)
+    active_state = make_file(downloads_dir, f"video-{active_id}.mp4.ytdl", age=1200)
+    done_file = make_file(downloads_dir, f"video-{done_id}.mp4", age=1200)
+    done_part = make_file(downloads_dir, f"video-{done_id}.f137.mp4", age=1200)
+    orphan_file = make_file(downloads_dir, f"video-{orphan_id}.mp4", age=1200)
+    young_orphan = make_file(downloads_dir, f"video-{uuid.uuid4()}.mp4")
+
+    records_removed = []
+    engine = CleanupEngine(
+        downloads_dir, max_age=1800, leftover_max_age=3600, orphan_grace=600, on_record_remove=records_removed.append
+    )
+    metrics = await engine.run(storage=storage)
+    engine.close()
+
+    # Остатки выполняющейся загрузки и свежие файлы остаются
+    assert os.path.exists(active_part) and os.path.exists(active_state)
+    assert os.path.exists(done_file) and os.path.exists(young_orphan)
+    # Остаток завершенной загрузки и файл без записи удалены
+    assert not os.path.exists(done_part)
+    assert not os.path.exists(orphan_file)
+    # Запись завершенной загрузки без файла удалена
+    assert await storage.get_item(missing_id) is None
+    assert records_removed == [missing_id]
+    assert await storage.get_item(done_id) is not None
+    assert metrics["leftovers"] == 1
+    assert metrics["orphan_files"] == 1
+    assert metrics["orphan_records"] == 1
+
+@pytest.mark.asyncio
+async def test_expired_records_remove_files(tmp_dirs, storage):
+    """Тест удаления файлов просроченных записей"""
+    downloads_dir, _ = tmp_dirs
+    download_id = str(uuid.uuid4())
+    file_path = make_file(downloads_dir, f"video-{download_id}.mp4", size=42)
+    await storage.update_item(download_id, {
+        "status": "completed", "timestamp": time.time() - 7200, "file_path": file_path
+    })
+
+    removed, records_removed = [], []
+    engine = CleanupEngine(downloads_dir, max_age=86400, on_remove=removed.append, on_record_remove=records_removed.append)
+    metrics = await engine.run(storage=storage, record_ttl=1800)
+    engine.close()
+
+    assert not os.path.exists(file_path)
+    assert await storage.get_item(download_id) is None
+    assert removed == [file_path]
+    assert records_removed == [download_id]
+    assert metrics["expired_records"] == 1
+    assert metrics["bytes_freed"] == 42
+
+@pytest.mark.asyncio
+async def test_storage_files_survive(tmp_dirs, storage):
+    """Тест: файлы хранилища состояний, журналы и индексы кешей не удаляются"""
+    downloads_dir, _ = tmp_dirs
+    service_files = [
+        make_file(downloads_dir, name, age=7200)
+        for name in (
+            "state.db", "state.db-wal", "state.db-shm", "state.json", "state.json.wal",
+            "state.json.backup", "state.json.tmp", "result_cache.json", "result_cache.json.tmp"
+        )
+    ]
+    old_video = make_file(downloads_dir, "old.mp4", age=7200)
+
+    engine = CleanupEngine(downloads_dir, max_age=0, leftover_max_age=0, orphan_grace=0)
+    await engine.run(storage=storage, record_ttl=60)
+    engine.close()
+
+    assert all(os.path.exists(path) for path in service_files)
+    assert not os.path.exists(old_video)
+
+@pytest.mark.asyncio
+async def test_completed_file_age_from_record(tmp_dirs, storage):
+    """Тест: возраст готового файла отсчитывается от записи, а не от Last-Modified источника"""
+    downloads_dir, _ = tmp_dirs
+    download_id = str(uuid.uuid4())
+    # yt-dlp выставил файлу время изменения источника (год назад), загрузка завершилась только что
+    file_path = make_file(downloads_dir, f"video-{download_id}.mp4", age=365 * 86400)
+    await storage.update_item(download_id, {"status": "completed", "timestamp": time.time(), "file_path": file_path})
+
+    engine = CleanupEngine(downloads_dir, max_age=1800)
+    metrics = await engine.run(storage=storage)
+    engine.close()
+
+    assert os.path.exists(file_path)
+    assert metrics["files_removed"] == 0
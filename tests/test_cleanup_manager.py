@@ -67,6 +67,24 @@ async def test_cleanup_downloads(cleanup_manager, tmp_dirs):
     assert os.path.exists(new_file)      # Новый файл остался
     assert os.path.exists(json_file)     # JSON файл не тронут
 
+@pytest.mark.asyncio
+async def test_cleanup_downloads_keeps_protected_files(tmp_dirs):
+    """Тест пропуска файлов, защищенных от очистки по возрасту"""
+    downloads_dir, logs_dir = tmp_dirs
+    cached_file = os.path.join(downloads_dir, "cached.mp4")
+    old_file = os.path.join(downloads_dir, "old.mp4")
+    for path in (cached_file, old_file):
+        open(path, 'w').close()
+        os.utime(path, (time.time() - 25*3600, time.time() - 25*3600))
+
+    removed = []
+    manager = CleanupManager(downloads_dir, logs_dir, keep_file=lambda path: path == cached_file, on_remove=removed.append)
+    await manager.cleanup_downloads(24)
+
+    assert os.path.exists(cached_file)
+    assert not os.path.exists(old_file)
+    assert removed == [old_file]
+
 @pytest.mark.asyncio
 async def test_cleanup_logs(cleanup_manager, tmp_dirs):
     """Тест очистки старых логов"""
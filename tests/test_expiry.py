@@ -0,0 +1,58 @@
+import os
+import pytest
+from expiry import ExpiryHeap, remove_record_files
+
+def test_pop_expired_returns_only_due_keys():
+    """Тест извлечения только просроченных ключей"""
+    heap = ExpiryHeap()
+    heap.schedule("a", 100.0)
+    heap.schedule("b", 200.0)
+    heap.schedule("c", 300.0)
+
+    assert heap.pop_expired(250.0) == ["a", "b"]
+    assert len(heap) == 1
+    assert heap.pop_expired(250.0) == []
+
+def test_rescheduled_key_is_not_expired_by_stale_entry():
+    """Тест пропуска устаревших элементов после обновления ключа"""
+    heap = ExpiryHeap()
+    heap.schedule("a", 100.0)
+    heap.schedule("a", 500.0)
+    heap.schedule("b", 200.0)
+    heap.discard("b")
+
+    assert heap.pop_expired(300.0) == []
+    assert heap.pop_expired(600.0) == ["a"]
+
+def test_heap_compacts_stale_entries():
+    """Тест ограничения размера кучи при частых обновлениях"""
+    heap = ExpiryHeap()
+    for i in range(1000):
+        heap.schedule("a", float(i))
+
+    assert len(heap._heap) <= 2 * len(heap) + 64
+    assert heap.pop_expired(10000.0) == ["a"]
+
+def test_remove_record_files(tmp_path):
+    """Тест удаления файлов удаленных записей"""
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"data")
+
+    removed = remove_record_files({
+        "a": {"file_path": str(video)},
+        "b": {"file_path": str(tmp_path / "missing.mp4")},
+        "c": {"status": "error"},
+    })
+
+    assert removed == 1
+    assert not video.exists()
+
+def test_remove_record_files_keeps_protected(tmp_path):
+    """Тест пропуска файлов, которые удалять нельзя"""
+    cached = tmp_path / "cached.mp4"
+    cached.write_bytes(b"data")
+
+    removed = remove_record_files({"a": {"file_path": str(cached)}}, keep=lambda path: path == str(cached))
+
+    assert removed == 0
+    assert cached.exists()
@@ -0,0 +1,64 @@
+import os
+import time
+import uuid
+from file_index import FileIndex, extract_download_id, is_final_file
+
+def test_extract_download_id():
+    """Тест определения ID загрузки и промежуточных файлов по имени"""
+    download_id = str(uuid.uuid4())
+    assert extract_download_id(f"Видео - часть 1-{download_id}.mp4") == download_id
+    assert extract_download_id(f"sc-Replit-C1-L0-master-{download_id}.mp4") == download_id
+    assert extract_download_id("video.mp4") is None
+    assert is_final_file(f"title-{download_id}.webm")
+    assert not is_final_file(f"title-{download_id}.fhls-raw-audio-audio.mp4")
+    assert not is_final_file(f"title-{download_id}.temp.mp4")
+    assert not is_final_file(f"converted-title-{download_id}.mp4")
+    assert not is_final_file(f"title-{download_id}.mp4.part")
+
+def test_rebuild_prefers_mp4(tmp_path):
+    """Тест восстановления индекса обходом директории"""
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    (tmp_path / f"a-{first}.webm").write_bytes(b"webm")
+    (tmp_path / f"a-{first}.mp4").write_bytes(b"mp4!!")
+    (tmp_path / f"b-{second}.webm").write_bytes(b"webm")
+    (tmp_path / f"b-{second}.mp4.part").write_bytes(b"part")
+    (tmp_path / "result_cache.json").write_text("[]")
+
+    index = FileIndex(str(tmp_path))
+    assert index.rebuild() == 2
+    assert index.get(first)["container"] == "mp4"
+    assert index.get(first)["size"] == 5
+    assert index.get(second)["path"] == str(tmp_path / f"b-{second}.webm")
+    assert FileIndex(str(tmp_path / "missing")).rebuild() == 0
+
+def test_add_and_discard(tmp_path):
+    """Тест добавления при завершении загрузки и удаления при очистке"""
+    download_id = str(uuid.uuid4())
+    path = tmp_path / f"video-{download_id}.mp4"
+    path.write_bytes(b"video")
+
+    index = FileIndex(str(tmp_path))
+    assert index.add(download_id, str(tmp_path / "missing.mp4")) is None
+    assert index.add(download_id, str(path))["size"] == 5
+    assert index.stats() == {"files": 1, "bytes": 5}
+
+    index.discard_path(os.path.join(str(tmp_path), ".", path.name))
+    assert index.get(download_id) is None
+    assert len(index) == 0
+
+def test_added_file_is_most_recently_used(tmp_path):
+    """Тест: только что завершенная загрузка с давним Last-Modified не вытесняется первой"""
+    old_id, new_id = str(uuid.uuid4()), str(uuid.uuid4())
+    old_path = tmp_path / f"old-{old_id}.mp4"
+    new_path = tmp_path / f"new-{new_id}.mp4"
+    old_path.write_bytes(b"old")
+    new_path.write_bytes(b"new")
+    # yt-dlp выставил новому файлу время изменения источника
+    os.utime(new_path, (time.time() - 365 * 86400, time.time() - 365 * 86400))
+
+    index = FileIndex(str(tmp_path))
+    index.rebuild()
+    index.add(new_id, str(new_path))
+
+    assert index.get(new_id)["last_access"] > time.time() - 60
+    assert [download_id for download_id, _ in index.lru()] == [old_id, new_id]
@@ -0,0 +1,132 @@
+import pytest
+import asyncio
+from job_queue import DownloadJobQueue, QueueFullError, STAGE_CPU, STAGE_NETWORK
+
+@pytest.mark.asyncio
+async def test_workers_limit_concurrency():
+    """Тест ограничения числа одновременно выполняемых задач"""
+    running = 0
+    peak = 0
+
+    async def handler(job_id):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    queue = DownloadJobQueue(handler, workers=4, network_limit=2)
+    await queue.start()
+    for number in range(10):
+        queue.submit(f"job-{number}")
+    await queue._queue.join()
+    await queue.stop()
+
+    assert peak == 2
+    assert queue.stats()["completed"] == 10
+
+@pytest.mark.asyncio
+async def test_queue_position_and_limit():
+    """Тест позиции в очереди и ограничения размера очереди"""
+    queue = DownloadJobQueue(lambda job_id: asyncio.sleep(0), max_pending=2)
+
+    assert queue.submit("a") == 1
+    assert queue.submit("b") == 2
+    with pytest.raises(QueueFullError):
+        queue.submit("c")
+
+    assert queue.cancel("a")
+    assert queue.get_position("b") == 1
+    assert queue.get_position("a") is None
+
+@pytest.mark.asyncio
+async def test_stage_switch_frees_network_slot():
+    """Тест освобождения сетевого слота при переходе в процессорную стадию"""
+    merging = asyncio.Event()
+    release = asyncio.Event()
+    started = []
+    queue = None
+
+    async def handler(job_id):
+        started.append(job_id)
+        if job_id == "first":
+            await queue.enter_stage(job_id, STAGE_CPU)
+            merging.set()
+            await release.wait()
+
+    queue = DownloadJobQueue(handler, workers=2, network_limit=1, cpu_limit=1)
+    await queue.start()
+    queue.submit("first")
+    await merging.wait()
+    assert queue.get_stage("first") == STAGE_CPU
+
+    queue.submit("second")
+    await asyncio.sleep(0.01)
+    assert started == ["first", "second"]
+
+    release.set()
+    await queue._queue.join()
+    await queue.stop()
+    assert queue.stats()["stages"] == {STAGE_NETWORK: 0, STAGE_CPU: 0}
+
+@pytest.mark.asyncio
+async def test_abort_running_job():
+    """Тест прерывания выполняющейся задачи: воркер продолжает работу"""
+    started = asyncio.Event()
+    cancelled = []
+    done = []
+
+    async def handler(job_id):
+        if job_id == "long":
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(job_id)
+                raise
+        done.append(job_id)
+
+    queue = DownloadJobQueue(handler, workers=1)
+    await queue.start()
+    queue.submit("long")
+    queue.submit("next")
+    await started.wait()
+
+    assert queue.is_running("long")
+    assert await queue.abort("long", timeout=1)
+    assert not await queue.abort("missing")
+    await queue._queue.join()
+    await queue.stop()
+
+    assert cancelled == ["long"]
+    assert done == ["next"]
+    assert queue.stats()["aborted"] == 1
+    assert queue.stats()["completed"] == 1
+    assert queue.stats()["stages"] == {STAGE_NETWORK: 0, STAGE_CPU: 0}
+
+@pytest.mark.asyncio
+async def test_cancel_job_waiting_for_stage_slot():
+    """Тест отмены задачи, которую воркер взял, но которая ждет сетевой слот"""
+    release = asyncio.Event()
+    started = []
+
+    async def handler(job_id):
+        started.append(job_id)
+        await release.wait()
+
+    queue = DownloadJobQueue(handler, workers=2, network_limit=1)
+    await queue.start()
+    queue.submit("a")
+    queue.submit("b")
+    await asyncio.sleep(0.01)
+
+    assert started == ["a"]
+    assert queue.get_position("b") == 1
+    assert queue.cancel("b")
+
+    release.set()
+    await queue._queue.join()
+    await queue.stop()
+
+    assert started == ["a"]
+    assert queue.stats()["stages"] == {STAGE_NETWORK: 0, STAGE_CPU: 0}
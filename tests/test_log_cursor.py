@@ -0,0 +1,52 @@
+import os
+from log_cursor import LogCursors
+
+def test_reads_only_appended_bytes(tmp_path):
+    """Тест чтения только дописанной части лога и незавершенной строки"""
+    log_file = tmp_path / "a.log"
+    log_file.write_bytes(b"[download]  10.0% of 5MiB\n[download]  20.5% of")
+    cursors = LogCursors()
+
+    state = cursors.read(str(log_file))
+    assert state.progress == 10.0
+    assert not state.completed
+
+    with open(log_file, "ab") as f:
+        f.write(b" 5MiB\n[download]  42.1% of 5MiB\n")
+    before = cursors.stats()["bytes_read"]
+    state = cursors.read(str(log_file))
+    assert state.progress == 42.1
+    assert cursors.stats()["bytes_read"] - before == len(b" 5MiB\n[download]  42.1% of 5MiB\n")
+
+    with open(log_file, "ab") as f:
+        f.write(b"[download] 100% of 5MiB in 00:00:03\n")
+    assert cursors.read(str(log_file)).completed
+
+def test_large_log_scanned_from_end(tmp_path):
+    """Тест поиска последнего прогресса с конца большого лога"""
+    log_file = tmp_path / "big.log"
+    with open(log_file, "wb") as f:
+        f.write(b"[download]   1.0% of 5MiB\n")
+        f.write((b"[debug] " + b"y" * 100 + b"\n") * 20000)
+        f.write(b"[download]  77.7% of 5MiB\n")
+        f.write((b"[debug] noise\n") * 100)
+    cursors = LogCursors(block_size=4096, max_read=64 * 1024)
+
+    state = cursors.read(str(log_file))
+    assert state.progress == 77.7
+    assert cursors.stats()["bytes_read"] <= 64 * 1024
+    assert state.size == os.path.getsize(log_file)
+
+def test_truncated_and_missing_log(tmp_path):
+    """Тест сброса позиции для пересозданного и удаленного лога"""
+    log_file = tmp_path / "a.log"
+    log_file.write_bytes(b"[download]  50.0% of 5MiB\n")
+    cursors = LogCursors()
+    assert cursors.read(str(log_file)).progress == 50.0
+
+    log_file.write_bytes(b"[download]   5.0%\n")
+    assert cursors.read(str(log_file)).progress == 5.0
+
+    log_file.unlink()
+    assert cursors.read(str(log_file)) is None
+    assert cursors.stats()["tracked"] == 0
@@ -0,0 +1,71 @@
+import time
+import pytest
+import asyncio
+from metadata_cache import MetadataCache, is_single_video, signed_url_expiry, summarize_info
+
+def make_info(video_id="abc", expire=None):
+    url = f"https://cdn.example.com/{video_id}.mp4"
+    if expire is not None:
+        url += f"?expire={int(expire)}&sig=xyz"
+    return {
+        "id": video_id,
+        "title": "Видео",
+        "duration": 10,
+        "formats": [{"format_id": "18", "ext": "mp4", "height": 360, "url": url}]
+    }
+
+def test_get_put_normalized_url():
+    """Тест сохранения по нормализованному URL и ограничения числа записей"""
+    cache = MetadataCache(ttl=60, max_entries=2)
+    assert cache.put("https://youtu.be/a", make_info("a"))
+    assert cache.get("https://www.youtube.com/watch?v=a&utm_source=x")["id"] == "a"
+
+    cache.put("https://example.com/b", make_info("b"))
+    cache.put("https://example.com/c", make_info("c"))
+    assert cache.get("https://youtu.be/a") is None
+    assert cache.stats()["entries"] == 2
+
+def test_ttl_and_signed_url_expiry():
+    """Тест устаревания записи и сокращения срока до истечения подписанных ссылок"""
+    cache = MetadataCache(ttl=0.05, expiry_margin=60)
+    cache.put("https://example.com/a", make_info())
+    time.sleep(0.1)
+    assert cache.get("https://example.com/a") is None
+
+    expire = time.time() + 30
+    assert signed_url_expiry(make_info(expire=expire)) == int(expire)
+    assert not MetadataCache(ttl=600, expiry_margin=60).put("https://example.com/a", make_info(expire=expire))
+    assert not cache.put("https://example.com/list", {"_type": "playlist", "entries": []})
+    assert not cache.put("https://example.com/link", {"_type": "url", "url": "https://example.com/a"})
+    assert is_single_video(make_info())
+    assert is_single_video({"_type": "video", "id": "a"})
+    assert not is_single_video({"_type": "playlist"})
+
+def test_summarize_info():
+    """Тест краткой информации без ссылок на форматы"""
+    summary = summarize_info(make_info())
+    assert summary["title"] == "Видео"
+    assert summary["formats"] == [{"format_id": "18", "ext": "mp4", "height": 360}]
+
+@pytest.mark.asyncio
+async def test_get_or_load_coalesces():
+    """Тест одного извлечения для одновременных запросов одного URL"""
+    cache = MetadataCache(ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return make_info()
+
+    results = await asyncio.gather(*(cache.get_or_load("https://example.com/a", loader) for _ in range(3)))
+    assert len(calls) == 1
+    assert all(info["id"] == "abc" and not hit for info, hit in results)
+    assert (await cache.get_or_load("https://example.com/a", loader))[1] is True
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("https://example.com/b", failing)
+    assert cache.stats()["loading"] == 0
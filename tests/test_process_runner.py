@@ -0,0 +1,57 @@
+import sys
+import time
+import pytest
+import asyncio
+import subprocess
+from process_runner import run_process, capture_output
+
+@pytest.mark.asyncio
+async def test_lines_and_log(tmp_path):
+    """Тест разбора строк по \\n и \\r и записи лога"""
+    log_file = tmp_path / "process.log"
+    lines = []
+    script = "import sys; sys.stdout.write('first\\n[download]  10.0%\\r[download]  55.5%\\nlast')"
+
+    returncode = await run_process([sys.executable, "-c", script], log_file=str(log_file), on_line=lines.append)
+
+    assert returncode == 0
+    assert lines == ["first", "[download]  10.0%", "[download]  55.5%", "last"]
+    assert log_file.read_text().splitlines() == lines
+
+@pytest.mark.asyncio
+async def test_async_handler_and_check():
+    """Тест асинхронного обработчика строк и проверки кода возврата"""
+    lines = []
+
+    async def on_line(line):
+        await asyncio.sleep(0)
+        lines.append(line)
+
+    with pytest.raises(subprocess.CalledProcessError):
+        await run_process([sys.executable, "-c", "print('boom'); raise SystemExit(3)"], on_line=on_line, check=True)
+    assert lines == ["boom"]
+
+@pytest.mark.asyncio
+async def test_timeout_terminates_process():
+    """Тест завершения процесса по таймауту"""
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        await run_process([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5)
+    assert time.monotonic() - started < 10
+
+@pytest.mark.asyncio
+async def test_capture_output():
+    """Тест получения вывода процесса"""
+    assert await capture_output([sys.executable, "-c", "print('audio')"]) == "audio"
+
+@pytest.mark.asyncio
+async def test_multibyte_character_split_across_chunks(monkeypatch):
+    """Тест: символ UTF-8 на границе блоков чтения не заменяется на U+FFFD"""
+    import process_runner
+
+    monkeypatch.setattr(process_runner, "_READ_CHUNK_SIZE", 3)
+    script = "import sys; sys.stdout.buffer.write('ab\\u0432\\u0438\\u0434\\u0435\\u043e\\n\\u0433\\u043e\\u0442\\u043e\\u0432\\u043e'.encode())"
+
+    output = await capture_output([sys.executable, "-c", script])
+
+    assert output == "abвидео\nготово"
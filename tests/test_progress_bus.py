@@ -0,0 +1,130 @@
+import pytest
+import asyncio
+from progress_bus import ProgressBus, ProgressPersister, ProgressRelay
+
+class MemoryStorage:
+    """Хранилище в памяти, запоминающее все записи"""
+
+    def __init__(self):
+        self.writes = []
+
+    async def update_item(self, key, value):
+        self.writes.append((key, dict(value)))
+
+@pytest.mark.asyncio
+async def test_topics_and_last_value():
+    """Тест доставки событий подписчикам темы и кеша последнего значения"""
+    bus = ProgressBus()
+    with bus.subscribe("a") as only_a, bus.subscribe() as everything:
+        bus.publish("a", {"status": "downloading", "progress": 10})
+        bus.publish("b", {"status": "downloading", "progress": 20})
+        bus.publish("a", {"progress": 30})
+
+        assert [event.data["progress"] for event in (only_a.get_nowait(), only_a.get_nowait())] == [10, 30]
+        assert only_a.get_nowait() is None
+        assert [everything.get_nowait().download_id for _ in range(3)] == ["a", "b", "a"]
+
+    last = bus.get_last("a")
+    assert last["status"] == "downloading" and last["progress"] == 30
+    assert bus.stats()["subscribers"] == 0
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_drops_oldest():
+    """Тест потери старых событий медленным подписчиком"""
+    bus = ProgressBus(queue_size=2)
+    subscription = bus.subscribe("a")
+    for progress in range(5):
+        bus.publish("a", {"progress": progress})
+
+    assert [subscription.get_nowait().data["progress"] for _ in range(2)] == [3, 4]
+    assert subscription.dropped == 3
+    subscription.close()
+
+@pytest.mark.asyncio
+async def test_publish_threadsafe():
+    """Тест публикации из другого потока"""
+    bus = ProgressBus()
+    subscription = bus.subscribe("a")
+    await asyncio.to_thread(bus.publish_threadsafe, "a", {"progress": 50})
+
+    event = await subscription.get(timeout=1)
+    assert event.data["progress"] == 50
+    subscription.close()
+
+@pytest.mark.asyncio
+async def test_versions_and_wait():
+    """Тест версий событий и ожидания новой версии"""
+    bus = ProgressBus()
+    bus.publish("a", {"progress": 10})
+    bus.publish("b", {"progress": 10})
+    version = bus.get_version("a")
+    assert bus.get_last("a")["version"] == version
+    assert bus.get_version("b") > version
+
+    assert await bus.wait_for_version("a", version, timeout=0.01) == version
+    assert await bus.wait_for_version("a", version - 1, timeout=10) == version
+
+    waiter = asyncio.create_task(bus.wait_for_version("a", version, timeout=10))
+    await asyncio.sleep(0)
+    bus.publish("a", {"progress": 20})
+    assert await waiter == bus.get_version("a") > version
+    assert bus.stats()["waiters"] == 0
+
+    # После удаления из кеша версии не повторяются
+    bus.discard("a")
+    bus.publish("a", {"progress": 0})
+    assert bus.get_version("a") > version + 1
+
+@pytest.mark.asyncio
+async def test_persister_coalesces_and_respects_finish():
+    """Тест объединения событий при записи и отбрасывания событий после finish"""
+    bus = ProgressBus()
+    storage = MemoryStorage()
+    persister = ProgressPersister(bus, storage, interval=0.01)
+    await persister.start()
+
+    for progress in range(10):
+        bus.publish("a", {"status": "downloading", "progress": progress})
+    bus.publish("skip", {"status": "completed"}, persist=False)
+    await asyncio.sleep(0.05)
+
+    await persister.finish("a")
+    bus.publish("a", {"progress": 99})
+    await persister.stop()
+
+    assert storage.writes == [("a", storage.writes[0][1])]
+    assert storage.writes[0][1]["progress"] == 9
+
+class ChangesStorage:
+    """Хранилище, отдающее заранее заданные изменения через subscribe"""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def subscribe(self):
+        for change in self.changes:
+            yield change
+        await asyncio.Event().wait()
+
+@pytest.mark.asyncio
+async def test_relay_publishes_changes_from_storage():
+    """Тест передачи в шину изменений записей из других процессов"""
+    bus = ProgressBus()
+    relay = ProgressRelay(bus, ChangesStorage([
+        ("a", {"status": "downloading", "progress": 40, "url": "https://example.com"}),
+        ("b", {"status": "downloading", "progress": 5}),
+        ("b", None),
+        ("c", "scalar")
+    ]))
+    with bus.subscribe("a") as subscription:
+        await relay.start()
+        event = await subscription.get(timeout=1)
+        await relay.stop()
+
+    assert event.data["progress"] == 40
+    assert "url" not in event.data
+    # Изменения из хранилища не записываются в него повторно
+    assert event.persist is False
+    assert bus.get_last("b") is None
+    assert bus.get_last("c") is None
+    assert relay.relayed == 2
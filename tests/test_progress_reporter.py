@@ -0,0 +1,75 @@
+import pytest
+import asyncio
+from progress_reporter import ProgressReporter
+
+class Recorder:
+    """Обработчик, запоминающий переданные обновления"""
+
+    def __init__(self):
+        self.updates = []
+
+    async def __call__(self, download_id, update):
+        self.updates.append((download_id, dict(update)))
+
+@pytest.mark.asyncio
+async def test_throttles_by_delta_and_coalesces():
+    """Тест прореживания по изменению прогресса и передачи последнего значения по таймеру"""
+    recorder = Recorder()
+    reporter = ProgressReporter(recorder, min_delta=5, min_interval=0.05)
+
+    for progress in (1, 2, 3, 7, 8, 9):
+        reporter.report("a", "downloading", progress)
+    await asyncio.sleep(0)
+    assert [update["progress"] for _, update in recorder.updates] == [1, 7]
+
+    await asyncio.sleep(0.1)
+    assert [update["progress"] for _, update in recorder.updates] == [1, 7, 9]
+    assert reporter.stats()["emitted"] == 3
+    assert reporter.stats()["dropped"] == 3
+
+@pytest.mark.asyncio
+async def test_terminal_status_always_emitted():
+    """Тест передачи завершающего статуса и отбрасывания последующих обновлений"""
+    recorder = Recorder()
+    reporter = ProgressReporter(recorder, min_delta=50, min_interval=10)
+
+    reporter.report("a", "downloading", 10)
+    reporter.report("a", "downloading", 20)
+    assert reporter.report("a", "completed", 100) is True
+    assert reporter.report("a", "downloading", 30) is False
+    await reporter.flush()
+
+    assert [update["status"] for _, update in recorder.updates] == ["downloading", "completed"]
+    assert recorder.updates[-1][1]["progress"] == 100
+
+@pytest.mark.asyncio
+async def test_finish_discards_pending():
+    """Тест отбрасывания придержанного обновления после finish"""
+    published = []
+    reporter = ProgressReporter(lambda download_id, update: published.append(update), min_interval=10)
+
+    reporter.report("a", "downloading", 10, speed=100)
+    reporter.report("a", "downloading", 10.5)
+    await asyncio.sleep(0)
+    reporter.finish("a")
+    await reporter.flush("a")
+
+    assert published == [{"status": "downloading", "progress": 10, "speed": 100}]
+    assert reporter.stats()["pending"] == 0
+
+    reporter.forget("a")
+    reporter.report("a", "downloading", 0)
+    await reporter.flush("a")
+    assert len(published) == 2
+
+@pytest.mark.asyncio
+async def test_report_threadsafe():
+    """Тест обновления из другого потока"""
+    recorder = Recorder()
+    reporter = ProgressReporter(recorder)
+    reporter.bind_loop(asyncio.get_running_loop())
+
+    await asyncio.to_thread(reporter.report_threadsafe, "a", "error", error="boom")
+    await asyncio.sleep(0.01)
+    await reporter.flush()
+    assert recorder.updates == [("a", {"status": "error", "error": "boom"})]
@@ -0,0 +1,116 @@
+import time
+import uuid
+import pytest
+import asyncio
+from file_index import FileIndex
+from quota_manager import QuotaExceededError, QuotaManager, estimate_download_size
+
+class FakeDisk:
+    """Диск с заданным объемом, свободное место которого растет при удалении файлов"""
+
+    def __init__(self, total, free):
+        self.total = total
+        self.free = free
+
+    async def __call__(self, path):
+        return self.total, self.free
+
+def test_estimate_download_size():
+    """Тест оценки размера по filesize, filesize_approx и битрейту"""
+    assert estimate_download_size(None) is None
+    assert estimate_download_size({"filesize_approx": 1000}) == 1000
+    info = {
+        "duration": 10,
+        "formats": [
+            {"vcodec": "avc1", "acodec": "none", "filesize": 5000},
+            {"vcodec": "avc1", "acodec": "mp4a", "filesize_approx": 3000},
+            {"vcodec": "avc1", "acodec": "mp4a", "tbr": 8}
+        ]
+    }
+    assert estimate_download_size(info) == 10000
+    assert estimate_download_size({"formats": [{"vcodec": "none", "acodec": "opus", "filesize": 700}]}) == 700
+    assert estimate_download_size({"formats": [{"format_id": "hls"}]}) is None
+
+@pytest.mark.asyncio
+async def test_reserve_and_reject():
+    """Тест резервирования с запасом и отклонения загрузки, которая не поместится на диск"""
+    disk = FakeDisk(total=1000, free=900)
+    quota = QuotaManager("/downloads", disk, min_free_bytes=100, reserve_factor=2, wait_timeout=0)
+
+    assert await quota.reserve("a", 200) == 400
+    with pytest.raises(QuotaExceededError):
+        await quota.reserve("b", 300)
+    with pytest.raises(QuotaExceededError, match="объем диска"):
+        await quota.reserve("c", 1000)
+    assert quota.stats()["rejected"] == 2
+
+    quota.release("a")
+    assert await quota.reserve("b", 300) == 600
+
+@pytest.mark.asyncio
+async def test_waits_for_release():
+    """Тест ожидания места, освобожденного завершенной загрузкой"""
+    disk = FakeDisk(total=1000, free=600)
+    quota = QuotaManager("/downloads", disk, min_free_bytes=0, reserve_factor=1, wait_timeout=5, poll_interval=5)
+    waits = []
+
+    async def on_wait(required, available):
+        waits.append((required, available))
+
+    await quota.reserve("a", 400)
+    task = asyncio.create_task(quota.reserve("b", 400, on_wait=on_wait))
+    await asyncio.sleep(0.01)
+    assert not task.done()
+    assert waits == [(400, 200)]
+
+    quota.release("a")
+    assert await asyncio.wait_for(task, 1) == 400
+
+@pytest.mark.asyncio
+async def test_evicts_least_recently_used(tmp_path):
+    """Тест удаления давно использованных готовых файлов ради места"""
+    old_id, recent_id = str(uuid.uuid4()), str(uuid.uuid4())
+    index = FileIndex(str(tmp_path))
+    for download_id in (old_id, recent_id):
+        path = tmp_path / f"video-{download_id}.mp4"
+        path.write_bytes(b"x" * 300)
+        index.add(download_id, str(path))
+    index.get(old_id)["last_access"] = time.time() - 100
+    index.touch(recent_id)
+
+    disk = FakeDisk(total=1000, free=400)
+    evicted = []
+
+    async def on_evict(download_id, path):
+        disk.free += 300
+        evicted.append(download_id)
+
+    quota = QuotaManager(str(tmp_path), disk, index, min_free_bytes=0, reserve_factor=1, wait_timeout=0, on_evict=on_evict)
+    await quota.reserve("new", 600)
+
+    assert evicted == [old_id]
+    assert index.get(old_id) is None
+    assert not (tmp_path / f"video-{old_id}.mp4").exists()
+    assert (tmp_path / f"video-{recent_id}.mp4").exists()
+    assert quota.stats()["evicted_bytes"] == 300
+
+@pytest.mark.asyncio
+async def test_written_bytes_not_counted_twice():
+    """Тест: записанная часть загрузки вычитается из резерва, а не второй раз из свободного места"""
+    disk = FakeDisk(total=1000, free=1000)
+    quota = QuotaManager("/downloads", disk, min_free_bytes=0, reserve_factor=1, wait_timeout=0)
+
+    await quota.reserve("a", 600)
+    # Загрузка записала видео и звук: 500 байт уже на диске
+    quota.record_written("a", "video.f137.mp4", 300)
+    quota.record_written("a", "video.f140.m4a", 200)
+    quota.record_written("unknown", "other.mp4", 100)
+    disk.free = 500
+    assert quota.outstanding_bytes == 100
+
+    assert await quota.reserve("b", 400) == 400
+    with pytest.raises(QuotaExceededError):
+        await quota.reserve("c", 100)
+
+    quota.release("a")
+    assert quota.stats()["outstanding_bytes"] == 400
@@ -0,0 +1,105 @@
+import pytest
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Route
+from range_response import RangeFileResponse, parse_range_header
+
+DATA = bytes(range(256)) * 40  # 10240 байт
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(DATA)
+
+    async def endpoint(request):
+        return RangeFileResponse(str(path), media_type="video/mp4")
+
+    app = Starlette(routes=[Route("/file", endpoint, methods=["GET", "HEAD"])])
+    return httpx.AsyncClient(app=app, base_url="http://test")
+
+def test_parse_range_header():
+    """Тест разбора диапазонов: суффиксы, открытые концы, объединение и некорректные значения"""
+    assert parse_range_header(None, 100) is None
+    assert parse_range_header("bytes=0-9", 100) == [(0, 9)]
+    assert parse_range_header("bytes=90-", 100) == [(90, 99)]
+    assert parse_range_header("bytes=-10", 100) == [(90, 99)]
+    assert parse_range_header("bytes=50-200", 100) == [(50, 99)]
+    assert parse_range_header("bytes=20-29, 0-9, 5-14", 100) == [(0, 14), (20, 29)]
+    assert parse_range_header("bytes=200-300", 100) == []
+    assert parse_range_header("bytes=9-0", 100) is None
+    assert parse_range_header("items=0-9", 100) is None
+    assert parse_range_header("bytes=" + ",".join(f"{i}-{i}" for i in range(0, 40, 2)), 100) is None
+
+@pytest.mark.asyncio
+async def test_full_and_single_range(client):
+    """Тест ответа целиком и одиночного диапазона"""
+    async with client:
+        response = await client.get("/file")
+        assert response.status_code == 200
+        assert response.content == DATA
+        assert response.headers["accept-ranges"] == "bytes"
+
+        response = await client.get("/file", headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == DATA[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+        assert response.headers["content-length"] == "100"
+
+        response = await client.head("/file", headers={"Range": "bytes=-10"})
+        assert response.status_code == 206
+        assert response.headers["content-length"] == "10"
+        assert response.content == b""
+
+        response = await client.get("/file", headers={"Range": "bytes=20000-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+@pytest.mark.asyncio
+async def test_multi_range(client):
+    """Тест ответа multipart/byteranges"""
+    async with client:
+        response = await client.get("/file", headers={"Range": "bytes=0-9, 5000-5009"})
+    assert response.status_code == 206
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    assert int(response.headers["content-length"]) == len(response.content)
+
+    parts = response.content.split(f"--{boundary}".encode())
+    assert parts[-1] == b"--\r\n"
+    bodies = [part.split(b"\r\n\r\n", 1)[1].removesuffix(b"\r\n") for part in parts[1:-1]]
+    assert bodies == [DATA[0:10], DATA[5000:5010]]
+    assert b"Content-Range: bytes 5000-5009/10240" in parts[2]
+
+@pytest.mark.asyncio
+async def test_if_range(client):
+    """Тест If-Range: при несовпадающей версии отдается весь файл"""
+    async with client:
+        etag = (await client.head("/file")).headers["etag"]
+        response = await client.get("/file", headers={"Range": "bytes=0-9", "If-Range": f'"{etag}"'})
+        assert response.status_code == 206
+
+        response = await client.get("/file", headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        assert response.status_code == 200
+        assert response.content == DATA
+
+@pytest.mark.asyncio
+async def test_zerocopy_extension(tmp_path):
+    """Тест передачи через расширение http.response.zerocopysend"""
+    path = tmp_path / "video.mp4"
+    path.write_bytes(DATA)
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "method": "GET", "headers": [(b"range", b"bytes=10-19")],
+        "extensions": {"http.response.zerocopysend": {}}
+    }
+    await RangeFileResponse(str(path))(scope, None, send)
+
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == "http.response.zerocopysend"
+    assert (messages[1]["offset"], messages[1]["count"]) == (10, 10)
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
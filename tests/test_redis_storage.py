@@ -0,0 +1,257 @@
+import time
+import pytest
+import asyncio
+import pytest_asyncio
+from redis.exceptions import WatchError
+from redis_storage import RedisStateStorage
+
+class FakePipeline:
+    """Pipeline поддельного клиента: команды копятся и выполняются в execute"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.watched = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.commands = []
+        self.watched = {}
+
+    async def watch(self, *names):
+        self.watched = {name: self.client.versions.get(name, 0) for name in names}
+
+    def multi(self):
+        pass
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        if any(self.client.versions.get(name, 0) != version for name, version in self.watched.items()):
+            raise WatchError("Watched variable changed.")
+        return [await getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+class FakeRedis:
+    """Минимальный асинхронный клиент Redis в памяти процесса"""
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}  # Счетчики изменений ключей для WATCH
+        self.published = []
+        self.subscribers = []
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        pass
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def hset(self, name, mapping):
+        self.data.setdefault(name, {}).update(mapping)
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    async def hgetall(self, name):
+        return dict(self.data.get(name, {}))
+
+    async def delete(self, name):
+        self.data.pop(name, None)
+        self.versions[name] = self.versions.get(name, 0) + 1
+
+    async def sadd(self, name, *values):
+        self.data.setdefault(name, set()).update(values)
+
+    async def srem(self, name, *values):
+        self.data.get(name, set()).difference_update(values)
+
+    async def smembers(self, name):
+        return set(self.data.get(name, set()))
+
+    async def scard(self, name):
+        return len(self.data.get(name, set()))
+
+    async def zadd(self, name, mapping):
+        self.data.setdefault(name, {}).update(mapping)
+
+    async def zrem(self, name, *values):
+        for value in values:
+            self.data.get(name, {}).pop(value, None)
+
+    async def zrangebyscore(self, name, min, max):
+        limit = float(max.lstrip("("))
+        return [key for key, score in sorted(self.data.get(name, {}).items(), key=lambda item: item[1]) if score < limit]
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+        for subscriber in list(self.subscribers):
+            subscriber.deliver(channel, message)
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+class FakePubSub:
+    """Подписка pub/sub поддельного клиента"""
+
+    def __init__(self, client):
+        self.client = client
+        self.channels = set()
+        self.messages = asyncio.Queue()
+
+    def deliver(self, channel, message):
+        if channel in self.channels:
+            self.messages.put_nowait({"type": "message", "channel": channel, "data": message})
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+        self.client.subscribers.append(self)
+
+    async def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    async def close(self):
+        self.client.subscribers.remove(self)
+
+    async def listen(self):
+        while True:
+            yield await self.messages.get()
+
+@pytest_asyncio.fixture
+async def storage():
+    """Фикстура для создания хранилища с поддельным клиентом"""
+    storage = RedisStateStorage(client=FakeRedis())
+    await storage.initialize()
+    yield storage
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_set_get_update_delete(storage):
+    """Тест базовых операций с записями"""
+    await storage.set_item("test", {"id": "test", "value": 1})
+    assert await storage.get_item("test") == {"id": "test", "value": 1}
+
+    await storage.update_item("test", {"value": 2}, status="downloading")
+    assert await storage.get_item("test") == {"id": "test", "value": 2, "status": "downloading"}
+
+    await storage.delete_item("test")
+    assert await storage.get_item("test") is None
+    assert await storage.get_all_items() == {}
+
+@pytest.mark.asyncio
+async def test_update_writes_only_changed_fields(storage):
+    """Тест записи только переданных полей при обновлении"""
+    await storage.set_item("test", {"status": "downloading", "progress": 0, "filename": "a.mp4"})
+    storage._client.published.clear()
+
+    await storage.update_item("test", progress=50)
+
+    fields = storage._client.data["downloads:item:test"]
+    assert fields == {"status": '"downloading"', "progress": "50", "filename": '"a.mp4"'}
+    assert len(storage._client.published) == 1
+
+@pytest.mark.asyncio
+async def test_status_index(storage):
+    """Тест подсчета и выборки по статусу"""
+    await storage.set_item("a", {"status": "downloading"})
+    await storage.set_item("b", {"status": "completed"})
+    await storage.set_item("c", {"status": "downloading"})
+
+    await storage.update_item("c", status="completed")
+
+    assert await storage.count_by_status() == {"downloading": 1, "completed": 2}
+    assert set(await storage.get_items_by_status("completed")) == {"b", "c"}
+
+@pytest.mark.asyncio
+async def test_cleanup_old_items(storage):
+    """Тест очистки устаревших записей по sorted set"""
+    now = time.time()
+    await storage.set_item("old", {"status": "completed", "timestamp": now - 7200})
+    await storage.set_item("new", {"status": "completed", "timestamp": now})
+
+    removed = await storage.cleanup_old_items(max_age_hours=1)
+
+    assert set(removed) == {"old"}
+    assert set(await storage.get_all_items()) == {"new"}
+    assert await storage.count_by_status() == {"completed": 1}
+
+@pytest.mark.asyncio
+async def test_atomic_operation(storage):
+    """Тест применения изменений атомарной операции"""
+    await storage.set_item("a", {"status": "pending"})
+    await storage.set_item("b", {"status": "pending"})
+
+    async with storage.atomic_operation() as state:
+        state["a"]["status"] = "completed"
+        del state["b"]
+
+    assert await storage.get_all_items() == {"a": {"status": "completed"}}
+    assert await storage.get_items(["a", "b"]) == {"a": {"status": "completed"}}
+
+@pytest.mark.asyncio
+async def test_update_retries_on_concurrent_write(storage):
+    """Тест повтора обновления, если другой воркер изменил запись между чтением и записью"""
+    await storage.set_item("a", {"status": "downloading", "progress": 10})
+    read = storage._get_many
+    raced = []
+
+    async def racing_read(keys):
+        current = await read(keys)
+        if not raced:
+            raced.append(keys)
+            # Другой воркер завершает загрузку после чтения записи
+            await storage.update_item("a", status="completed")
+        return current
+
+    storage._get_many = racing_read
+    await storage.update_item("a", progress=50)
+
+    assert await storage.get_item("a") == {"status": "completed", "progress": 50}
+    assert await storage.get_keys_by_status("downloading") == []
+    assert await storage.get_keys_by_status("completed") == ["a"]
+
+@pytest.mark.asyncio
+async def test_cleanup_keeps_items_updated_after_selection(storage):
+    """Тест: запись, обновленная после выборки из sorted set, не удаляется"""
+    await storage.set_item("a", {"status": "downloading", "timestamp": time.time() - 7200})
+    select = storage._client.zrangebyscore
+
+    async def racing_select(*args):
+        keys = await select(*args)
+        await storage.update_item("a", timestamp=time.time())
+        return keys
+
+    storage._client.zrangebyscore = racing_select
+    removed = await storage.cleanup_old_items(max_age_hours=1)
+
+    assert removed == {}
+    assert (await storage.get_item("a"))["status"] == "downloading"
+
+@pytest.mark.asyncio
+async def test_subscribe_receives_other_workers_changes(storage):
+    """Тест уведомлений: изменения другого воркера приходят, свои - нет"""
+    other = RedisStateStorage(client=storage._client)
+    await other.initialize()
+    received = []
+
+    async def listen():
+        async for key, value in storage.subscribe():
+            received.append((key, value))
+            if value is None:
+                break
+
+    listener = asyncio.create_task(listen())
+    await asyncio.sleep(0)
+    await storage.set_item("own", {"status": "downloading"})
+    await other.set_item("a", {"status": "downloading", "progress": 10})
+    await other.delete_item("a")
+    await asyncio.wait_for(listener, timeout=1)
+
+    assert received == [("a", {"status": "downloading", "progress": 10}), ("a", None)]
+    assert storage._client.subscribers == []
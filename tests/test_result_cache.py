@@ -0,0 +1,64 @@
+import os
+import pytest
+from result_cache import ResultCache
+
+def make_file(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+@pytest.mark.asyncio
+async def test_get_put_and_lru_eviction(tmp_path):
+    """Тест вытеснения давно использованных файлов при превышении бюджета"""
+    cache = ResultCache(max_bytes=250)
+    first = make_file(tmp_path, "first.mp4", 100)
+    second = make_file(tmp_path, "second.mp4", 100)
+    third = make_file(tmp_path, "third.mp4", 100)
+
+    assert await cache.put("a", first, {"download_id": "id-a"})
+    assert await cache.put("b", second)
+    assert (await cache.get("a"))["download_id"] == "id-a"
+    assert cache.is_cached(first)
+
+    # "b" использовался давнее всего и вытесняется вместе с файлом
+    assert await cache.put("c", third)
+    assert await cache.get("b") is None
+    assert not os.path.exists(second)
+    assert os.path.exists(first) and os.path.exists(third)
+    assert cache.stats()["bytes"] == 200
+    assert cache.stats()["evictions"] == 1
+
+@pytest.mark.asyncio
+async def test_rejects_oversized_and_missing_files(tmp_path):
+    """Тест отказа для файлов больше бюджета и удаленных файлов"""
+    cache = ResultCache(max_bytes=50)
+    assert not await cache.put("big", make_file(tmp_path, "big.mp4", 100))
+    assert not await cache.put("missing", str(tmp_path / "missing.mp4"))
+
+    small = make_file(tmp_path, "small.mp4", 10)
+    assert await cache.put("small", small)
+    os.remove(small)
+    assert await cache.get("small") is None
+    assert cache.stats()["entries"] == 0
+
+    assert not await ResultCache(max_bytes=0).put("small", make_file(tmp_path, "other.mp4", 10))
+
+@pytest.mark.asyncio
+async def test_index_persists_lru_order(tmp_path):
+    """Тест восстановления индекса и порядка обращений после перезапуска"""
+    index_path = str(tmp_path / "result_cache.json")
+    cache = ResultCache(max_bytes=1000, index_path=index_path)
+    first = make_file(tmp_path, "first.mp4", 100)
+    second = make_file(tmp_path, "second.mp4", 100)
+    await cache.put("a", first)
+    await cache.put("b", second)
+    await cache.get("a")
+    await cache.put("c", make_file(tmp_path, "third.mp4", 100))
+
+    # После перезапуска с меньшим бюджетом вытесняется давно использованный "b"
+    reloaded = ResultCache(max_bytes=200, index_path=index_path)
+    await reloaded.load()
+    assert reloaded.stats()["entries"] == 2
+    assert not os.path.exists(second)
+    assert (await reloaded.get("a"))["file_path"] == first
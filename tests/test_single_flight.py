@@ -0,0 +1,51 @@
+from single_flight import SingleFlight, make_flight_key, normalize_url
+
+def test_normalize_url():
+    """Тест нормализации URL видео"""
+    canonical = "https://youtube.com/watch?v=abc"
+    assert normalize_url("http://www.youtube.com/watch?v=abc&feature=share#t=10") == canonical
+    assert normalize_url("https://youtu.be/abc?si=tracking") == canonical
+    assert normalize_url("https://m.youtube.com/shorts/abc/") == canonical
+    assert normalize_url("https://YOUTUBE.com:443/watch?list=PL1&v=abc") == canonical
+    assert normalize_url("https://vimeo.com/123?b=2&a=1&utm_source=x") == "https://vimeo.com/123?a=1&b=2"
+    assert normalize_url("https://vimeo.com/123") != normalize_url("https://vimeo.com/124")
+
+def test_flight_key_includes_format_and_quality():
+    """Тест ключа объединения загрузок"""
+    url = "https://vimeo.com/123"
+    assert make_flight_key(url) == make_flight_key("http://www.vimeo.com/123/")
+    assert make_flight_key(url, "mp4") != make_flight_key(url)
+    assert make_flight_key(url, "mp4", "720p") != make_flight_key(url, "mp4", "1080p")
+
+def test_single_flight_registry():
+    """Тест регистрации, присоединения и завершения загрузок"""
+    flights = SingleFlight()
+    flights.start("key", "primary")
+    assert flights.get("key") == "primary"
+
+    flights.attach("primary", "alias-1")
+    flights.attach("primary", "alias-2")
+    assert flights.detach("alias-1") is True
+    assert flights.detach("unknown") is False
+    assert flights.stats() == {"in_flight": 1, "aliases": 1, "abandoned": 0, "joined": 2}
+
+    assert flights.complete("primary") == ["alias-2"]
+    assert flights.get("key") is None
+    assert flights.complete("primary") == []
+
+def test_single_flight_abandon():
+    """Тест отмены основной загрузки с присоединенными запросами"""
+    flights = SingleFlight()
+    flights.start("key", "primary")
+    assert flights.abandon("primary") is False
+
+    flights.attach("primary", "alias-1")
+    assert flights.get_primary("alias-1") == "primary"
+    assert flights.abandon("primary") is True
+    assert flights.is_abandoned("primary")
+    assert flights.stats()["abandoned"] == 1
+
+    assert flights.detach("alias-1") is True
+    assert not flights.has_aliases("primary")
+    assert flights.complete("primary") == []
+    assert not flights.is_abandoned("primary")
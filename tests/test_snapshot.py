@@ -0,0 +1,48 @@
+import json
+from snapshot import SNAPSHOT_MAGIC, load_snapshot, read_snapshot, write_snapshot
+
+def test_binary_roundtrip(tmp_path):
+    """Тест записи и чтения бинарного снимка"""
+    path = str(tmp_path / "state.json")
+    state = {"a": {"status": "completed", "progress": 100}, "b": {"title": "Видео"}}
+
+    write_snapshot(path, state, "binary")
+
+    with open(path, "rb") as f:
+        assert f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    assert load_snapshot(path) == state
+
+def test_corrupt_tail_keeps_previous_records(tmp_path):
+    """Тест потери только записей после поврежденного места"""
+    path = str(tmp_path / "state.json")
+    write_snapshot(path, {"a": {"value": 1}, "b": {"value": 2}, "c": {"value": 3}}, "binary")
+
+    # Портим последний байт и обрезаем файл
+    with open(path, "r+b") as f:
+        data = f.read()
+        f.seek(len(data) - 1)
+        f.write(b"!")
+    assert load_snapshot(path) == {"a": {"value": 1}, "b": {"value": 2}}
+
+    with open(path, "r+b") as f:
+        f.truncate(len(data) - 5)
+    assert load_snapshot(path) == {"a": {"value": 1}, "b": {"value": 2}}
+
+def test_legacy_json(tmp_path):
+    """Тест чтения снимка в формате JSON прежних версий"""
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps({"a": {"value": 1}}, indent=2))
+
+    assert load_snapshot(str(path)) == {"a": {"value": 1}}
+
+def test_meta_roundtrip(tmp_path):
+    """Тест служебных данных снимка в обоих форматах"""
+    state = {"a": {"value": 1}}
+    for snapshot_format in ("json", "binary"):
+        path = str(tmp_path / f"state.{snapshot_format}")
+        write_snapshot(path, state, snapshot_format, meta={"wal_seq": 7})
+        assert read_snapshot(path) == (state, {"wal_seq": 7})
+        assert load_snapshot(path) == state
+
+        write_snapshot(path, state, snapshot_format)
+        assert read_snapshot(path) == (state, {})
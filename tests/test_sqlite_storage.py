@@ -0,0 +1,79 @@
+import os
+import time
+import json
+import pytest
+import asyncio
+import pytest_asyncio
+from sqlite_storage import SQLiteStateStorage
+
+@pytest_asyncio.fixture
+async def storage(tmp_path):
+    """Фикстура для создания тестового хранилища"""
+    storage = SQLiteStateStorage(str(tmp_path / "state.db"))
+    await storage.initialize()
+    yield storage
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_set_get_update_delete(storage):
+    """Тест базовых операций с записями"""
+    await storage.set_item("test", {"id": "test", "value": 1})
+    assert await storage.get_item("test") == {"id": "test", "value": 1}
+
+    await storage.update_item("test", {"value": 2}, status="downloading")
+    assert await storage.get_item("test") == {"id": "test", "value": 2, "status": "downloading"}
+
+    await storage.delete_item("test")
+    assert await storage.get_item("test") is None
+
+@pytest.mark.asyncio
+async def test_count_and_select_by_status(storage):
+    """Тест подсчета и выборки по индексу статуса"""
+    await storage.set_item("a", {"status": "downloading"})
+    await storage.set_item("b", {"status": "completed"})
+    await storage.set_item("c", {"status": "completed"})
+
+    counts = await storage.count_by_status()
+    assert counts == {"downloading": 1, "completed": 2}
+
+    completed = await storage.get_items_by_status("completed")
+    assert set(completed) == {"b", "c"}
+
+@pytest.mark.asyncio
+async def test_cleanup_old_items(storage):
+    """Тест очистки устаревших записей по индексу updated_at"""
+    await storage.set_item("old", {"status": "completed", "updated_at": time.time() - 3600})
+    await storage.set_item("new", {"status": "completed", "updated_at": time.time()})
+    await storage.set_item("no_time", {"status": "completed"})
+
+    await storage.cleanup_old_items(max_age_hours=0.5)
+
+    assert await storage.get_item("old") is None
+    assert await storage.get_item("new") is not None
+    assert await storage.get_item("no_time") is not None
+
+@pytest.mark.asyncio
+async def test_atomic_operation(storage):
+    """Тест применения изменений атомарной операции"""
+    await storage.set_item("keep", {"value": 1})
+    await storage.set_item("drop", {"value": 2})
+
+    async with storage.atomic_operation() as state:
+        state["keep"]["value"] = 10
+        del state["drop"]
+        state["added"] = {"value": 3}
+
+    assert await storage.get_all_items() == {"keep": {"value": 10}, "added": {"value": 3}}
+    assert await storage.get_items(["added", "drop", "added"]) == {"added": {"value": 3}}
+
+@pytest.mark.asyncio
+async def test_shared_between_instances(storage, tmp_path):
+    """Тест общего состояния для нескольких экземпляров (воркеров)"""
+    other = SQLiteStateStorage(str(tmp_path / "state.db"))
+    await other.initialize()
+    try:
+        await storage.set_item("shared", {"progress": 10})
+        await other.update_item("shared", {"progress": 50})
+        assert (await storage.get_item("shared"))["progress"] == 50
+    finally:
+        await other.stop()
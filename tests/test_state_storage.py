@@ -4,6 +4,7 @@ import pytest
 import asyncio
 import pytest_asyncio
 from state_storage import StateStorage
+from snapshot import read_snapshot
 from datetime import datetime, timedelta
 
 @pytest_asyncio.fixture
@@ -88,6 +89,13 @@ async def test_get_all_items(storage):
     result = await storage.get_all_items()
     assert result == test_data
 
+@pytest.mark.asyncio
+async def test_get_items(storage):
+    """Тест получения нескольких элементов по ключам"""
+    await storage.set_item("a", {"value": 1})
+    await storage.set_item("b", {"value": 2})
+    assert await storage.get_items(["a", "missing", "b"]) == {"a": {"value": 1}, "b": {"value": 2}}
+
 @pytest.mark.asyncio
 async def test_cleanup_old_items(storage):
     """Тест очистки старых элементов"""
@@ -138,3 +146,289 @@ async def test_concurrent_access(storage):
     result = await storage.get_item("test")
     assert isinstance(result["value"], int)
     assert 0 <= result["value"] <= 9
+
+@pytest.mark.asyncio
+async def test_wal_replay_after_crash(tmp_path):
+    """Тест восстановления изменений из журнала без сохранения снимка"""
+    state_file = str(tmp_path / "wal_state.json")
+    storage = StateStorage(state_file, wal_enabled=True)
+    await storage.initialize()
+
+    await storage.set_item("a", {"value": 1})
+    await storage.update_item("a", {"value": 2})
+    await storage.set_item("b", {"value": 3})
+    await storage.delete_item("b")
+
+    # Снимок не перезаписывался, изменения есть только в журнале
+    with open(state_file, 'r') as f:
+        assert json.load(f) == {}
+    assert os.path.getsize(f"{state_file}.wal") > 0
+
+    # Имитируем падение процесса: новое хранилище без вызова stop(),
+    # блокировку журнала упавший процесс уже не держит
+    storage._compact_task.cancel()
+    storage._release_wal_lock()
+    recovered = StateStorage(state_file, wal_enabled=True)
+    await recovered.initialize()
+    assert await recovered.get_item("a") == {"value": 2}
+    assert await recovered.get_item("b") is None
+    await recovered.stop()
+
+@pytest.mark.asyncio
+async def test_wal_compaction(tmp_path):
+    """Тест сжатия журнала в снимок при достижении порога"""
+    state_file = str(tmp_path / "wal_state.json")
+    storage = StateStorage(state_file, wal_enabled=True, compact_threshold=3)
+    await storage.initialize()
+
+    for i in range(3):
+        await storage.set_item(str(i), {"value": i})
+
+    # Даем фоновой задаче выполнить сжатие
+    for _ in range(50):
+        if storage._wal_records == 0:
+            break
+        await asyncio.sleep(0.01)
+
+    assert storage._wal_records == 0
+    assert os.path.getsize(f"{state_file}.wal") == 0
+    # Снимок помнит номер последней записи журнала, которую он содержит
+    assert read_snapshot(state_file) == ({str(i): {"value": i} for i in range(3)}, {"wal_seq": 3})
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_wal_crash_after_snapshot(tmp_path):
+    """Тест: журнал, не очищенный после записи снимка, не возвращает ключам старые значения"""
+    state_file = str(tmp_path / "wal_state.json")
+    storage = StateStorage(state_file, wal_enabled=True, flush_interval=60)
+    await storage.initialize()
+
+    await storage.set_item("a", {"value": 1}, flush=True)
+    await storage.set_item("b", {"value": 1}, flush=True)
+    # Отложенное изменение попадает только в снимок
+    await storage.update_item("a", {"value": 2})
+
+    # Процесс упал после записи снимка, но до очистки журнала
+    async with storage.lock:
+        await storage._save_state()
+    storage._compact_task.cancel()
+    storage._flush_task.cancel()
+    storage._release_wal_lock()
+    with open(f"{state_file}.wal") as f:
+        assert len(f.readlines()) == 2
+
+    recovered = StateStorage(state_file, wal_enabled=True)
+    await recovered.initialize()
+    assert await recovered.get_item("a") == {"value": 2}
+    assert await recovered.get_item("b") == {"value": 1}
+
+    # Новые записи журнала нумеруются после записей снимка и применяются
+    await recovered.set_item("a", {"value": 3})
+    recovered._compact_task.cancel()
+    recovered._release_wal_lock()
+    again = StateStorage(state_file, wal_enabled=True)
+    await again.initialize()
+    assert await again.get_item("a") == {"value": 3}
+    await again.stop()
+
+@pytest.mark.asyncio
+async def test_wal_single_owner(tmp_path):
+    """Тест: журнал ведет только один процесс, второй пишет снимки и журнал не трогает"""
+    state_file = str(tmp_path / "wal_state.json")
+    owner = StateStorage(state_file, wal_enabled=True)
+    await owner.initialize()
+    other = StateStorage(state_file, wal_enabled=True)
+    await other.initialize()
+    assert owner.wal_enabled
+    assert not other.wal_enabled
+
+    await owner.set_item("a", {"value": 1})
+    await other.set_item("b", {"value": 2})
+
+    # Снимок второго процесса не очистил журнал владельца и не хранит номер записи
+    with open(f"{state_file}.wal") as f:
+        assert [json.loads(line)["key"] for line in f] == ["a"]
+    assert read_snapshot(state_file) == ({"b": {"value": 2}}, {})
+
+    # После падения обоих процессов изменения владельца восстанавливаются из журнала
+    owner._compact_task.cancel()
+    owner._release_wal_lock()
+    other._release_wal_lock()
+    recovered = StateStorage(state_file, wal_enabled=True)
+    await recovered.initialize()
+    assert await recovered.get_item("a") == {"value": 1}
+    assert await recovered.get_item("b") == {"value": 2}
+    await recovered.stop()
+
+@pytest.mark.asyncio
+async def test_wal_torn_tail(tmp_path):
+    """Тест пропуска оборванной последней записи журнала"""
+    state_file = str(tmp_path / "wal_state.json")
+    with open(state_file, 'w') as f:
+        json.dump({"a": {"value": 1}}, f)
+    with open(f"{state_file}.wal", 'w') as f:
+        f.write('{"op":"set","key":"b","value":{"value":2}}\n{"op":"set","key":"c","val')
+
+    storage = StateStorage(state_file, wal_enabled=True)
+    await storage.initialize()
+    assert await storage.get_item("a") == {"value": 1}
+    assert await storage.get_item("b") == {"value": 2}
+    assert await storage.get_item("c") is None
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_write_behind_flush(tmp_path):
+    """Тест отложенной записи: прогресс копится в памяти, завершение сохраняется сразу"""
+    state_file = str(tmp_path / "wb_state.json")
+    storage = StateStorage(state_file, wal_enabled=True, flush_interval=60)
+    await storage.initialize()
+    wal_file = f"{state_file}.wal"
+
+    await storage.set_item("d1", {"status": "downloading", "progress": 0})
+    for progress in range(1, 50):
+        await storage.update_item("d1", {"progress": progress})
+
+    # На диск ничего не записано, ключ помечен как измененный
+    assert not os.path.exists(wal_file) or os.path.getsize(wal_file) == 0
+    assert storage._dirty == {"d1"}
+
+    # Завершающий статус сохраняется синхронно одной записью
+    await storage.update_item("d1", {"status": "completed", "progress": 100})
+    assert storage._dirty == set()
+    with open(wal_file) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1
+    assert records[0]["value"]["status"] == "completed"
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_write_behind_group_commit(tmp_path):
+    """Тест досрочной записи после накопления flush_batch_size изменений"""
+    state_file = str(tmp_path / "wb_state.json")
+    storage = StateStorage(state_file, wal_enabled=True, flush_interval=60, flush_batch_size=5)
+    await storage.initialize()
+
+    for i in range(5):
+        await storage.set_item(f"k{i}", {"progress": i})
+
+    for _ in range(50):
+        if not storage._dirty:
+            break
+        await asyncio.sleep(0.01)
+
+    assert storage._dirty == set()
+    with open(f"{state_file}.wal") as f:
+        assert len(f.readlines()) == 5
+    await storage.stop()
+
+@pytest.mark.asyncio
+async def test_write_behind_stop_drains(tmp_path):
+    """Тест сохранения буфера при остановке хранилища"""
+    state_file = str(tmp_path / "wb_state.json")
+    storage = StateStorage(state_file, flush_interval=60)
+    await storage.initialize()
+
+    await storage.set_item("d1", {"status": "downloading", "progress": 42})
+    with open(state_file) as f:
+        assert json.load(f) == {}
+
+    await storage.stop()
+    with open(state_file) as f:
+        assert json.load(f) == {"d1": {"status": "downloading", "progress": 42}}
+
+@pytest.mark.asyncio
+async def test_reads_do_not_wait_for_persistence(tmp_path):
+    """Тест чтения без ожидания записи на диск"""
+    storage = StateStorage(str(tmp_path / "state.json"))
+    await storage.initialize()
+    await storage.set_item("test", {"progress": 1})
+
+    # Пока файл занят записью, чтение выполняется без ожидания
+    async with storage.lock:
+        result = await asyncio.wait_for(storage.get_item("test"), timeout=0.5)
+    assert result == {"progress": 1}
+
+    # Изменение полученной копии не затрагивает хранимую запись
+    result["progress"] = 99
+    assert (await storage.get_item("test"))["progress"] == 1
+
+@pytest.mark.asyncio
+async def test_get_all_items_snapshot(tmp_path):
+    """Тест неизменности снимка при последующих изменениях"""
+    storage = StateStorage(str(tmp_path / "state.json"))
+    await storage.initialize()
+    await storage.set_item("a", {"progress": 1})
+    snapshot = await storage.get_all_items()
+
+    await storage.update_item("a", {"progress": 2})
+    await storage.set_item("b", {"progress": 3})
+
+    assert snapshot == {"a": {"progress": 1}}
+    assert await storage.get_all_items() == {"a": {"progress": 2}, "b": {"progress": 3}}
+
+@pytest.mark.asyncio
+async def test_status_index(tmp_path):
+    """Тест счетчиков и индекса статусов"""
+    storage = StateStorage(str(tmp_path / "state.json"))
+    await storage.initialize()
+
+    await storage.set_item("a", {"status": "downloading"})
+    await storage.set_item("b", {"status": "downloading"})
+    await storage.set_item("c", {"status": "pending"})
+    await storage.update_item("b", {"status": "completed"})
+    await storage.delete_item("c")
+
+    assert await storage.count_by_status() == {"downloading": 1, "completed": 1}
+    assert await storage.get_keys_by_status("completed") == ["b"]
+    items = await storage.get_items_by_status("downloading")
+    assert items == {"a": {"status": "downloading"}}
+    # Выборка возвращает копии: изменение результата не меняет хранимую запись
+    items["a"]["status"] = "error"
+    assert await storage.get_item("a") == {"status": "downloading"}
+
+    # Индекс восстанавливается при загрузке и после атомарных операций
+    async with storage.atomic_operation() as state:
+        state["d"] = {"status": "error"}
+    await storage.stop()
+
+    reloaded = StateStorage(str(tmp_path / "state.json"))
+    await reloaded.initialize()
+    assert await reloaded.count_by_status() == {"downloading": 1, "completed": 1, "error": 1}
+
+@pytest.mark.asyncio
+async def test_cleanup_old_items_removes_files(tmp_path):
+    """Тест очистки по куче устаревания с удалением файлов"""
+    storage = StateStorage(str(tmp_path / "state.json"))
+    await storage.initialize()
+
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"data")
+    now = datetime.now().timestamp()
+    await storage.set_item("old", {"status": "completed", "updated_at": now - 3600, "file_path": str(video)})
+    await storage.set_item("refreshed", {"status": "downloading", "updated_at": now - 3600})
+    await storage.update_item("refreshed", {"updated_at": now})
+
+    expired = await storage.cleanup_old_items(max_age_hours=0.5, remove_files=True)
+
+    assert list(expired) == ["old"]
+    assert not video.exists()
+    assert await storage.get_item("refreshed") is not None
+    assert await storage.count_by_status() == {"downloading": 1}
+
+@pytest.mark.asyncio
+async def test_binary_snapshot_migration(tmp_path):
+    """Тест загрузки JSON-снимка и сохранения в бинарном формате"""
+    state_file = tmp_path / "state.json"
+    state_file.write_text(json.dumps({"a": {"value": 1}}, indent=2))
+
+    storage = StateStorage(str(state_file), snapshot_format="binary")
+    await storage.initialize()
+    assert await storage.get_item("a") == {"value": 1}
+    await storage.set_item("b", {"value": 2})
+    await storage.stop()
+
+    assert state_file.read_bytes().startswith(b"DMSNAP1")
+    reloaded = StateStorage(str(state_file), snapshot_format="binary")
+    await reloaded.initialize()
+    assert await reloaded.get_all_items() == {"a": {"value": 1}, "b": {"value": 2}}
+    await reloaded.stop()
@@ -0,0 +1,80 @@
+import os
+import asyncio
+import pytest
+from ydl_worker import YdlProcessPool
+
+def report_and_return(channel, value):
+    """Функция дочернего процесса: отправляет прогресс и ждет разрешения на постобработку"""
+    channel.send("progress", {"pid": os.getpid(), "value": value})
+    channel.send("postprocess")
+    channel.wait()
+    return value * 2
+
+def fail(channel):
+    raise RuntimeError("ошибка в дочернем процессе")
+
+def wait_for_stop(channel):
+    """Функция дочернего процесса: работает, пока задачу не отменят"""
+    import time
+    channel.send("progress")
+    while not channel.stopped():
+        time.sleep(0.01)
+    return "stopped"
+
+@pytest.mark.asyncio
+async def test_run_marshals_messages_and_result():
+    """Тест передачи сообщений и результата из дочернего процесса"""
+    pool = YdlProcessPool(max_workers=1)
+    messages = []
+
+    async def on_message(kind, payload):
+        messages.append((kind, payload))
+
+    try:
+        assert await pool.run("job", report_and_return, 21, on_message=on_message) == 42
+    finally:
+        await pool.stop()
+
+    assert messages[0][0] == "progress"
+    assert messages[0][1]["pid"] != os.getpid()
+    assert messages[0][1]["value"] == 21
+    assert messages[1][0] == "postprocess"
+
+@pytest.mark.asyncio
+async def test_run_propagates_errors():
+    """Тест передачи исключения из дочернего процесса"""
+    pool = YdlProcessPool(max_workers=1)
+    try:
+        with pytest.raises(RuntimeError, match="дочернем"):
+            await pool.run("job", fail)
+    finally:
+        await pool.stop()
+
+@pytest.mark.asyncio
+async def test_cancel_stops_child():
+    """Тест отмены: дочерний процесс видит флаг остановки и освобождает пул"""
+    pool = YdlProcessPool(max_workers=1)
+    started = asyncio.Event()
+    handler_cancelled = []
+
+    async def on_message(kind, payload):
+        started.set()
+        # Обработчик ждет, например, слот стадии
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            handler_cancelled.append(kind)
+            raise
+
+    try:
+        task = asyncio.create_task(pool.run("job", wait_for_stop, on_message=on_message))
+        await asyncio.wait_for(started.wait(), timeout=30)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Обработчик сообщения не переживает отмененный вызов
+        assert handler_cancelled == ["progress"]
+        # Единственный процесс пула освободился
+        assert await asyncio.wait_for(pool.run("next", report_and_return, 1), timeout=30) == 2
+    finally:
+        await pool.stop()
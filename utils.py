@@ -5,6 +5,7 @@ import time
 import logging
 import asyncio
 import threading
+from enum import Enum
 from datetime import datetime
 from typing import Dict, Any, Optional, List, Tuple, Union, Callable
 import yt_dlp
@@ -14,6 +15,9 @@ import aiofiles
 from state_storage import StateStorage, state_storage
 import aiohttp
 from urllib.parse import urlparse
+from process_runner import run_process, capture_output
+from progress_bus import progress_bus, TERMINAL_STATUSES
+from progress_reporter import ProgressReporter
 
 # Глобальные переменные для состояния
 _app: Optional[FastAPI] = None
@@ -41,8 +45,7 @@ async def update_download_status(
     try:
         from app import app
 
-        # Добавляем логирование для отладки
-        logging.info(f"[UPDATE] Updating status for {download_id}: status={status}, progress={progress}")
+        logging.debug(f"[UPDATE] Updating status for {download_id}: status={status}, progress={progress}")
 
         # Обновляем состояние
         state = await app.state.storage.get_item(download_id)
@@ -53,20 +56,45 @@ async def update_download_status(
                 state['progress'] = progress
                 # Логируем изменение прогресса
                 if old_progress != progress:
-                    logging.info(f"[UPDATE] Progress changed for {download_id}: {old_progress} -> {progress}")
+                    logging.debug(f"[UPDATE] Progress changed for {download_id}: {old_progress} -> {progress}")
             if error:
                 state['error'] = error
             state['updated_at'] = time.time()
 
+            # Итоговое состояние не должны перезаписать накопленные события прогресса
+            status_value = status.value if isinstance(status, Enum) else status
+            persister = getattr(app.state, 'progress_persister', None)
+            if persister is not None and status_value in TERMINAL_STATUSES:
+                await persister.finish(download_id)
+
             # Сохраняем обновленное состояние
             await app.state.storage.update_item(download_id, state)
-            logging.info(f"[UPDATE] State updated for {download_id}: {state}")
+            logging.debug(f"[UPDATE] State updated for {download_id}: {state}")
+
+            # Сообщаем подписчикам шины (состояние уже записано в хранилище)
+            update = {"status": status_value}
+            if progress is not None:
+                update["progress"] = progress
+            if error:
+                update["error"] = error
+            progress_bus.publish(download_id, update, persist=False)
         else:
             logging.warning(f"[UPDATE] State not found for {download_id}")
 
     except Exception as e:
         logging.error(f"[UPDATE] Error updating status for {download_id}: {str(e)}")
 
+async def _emit_download_status(download_id: str, update: Dict[str, Any]) -> None:
+    await update_download_status(
+        download_id,
+        update["status"],
+        progress=update.get("progress"),
+        error=update.get("error")
+    )
+
+# Прореживает обновления прогресса из хуков yt-dlp и потоковых загрузок
+status_reporter = ProgressReporter(_emit_download_status)
+
 def update_download_state_sync(download_id: str, state: Dict[str, Any]):
     """Синхронно обновить состояние загрузки"""
     try:
@@ -93,6 +121,39 @@ def update_download_state_sync(download_id: str, state: Dict[str, Any]):
     except Exception as e:
         logging.error(f"[STATE] Error updating state for {download_id}: {str(e)}", exc_info=True)
 
+_DOWNLOAD_LINE = re.compile(
+    r"\[download\]\s+(?P<progress>\d+(?:\.\d+)?)%"
+    r"(?:.*?\s+at\s+(?P<speed>\d+(?:\.\d+)?)(?P<unit>[KMGT]?i?B)/s)?"
+    r"(?:.*?\s+ETA\s+(?P<eta>(?:\d+:)?\d+:\d+))?"
+)
+_SIZE_UNITS = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4,
+               "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+
+def parse_download_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбирает строку прогресса yt-dlp вида
+    "[download]  45.3% of 10.00MiB at  1.23MiB/s ETA 00:05"
+
+    Args:
+        line: Строка вывода yt-dlp
+
+    Returns:
+        Optional[Dict[str, Any]]: progress (%), speed (байт/с) и eta (секунды) или None
+    """
+    match = _DOWNLOAD_LINE.search(line)
+    if not match:
+        return None
+
+    result: Dict[str, Any] = {"progress": float(match.group("progress"))}
+    if match.group("speed"):
+        result["speed"] = float(match.group("speed")) * _SIZE_UNITS.get(match.group("unit"), 1)
+    if match.group("eta"):
+        seconds = 0
+        for part in match.group("eta").split(":"):
+            seconds = seconds * 60 + int(part)
+        result["eta"] = seconds
+    return result
+
 def is_loom_url(url: str) -> bool:
     """
     Проверяет, является ли URL ссылкой на Loom
@@ -228,7 +289,9 @@ async def get_safe_ydl_opts(
         Dict[str, Any]: Словарь с опциями
     """
     try:
-        async def progress_hook(d):
+        status_reporter.bind_loop(asyncio.get_running_loop())
+
+        def progress_hook(d):
             if not download_id:
                 return
 
@@ -238,11 +301,11 @@ async def get_safe_ydl_opts(
                     total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
                     downloaded = d.get('downloaded_bytes', 0)
                     progress = (downloaded / total * 100) if total else 0
-                    await update_download_status(download_id=download_id, status="downloading", progress=progress)
+                    status_reporter.report_threadsafe(download_id, "downloading", progress)
                 elif status == 'finished':
-                    await update_download_status(download_id=download_id, status="completed", progress=100)
+                    status_reporter.report_threadsafe(download_id, "completed", 100)
                 elif status == 'error':
-                    await update_download_status(download_id=download_id, status="error", error=str(d.get('error')))
+                    status_reporter.report_threadsafe(download_id, "error", error=str(d.get('error')))
             except Exception as e:
                 logging.error(f"[YDL] Progress hook error: {str(e)}", exc_info=True)
 
@@ -251,7 +314,12 @@ async def get_safe_ydl_opts(
             'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
             'merge_output_format': 'mp4',
             'outtmpl': output_file or '%(title)s.%(ext)s',
-            'progress_hooks': [lambda d: asyncio.create_task(progress_hook(d))],
+            # yt-dlp может выполняться в отдельном потоке, поэтому хук передает
+            # обновление в цикл событий потокобезопасно
+            'progress_hooks': [progress_hook],
+            # Время изменения файла - время завершения загрузки, а не Last-Modified источника
+            # (по нему очистка и вытеснение определяют давно использованные файлы)
+            'updatetime': False,
 
             # Настройки для обхода ограничений
             'nocheckcertificate': True,
@@ -416,8 +484,9 @@ async def download_with_requests(url: str, output_path: str, download_id: str) -
                         downloaded += len(chunk)
 
                         if total_size:
-                            progress = (downloaded / total_size) * 100
-                            await update_download_status(download_id, "downloading", progress=progress)
+                            status_reporter.report(download_id, "downloading", (downloaded / total_size) * 100)
+
+        await status_reporter.flush(download_id)
 
         logging.info(f"[REQUESTS] Загрузка {url} завершена")
         return output_path
@@ -425,19 +494,49 @@ async def download_with_requests(url: str, output_path: str, download_id: str) -
     except aiohttp.ClientError as e:
         error_msg = f"Ошибка сети: {str(e)}"
         logging.error(f"[REQUESTS] {error_msg}")
-        await update_download_status(download_id, "error", error=error_msg)
+        status_reporter.report(download_id, "error", error=error_msg)
+        await status_reporter.flush(download_id)
         return None
 
     except IOError as e:
         error_msg = f"Ошибка записи файла: {str(e)}"
         logging.error(f"[REQUESTS] {error_msg}")
-        await update_download_status(download_id, "error", error=error_msg)
+        status_reporter.report(download_id, "error", error=error_msg)
+        await status_reporter.flush(download_id)
         return None
 
     except Exception as e:
         error_msg = f"Неожиданная ошибка: {str(e)}"
         logging.error(f"[REQUESTS] {error_msg}")
-        await update_download_status(download_id, "error", error=error_msg)
+        status_reporter.report(download_id, "error", error=error_msg)
+        await status_reporter.flush(download_id)
+        return None
+
+async def check_audio_stream(path: str) -> Optional[bool]:
+    """
+    Проверяет с помощью ffprobe, что файл содержит аудиодорожку
+
+    Args:
+        path: Путь к видеофайлу
+
+    Returns:
+        Optional[bool]: True, если аудиодорожка есть; None при ошибке проверки
+    """
+    try:
+        output = await capture_output([
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_type',
+            '-of', 'csv=p=0',
+            path
+        ], timeout=30)
+        if 'audio' not in output:
+            logging.warning(f"[LOOM] Файл {path} не содержит аудиодорожку!")
+            return False
+        return True
+    except Exception as e:
+        logging.error(f"[LOOM] Ошибка при проверке аудиодорожки: {str(e)}")
         return None
 
 async def download_loom_video(url: str, output_path: str, download_id: str) -> Optional[str]:
@@ -466,87 +565,10 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
         # Используем yt-dlp для скачивания видео
         logging.info(f"[LOOM] Используем yt-dlp для скачивания {url}")
 
-        # Создаем прогресс-хук для отслеживания прогресса
-        progress_file = os.path.join(os.path.dirname(output_path), f"{download_id}_progress.txt")
-
-        # Создаем файл для отслеживания прогресса
-        with open(progress_file, 'w') as f:
-            f.write('0')
-
-        # Запускаем отдельный поток для обновления прогресса
-        async def update_progress_task():
-            try:
-                last_progress = 0
-                last_update_time = time.time()
-                no_progress_counter = 0
-
-                # Сразу устанавливаем начальный прогресс
-                await update_download_status(download_id, "downloading", progress=1)
-                logging.info(f"[LOOM] Установлен начальный прогресс 1% для {download_id}")
-
-                # Имитируем начальный прогресс
-                for initial_progress in range(2, 10, 2):
-                    await asyncio.sleep(1)
-                    await update_download_status(download_id, "downloading", progress=initial_progress)
-                    logging.info(f"[LOOM] Имитация начального прогресса: {initial_progress}% для {download_id}")
-
-                while True:
-                    try:
-                        # Проверяем, существует ли файл прогресса
-                        if not os.path.exists(progress_file):
-                            logging.info(f"[LOOM] Файл прогресса не найден, завершаем задачу")
-                            break
-
-                        # Читаем текущий прогресс из файла
-                        with open(progress_file, 'r') as f:
-                            progress_str = f.read().strip()
-
-                        if progress_str and progress_str.isdigit():
-                            current_progress = int(progress_str)
-
-                            # Если прогресс изменился или прошло больше 1 секунды с момента последнего обновления
-                            current_time = time.time()
-                            if current_progress != last_progress or (current_time - last_update_time) > 1:
-                                logging.info(f"[LOOM] Обновляем прогресс: {current_progress}% для {download_id}")
-                                await update_download_status(download_id, "downloading", progress=current_progress)
-                                last_progress = current_progress
-                                last_update_time = current_time
-                                no_progress_counter = 0
-                            else:
-                                no_progress_counter += 1
-                        else:
-                            logging.warning(f"[LOOM] Некорректный формат прогресса в файле: '{progress_str}'")
-                            no_progress_counter += 1
-
-                        # Если прогресс достиг 100%, завершаем задачу
-                        if last_progress >= 100:
-                            logging.info(f"[LOOM] Прогресс достиг 100%, завершаем задачу")
-                            break
-
-                        # Вместо имитации прогресса, логируем отсутствие изменений
-                        if no_progress_counter > 3 and last_progress < 90:  # Если нет прогресса в течение 3 циклов
-                            logging.info(f"[LOOM] Нет изменений в прогрессе: {last_progress}% для {download_id} в течение {no_progress_counter} циклов")
-                            # Не имитируем прогресс, а просто увеличиваем счетчик
-                            no_progress_counter += 1
-
-                        # Ждем небольшую паузу перед следующей проверкой
-                        await asyncio.sleep(0.3)  # Уменьшаем интервал проверки до 0.3 секунд
-                    except Exception as e:
-                        logging.error(f"[LOOM] Ошибка при обновлении прогресса: {str(e)}")
-                        await asyncio.sleep(1)
-            except Exception as e:
-                logging.error(f"[LOOM] Ошибка в задаче обновления прогресса: {str(e)}")
-            finally:
-                # Удаляем файл прогресса при завершении
-                if os.path.exists(progress_file):
-                    try:
-                        os.remove(progress_file)
-                    except:
-                        pass
-
-        # Запускаем задачу обновления прогресса
-        logging.info(f"[LOOM] Запуск задачи обновления прогресса для {download_id}")
-        progress_task = asyncio.create_task(update_progress_task())
+        # Прогресс публикуется в шину: хук yt-dlp вызывается в цикле событий,
+        # так как ydl.download выполняется в этой корутине
+        def publish_progress(progress: int):
+            progress_bus.publish(download_id, {"status": "downloading", "progress": progress})
 
         def progress_hook(d):
             try:
@@ -562,12 +584,7 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                     fragment_count = d.get('fragment_count', 0)
 
                     # Получаем информацию о текущем прогрессе
-                    try:
-                        with open(progress_file, 'r') as f:
-                            current_progress_str = f.read().strip()
-                            current_progress = int(current_progress_str) if current_progress_str.isdigit() else 0
-                    except Exception:
-                        current_progress = 0
+                    current_progress = int((progress_bus.get_last(download_id) or {}).get("progress") or 0)
 
                     # Вычисляем прогресс на основе фрагментов, если они доступны
                     if fragment_count > 0:
@@ -578,8 +595,7 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
 
                         # Обновляем прогресс всегда, чтобы отражать реальный прогресс
                         logging.info(f"[LOOM] Fragment progress: {fragment_progress}% ({fragment_index}/{fragment_count})")
-                        with open(progress_file, 'w') as f:
-                            f.write(str(fragment_progress))
+                        publish_progress(fragment_progress)
                     elif total > 0:
                         # Используем стандартный метод, если фрагменты недоступны
                         # Распределяем прогресс от 5% до 90%
@@ -588,21 +604,18 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
 
                         # Обновляем прогресс всегда, чтобы отражать реальный прогресс
                         logging.info(f"[LOOM] Bytes progress: {bytes_progress}% ({downloaded}/{total})")
-                        with open(progress_file, 'w') as f:
-                            f.write(str(bytes_progress))
+                        publish_progress(bytes_progress)
                     else:
                         # Если нет информации о прогрессе, используем имитацию прогресса
                         # Увеличиваем прогресс на небольшую величину
                         new_progress = min(90, current_progress + 1)
                         logging.info(f"[LOOM] Simulated progress: {new_progress}%")
-                        with open(progress_file, 'w') as f:
-                            f.write(str(new_progress))
+                        publish_progress(new_progress)
 
                 elif d['status'] == 'finished':
                     # Записываем 95% прогресса при завершении загрузки
                     # Оставляем 5% на постобработку (объединение аудио и видео)
-                    with open(progress_file, 'w') as f:
-                        f.write('95')
+                    publish_progress(95)
                     logging.info(f"[LOOM] yt-dlp завершил загрузку, начинается объединение дорожек")
             except Exception as e:
                 logging.error(f"[LOOM] Ошибка в progress_hook: {str(e)}")
@@ -653,35 +666,10 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                 await asyncio.sleep(5)  # Увеличиваем задержку до 5 секунд
 
                 # Проверяем, что файл содержит аудиодорожку с помощью ffprobe
-                try:
-                    import subprocess
-                    cmd = [
-                        'ffprobe',
-                        '-v', 'error',
-                        '-select_streams', 'a:0',
-                        '-show_entries', 'stream=codec_type',
-                        '-of', 'csv=p=0',
-                        output_path
-                    ]
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    if 'audio' not in result.stdout:
-                        logging.warning(f"[LOOM] Файл {output_path} не содержит аудиодорожку!")
-                except Exception as e:
-                    logging.error(f"[LOOM] Ошибка при проверке аудиодорожки: {str(e)}")
+                await check_audio_stream(output_path)
 
                 # Записываем 100% прогресса при завершении
-                with open(progress_file, 'w') as f:
-                    f.write('100')
-
-                # Добавляем еще небольшую задержку перед завершением
-                await asyncio.sleep(1)
-
-                # Ждем завершения задачи обновления прогресса
-                try:
-                    await asyncio.wait_for(progress_task, timeout=5.0)
-                except asyncio.TimeoutError:
-                    # Если задача не завершилась вовремя, обновляем статус напрямую
-                    await update_download_status(download_id, "completed", progress=100)
+                await update_download_status(download_id, "completed", progress=100)
 
                 logging.info(f"[LOOM] Загрузка завершена: {output_path}")
                 return output_path
@@ -693,7 +681,6 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                 logging.info(f"[LOOM] Пробуем альтернативный метод с subprocess")
 
                 try:
-                    import subprocess
                     cmd = [
                         'yt-dlp',
                         '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best',  # Явно указываем форматы видео и аудио
@@ -701,6 +688,7 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                         '--no-warnings',
                         '--retries', '10',
                         '--fragment-retries', '10',
+                        '--no-mtime',
                         '--merge-output-format', 'mp4',
                         '--embed-subs',
                         '--embed-metadata',
@@ -710,8 +698,8 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                         url
                     ]
 
-                    # Запускаем команду
-                    subprocess.run(cmd, check=True, timeout=300)
+                    # Запускаем команду, не блокируя цикл событий
+                    await run_process(cmd, check=True, timeout=300)
 
                     # Проверяем, что файл существует
                     if not os.path.exists(output_path):
@@ -722,34 +710,10 @@ async def download_loom_video(url: str, output_path: str, download_id: str) -> O
                     await asyncio.sleep(5)  # Увеличиваем задержку до 5 секунд
 
                     # Проверяем, что файл содержит аудиодорожку с помощью ffprobe
-                    try:
-                        cmd = [
-                            'ffprobe',
-                            '-v', 'error',
-                            '-select_streams', 'a:0',
-                            '-show_entries', 'stream=codec_type',
-                            '-of', 'csv=p=0',
-                            output_path
-                        ]
-                        result = subprocess.run(cmd, capture_output=True, text=True)
-                        if 'audio' not in result.stdout:
-                            logging.warning(f"[LOOM] Файл {output_path} не содержит аудиодорожку!")
-                    except Exception as e:
-                        logging.error(f"[LOOM] Ошибка при проверке аудиодорожки: {str(e)}")
+                    await check_audio_stream(output_path)
 
                     # Записываем 100% прогресса при завершении
-                    with open(progress_file, 'w') as f:
-                        f.write('100')
-
-                    # Добавляем еще небольшую задержку перед завершением
-                    await asyncio.sleep(1)
-
-                    # Ждем завершения задачи обновления прогресса
-                    try:
-                        await asyncio.wait_for(progress_task, timeout=5.0)
-                    except asyncio.TimeoutError:
-                        # Если задача не завершилась вовремя, обновляем статус напрямую
-                        await update_download_status(download_id, "completed", progress=100)
+                    await update_download_status(download_id, "completed", progress=100)
 
                     logging.info(f"[LOOM] Загрузка завершена с использованием subprocess: {output_path}")
                     return output_path
@@ -0,0 +1,301 @@
+"""
+Выполнение yt-dlp в пуле процессов.
+
+YoutubeDL.extract_info работает синхронно минуты подряд и держит GIL, поэтому
+загрузки выполняются в отдельных процессах (ProcessPoolExecutor, контекст
+spawn). Прогресс и события постобработки передаются обратно в цикл событий
+через очередь multiprocessing.Manager и читаются одним фоновым потоком.
+
+Опции yt-dlp передаются в дочерний процесс через pickle: хуки и логгер из
+них удаляются, их заменяет канал ProgressChannel.
+
+Future дочернего процесса нельзя отменить, пока функция выполняется, поэтому
+при отмене задачи run выставляет в канале флаг остановки: хуки yt-dlp в
+дочернем процессе прерывают загрузку на ближайшем событии прогресса и
+освобождают процесс пула. Извлечение информации флаг проверяет только
+перед началом.
+
+Информация о видео, полученная заранее (extract_info), передается в
+загрузку очищенной через YoutubeDL.sanitize_info и обрабатывается
+process_ie_result без повторного извлечения, как при --load-info-json.
+Очистка удаляет entries, поэтому так загружаются только отдельные видео
+(_type "video"); плейлисты и ссылки загружаются с полным извлечением.
+"""
+
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# Опции, которые не передаются в дочерний процесс
+UNPICKLABLE_OPTS = ("progress_hooks", "postprocessor_hooks", "logger")
+
+# Поля события прогресса yt-dlp, которые пересылаются в основной процесс
+PROGRESS_FIELDS = ("status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta", "filename")
+
+MessageHandler = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+class ProgressChannel:
+    """Канал сообщений из дочернего процесса в основной (передается через pickle)"""
+
+    def __init__(self, job_id: str, queue, gate, stop):
+        self.job_id = job_id
+        self._queue = queue
+        self._gate = gate
+        self._stop = stop
+
+    def send(self, kind: str, payload: Optional[Dict[str, Any]] = None):
+        """Отправляет сообщение обработчику задачи в основном процессе"""
+        self._queue.put((self.job_id, kind, payload or {}))
+
+    def wait(self):
+        """Ждет разрешения основного процесса (например, свободного слота стадии)"""
+        self._gate.wait()
+
+    def stopped(self) -> bool:
+        """Отменена ли задача в основном процессе"""
+        return self._stop.is_set()
+
+def _run_extract(channel: ProgressChannel, url: str, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Извлекает информацию о видео без выбора форматов и загрузки
+
+    Флаг остановки проверяется только перед началом: у извлечения нет хуков,
+    поэтому начатое извлечение занимает процесс пула до своего завершения.
+    """
+    from yt_dlp import YoutubeDL
+
+    if channel.stopped():
+        raise RuntimeError("Извлечение информации отменено")
+    try:
+        with YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+            if info is None:
+                raise Exception("Не удалось получить информацию о видео")
+            sanitized = ydl.sanitize_info(info, remove_private_keys=True)
+            # sanitize_info удаляет original_url, а process_ie_result по нему
+            # заполняет поля исходного запроса
+            if info.get("original_url"):
+                sanitized["original_url"] = info["original_url"]
+            return sanitized
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
+
+def _run_download(channel: ProgressChannel, url: str, opts: Dict[str, Any], info: Optional[Dict[str, Any]] = None) -> str:
+    """Загружает видео в дочернем процессе и возвращает путь к файлу"""
+    from yt_dlp import YoutubeDL
+    from yt_dlp.utils import DownloadCancelled
+
+    def progress_hook(d):
+        if channel.stopped():
+            raise DownloadCancelled("Загрузка отменена")
+        channel.send("progress", {field: d.get(field) for field in PROGRESS_FIELDS})
+
+    def postprocessor_hook(d):
+        if d.get("status") == "started":
+            # Постобработка ждет, пока основной процесс выдаст слот процессорной стадии
+            channel.send("postprocess", {"postprocessor": d.get("postprocessor")})
+            channel.wait()
+            if channel.stopped():
+                raise DownloadCancelled("Загрузка отменена")
+
+    opts = dict(opts, progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook])
+    try:
+        with YoutubeDL(opts) as ydl:
+            if info is not None:
+                # Информация уже извлечена: выбираем форматы и загружаем без повторного запроса страницы
+                info = ydl.process_ie_result(info, download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+            if info is None:
+                raise Exception("Не удалось получить информацию о видео")
+            return ydl.prepare_filename(info)
+    except Exception as e:
+        # Исключения yt-dlp не всегда восстанавливаются из pickle
+        raise RuntimeError(str(e)) from None
+
+class YdlProcessPool:
+    """Пул процессов для загрузок yt-dlp"""
+
+    def __init__(self, max_workers: int = 2):
+        """
+        Args:
+            max_workers: Количество процессов
+        """
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._messages = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handlers: Dict[str, MessageHandler] = {}
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}  # Выполняющиеся обработчики сообщений задач
+
+    @property
+    def running(self) -> bool:
+        """Запущен ли пул"""
+        return self._executor is not None
+
+    async def start(self):
+        """Запускает пул процессов и поток чтения сообщений"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context("spawn")
+
+        def _start():
+            self._manager = context.Manager()
+            self._messages = self._manager.Queue()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+        await asyncio.to_thread(_start)
+        self._reader = threading.Thread(target=self._read_messages, name="ydl-progress", daemon=True)
+        self._reader.start()
+        logging.info(f"[YDL] Запущен пул процессов yt-dlp: {self.max_workers}")
+
+    async def stop(self):
+        """Останавливает пул, незавершенные загрузки прерываются"""
+        if not self.running:
+            return
+        executor, self._executor = self._executor, None
+
+        def _stop():
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._messages.put(None)
+            self._reader.join(timeout=5)
+            self._manager.shutdown()
+
+        await asyncio.to_thread(_stop)
+        self._handlers.clear()
+        logging.info("[YDL] Пул процессов yt-dlp остановлен")
+
+    def _read_messages(self):
+        """Читает сообщения дочерних процессов и передает их в цикл событий"""
+        while True:
+            try:
+                message = self._messages.get()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+            job_id, kind, payload = message
+            handler = self._handlers.get(job_id)
+            if handler is None:
+                continue
+            self._loop.call_soon_threadsafe(self._dispatch, job_id, handler, kind, payload)
+
+    def _dispatch(self, job_id: str, handler: MessageHandler, kind: str, payload: Dict[str, Any]):
+        # Задача могла завершиться, пока сообщение передавалось в цикл событий
+        if self._handlers.get(job_id) is not handler:
+            return
+        task = asyncio.ensure_future(handler(kind, payload))
+        tasks = self._tasks.setdefault(job_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        task.add_done_callback(self._log_handler_error)
+
+    @staticmethod
+    def _log_handler_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"[YDL] Ошибка в обработчике сообщения: {task.exception()}")
+
+    async def run(self, job_id: str, func: Callable[..., Any], *args, on_message: Optional[MessageHandler] = None) -> Any:
+        """
+        Выполняет func(channel, *args) в дочернем процессе
+
+        Args:
+            job_id: Идентификатор задачи
+            func: Функция уровня модуля (передается через pickle)
+            *args: Аргументы функции
+            on_message: Корутина для сообщений канала: on_message(kind, payload).
+                После обработки сообщения "postprocess" дочерний процесс продолжает работу.
+                При отмене вызова канал отмечается остановленным (см. ProgressChannel.stopped),
+                а незавершенные обработчики сообщений отменяются.
+
+        Returns:
+            Any: Результат func
+        """
+        if not self.running:
+            await self.start()
+
+        gate, stop = await asyncio.to_thread(lambda: (self._manager.Event(), self._manager.Event()))
+        channel = ProgressChannel(job_id, self._messages, gate, stop)
+
+        async def handle(kind: str, payload: Dict[str, Any]):
+            try:
+                if on_message is not None:
+                    await on_message(kind, payload)
+            finally:
+                if kind == "postprocess":
+                    await asyncio.to_thread(gate.set)
+
+        self._handlers[job_id] = handle
+        finished = False
+        try:
+            result = await self._loop.run_in_executor(self._executor, func, channel, *args)
+            finished = True
+            return result
+        except asyncio.CancelledError:
+            # Дочерний процесс прерывает загрузку сам, ожидающая постобработка отпускается.
+            # Флаги выставляются через Manager (блокирующий вызов), поэтому вне цикла событий
+            def release():
+                stop.set()
+                gate.set()
+
+            try:
+                await asyncio.shield(asyncio.to_thread(release))
+            except Exception as e:
+                logging.error(f"[YDL] Не удалось остановить задачу {job_id}: {str(e)}")
+            logging.info(f"[YDL] Задача {job_id} отменена, дочерний процесс остановит загрузку")
+            raise
+        finally:
+            self._handlers.pop(job_id, None)
+            # Обработчики не должны пережить вызов: иначе, например, слот стадии,
+            # полученный после завершения задачи, никто не освободит
+            tasks = self._tasks.pop(job_id, set())
+            if not finished:
+                for task in tasks:
+                    task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def download(
+        self,
+        job_id: str,
+        url: str,
+        opts: Dict[str, Any],
+        on_message: Optional[MessageHandler] = None,
+        info: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Загружает видео через yt-dlp в дочернем процессе
+
+        Args:
+            job_id: ID загрузки
+            url: URL видео
+            opts: Опции yt-dlp (хуки и логгер отбрасываются)
+            on_message: Обработчик сообщений "progress" и "postprocess"
+            info: Информация об отдельном видео из extract_info; загрузка начинается без повторного извлечения
+
+        Returns:
+            str: Путь к загруженному файлу
+        """
+        opts = {key: value for key, value in opts.items() if key not in UNPICKLABLE_OPTS}
+        return await self.run(job_id, _run_download, url, opts, info, on_message=on_message)
+
+    async def extract_info(self, job_id: str, url: str, opts: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Извлекает информацию о видео в дочернем процессе
+
+        Args:
+            job_id: Идентификатор задачи
+            url: URL видео
+            opts: Опции yt-dlp (хуки и логгер отбрасываются)
+
+        Returns:
+            Dict[str, Any]: Информация о видео (без выбора форматов), пригодная для download(info=...)
+        """
+        opts = {key: value for key, value in opts.items() if key not in UNPICKLABLE_OPTS}
+        return await self.run(job_id, _run_extract, url, opts)